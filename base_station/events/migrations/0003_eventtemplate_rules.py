@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-17 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0002_auto_20160324_0525'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eventtemplate',
+            name='finish_condition',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'First to complete the lap count'), (1, 'Time limit'), (2, 'Lap count or time limit, whichever comes first')], default=0, verbose_name='Finish condition'),
+        ),
+        migrations.AddField(
+            model_name='eventtemplate',
+            name='lap_count',
+            field=models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Lap count'),
+        ),
+        migrations.AddField(
+            model_name='eventtemplate',
+            name='min_lap_time',
+            field=models.DurationField(blank=True, null=True, verbose_name='Minimum lap time'),
+        ),
+        migrations.AddField(
+            model_name='eventtemplate',
+            name='start_type',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Flying start'), (1, 'Grid start')], default=0, verbose_name='Start type'),
+        ),
+        migrations.AddField(
+            model_name='eventtemplate',
+            name='time_limit',
+            field=models.DurationField(blank=True, null=True, verbose_name='Time limit'),
+        ),
+        migrations.AddField(
+            model_name='historicaleventtemplate',
+            name='finish_condition',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'First to complete the lap count'), (1, 'Time limit'), (2, 'Lap count or time limit, whichever comes first')], default=0, verbose_name='Finish condition'),
+        ),
+        migrations.AddField(
+            model_name='historicaleventtemplate',
+            name='lap_count',
+            field=models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Lap count'),
+        ),
+        migrations.AddField(
+            model_name='historicaleventtemplate',
+            name='min_lap_time',
+            field=models.DurationField(blank=True, null=True, verbose_name='Minimum lap time'),
+        ),
+        migrations.AddField(
+            model_name='historicaleventtemplate',
+            name='start_type',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Flying start'), (1, 'Grid start')], default=0, verbose_name='Start type'),
+        ),
+        migrations.AddField(
+            model_name='historicaleventtemplate',
+            name='time_limit',
+            field=models.DurationField(blank=True, null=True, verbose_name='Time limit'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-17 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0003_eventtemplate_rules'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicaltimer',
+            name='action',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Notify'), (1, 'Start the race'), (2, 'End the heat')], default=0, verbose_name='Action'),
+        ),
+        migrations.AddField(
+            model_name='timer',
+            name='action',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Notify'), (1, 'Start the race'), (2, 'End the heat')], default=0, verbose_name='Action'),
+        ),
+    ]
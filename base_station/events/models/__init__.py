@@ -1,4 +1,4 @@
 # -*- coding: utf-8 -*-
 from .events import Event, Occurrence  # noqa
 from .meta import Location  # noqa
-from .templates import EventTemplate  # noqa
+from .templates import EventTemplate, Timer  # noqa
@@ -1,3 +1,4 @@
+from catalog import Catalog
 from django.db import models
 from django.utils.translation import ugettext_lazy as _
 from django_extensions.db.fields import (
@@ -16,13 +17,38 @@ from base_station.utils.models import SyncModel
 class EventTemplate(SyncModel, TimeStampedModel):
     """
     Dictates the logic that is used when running a race.
+
+    The rules are compiled once per heat into the state machine that runs
+    it, see ``races.rules``.
     """
 
+    class START_TYPES(Catalog):
+        _attrs = ("value", "label")
+        # the first gate pass of each racer starts its first lap
+        flying = (0, _("Flying start"))
+        # every racer's first lap starts when the heat starts
+        grid = (1, _("Grid start"))
+
+    class FINISH_CONDITIONS(Catalog):
+        _attrs = ("value", "label")
+        laps = (0, _("First to complete the lap count"))
+        time = (1, _("Time limit"))
+        laps_or_time = (2, _("Lap count or time limit, whichever comes first"))
+
     name = models.CharField(_("name"), max_length=255, default="")
     slug = AutoSlugField(_("slug"), populate_from="name")
     creator = models.ForeignKey("users.User", blank=True, null=True)
     # May have to store creator details in non FK way due to future sync issues?
 
+    lap_count = models.PositiveSmallIntegerField(_("Lap count"), blank=True, null=True)
+    time_limit = models.DurationField(_("Time limit"), blank=True, null=True)
+    # laps faster than this don't count, e.g. a racer cutting the track
+    min_lap_time = models.DurationField(_("Minimum lap time"), blank=True, null=True)
+    start_type = models.PositiveSmallIntegerField(
+        _("Start type"), choices=START_TYPES._zip("value", "label"), default=START_TYPES.flying.value)
+    finish_condition = models.PositiveSmallIntegerField(
+        _("Finish condition"), choices=FINISH_CONDITIONS._zip("value", "label"), default=FINISH_CONDITIONS.laps.value)
+
     history = HistoricalRecords()
 
     def __str__(self):
@@ -32,12 +58,24 @@ class EventTemplate(SyncModel, TimeStampedModel):
 class Timer(SyncModel):
     """
     Timer model to hold different designated times to trigger events
+
+    ``duration`` is counted from the heat starting, start timers count from
+    the heat's scheduled time instead, see ``races.scheduler``.
     """
 
+    class ACTIONS(Catalog):
+        _attrs = ("value", "label")
+        # only tell everyone following the heat
+        notify = (0, _("Notify"))
+        start = (1, _("Start the race"))
+        end = (2, _("End the heat"))
+
     name = models.CharField(_("name"), max_length=255)
     slug = AutoSlugField(_("slug"), populate_from="name")
     duration = models.DurationField()
     tempalte = models.ForeignKey(EventTemplate)
+    action = models.PositiveSmallIntegerField(
+        _("Action"), choices=ACTIONS._zip("value", "label"), default=ACTIONS.notify.value)
 
     history = HistoricalRecords()
 
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from base_station.races.models import RaceHeat, HeatEvent
+from base_station.races.models import RaceHeat, HeatEvent, Lap
 
 
 class RaceHeatAdmin(admin.ModelAdmin):
@@ -24,14 +24,28 @@ class HeatEventAdmin(admin.ModelAdmin):
     model = HeatEvent
     fieldsets = (
         ('', {
-            'fields': ('heat', 'tracker', 'trigger', 'created', 'modified')
+            'fields': ('heat', 'tracker', 'trigger', 'triggered_time', 'created', 'modified')
         }),
     )
-    list_display = ('heat', 'tracker', 'trigger')
+    list_display = ('heat', 'tracker', 'trigger', 'triggered_time')
     search_fields = ('heat',)
     list_filter = ('trigger',)
     readonly_fields = ('created', 'modified',)
 
 
+class LapAdmin(admin.ModelAdmin):
+    model = Lap
+    fieldsets = (
+        ('', {
+            'fields': ('heat', 'tracker', 'number', 'start', 'end', 'duration', 'valid', 'created', 'modified')
+        }),
+    )
+    list_display = ('heat', 'tracker', 'number', 'duration', 'valid')
+    search_fields = ('heat',)
+    list_filter = ('valid',)
+    readonly_fields = ('created', 'modified',)
+
+
 admin.site.register(RaceHeat, RaceHeatAdmin)
 admin.site.register(HeatEvent, HeatEventAdmin)
+admin.site.register(Lap, LapAdmin)
@@ -0,0 +1,87 @@
+"""
+Running order of the trackers in a heat.
+
+Trackers are ranked by laps completed, most first, then by the time their
+last lap was completed, earliest first. Trackers that haven't completed a
+lap keep the order they entered the heat in. The order is a list of sort
+keys kept sorted with ``bisect``. Finding a tracker's old and new key is
+O(log n) but taking the old one out and putting the new one in shifts the
+keys after them, so an update is O(n), ranking a tracker stays O(log n).
+A heat is a field of a handful of racers, where that is a short memmove
+and cheaper than keeping an order statistics tree balanced.
+"""
+
+from bisect import bisect_left, insort
+from datetime import timedelta
+
+
+# Sorts trackers without a completed lap by the order they entered in
+NO_TIME = timedelta.max
+
+
+class Leaderboard(object):
+
+    def __init__(self):
+        # (-laps, total, entered, tracker id) in running order
+        self.keys = []
+        self.by_tracker = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self):
+        """
+        Tracker ids in running order.
+        """
+        return (key[-1] for key in self.keys)
+
+    def __contains__(self, tracker_id):
+        return tracker_id in self.by_tracker
+
+    def update(self, tracker_id, laps=0, total=None):
+        """
+        Place ``tracker_id`` by its ``laps`` and ``total`` time, returning its rank.
+        """
+        old = self.by_tracker.get(tracker_id)
+        if old is not None:
+            del self.keys[bisect_left(self.keys, old)]
+            entered = old[2]
+        else:
+            entered = len(self.by_tracker)
+        key = self.by_tracker[tracker_id] = (-laps, NO_TIME if total is None else total, entered, tracker_id)
+        insort(self.keys, key)
+        return self.rank(tracker_id)
+
+    def rank(self, tracker_id):
+        """
+        1 for the leader.
+        """
+        return bisect_left(self.keys, self.by_tracker[tracker_id]) + 1
+
+    def leader(self):
+        return self.keys[0][-1] if self.keys else None
+
+    def ahead(self, tracker_id):
+        """
+        The tracker placed directly ahead of ``tracker_id``, None for the leader.
+        """
+        index = bisect_left(self.keys, self.by_tracker[tracker_id])
+        return self.keys[index - 1][-1] if index else None
+
+    def gap(self, ahead_id, tracker_id):
+        """
+        Time ``tracker_id`` trails ``ahead_id`` by, None unless both have completed the same number of laps.
+        """
+        if ahead_id is None or ahead_id == tracker_id:
+            return None
+        laps, total = self.by_tracker[tracker_id][:2]
+        ahead_laps, ahead_total = self.by_tracker[ahead_id][:2]
+        if laps != ahead_laps or total is NO_TIME or ahead_total is NO_TIME:
+            return None
+        return total - ahead_total
+
+    def gap_to_leader(self, tracker_id):
+        return self.gap(self.leader(), tracker_id)
+
+    def gap_to_next(self, tracker_id):
+        return self.gap(self.ahead(tracker_id), tracker_id)
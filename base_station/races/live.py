@@ -0,0 +1,253 @@
+"""
+Live state of running heats, kept in memory and updated one HeatEvent at a time.
+
+Screens showing a running heat read its laps, positions and gaps from here
+instead of querying every HeatEvent again. Applying an event only touches
+the state of the tracker that triggered it and its place on the heat's
+Leaderboard. A process that starts while a heat is running rebuilds its
+state by replaying the heat's events from the database.
+
+How triggers are handled follows the rules of the heat's EventTemplate,
+compiled once when the live state is built into a table of handlers by heat
+state and trigger. With a flying start the first gate trigger of each
+tracker is its holeshot and starts lap one, with a grid start lap one starts
+with the heat. Every gate trigger after that completes a lap, and applying
+it returns the Lap for the caller to store.
+"""
+
+import threading
+
+from catalog import Catalog
+
+from .leaderboard import Leaderboard
+from .models import HeatEvent, Lap
+from .rules import HeatRules
+
+
+TRIGGERS = HeatEvent.TRIGGERS
+
+
+class STATES(Catalog):
+    _attrs = ("value", "label")
+    waiting = ("waiting", "Waiting for the start")
+    running = ("running", "Running")
+    # the finish condition was met, every racer finishes as it next crosses the gate
+    finishing = ("finishing", "Finishing")
+    finished = ("finished", "Every racer finished")
+    ended = ("ended", "Ended")
+
+
+class TrackerState(object):
+    """
+    Where a single tracker is in a heat.
+
+    :laps: laps completed that count towards the result.
+    :flown: every lap completed, including those that didn't count.
+    :lap_started: when the lap it is on started, None before its holeshot.
+    :last_lap: and :best_lap: are timedeltas, None until a lap is completed.
+    :total: time from the heat starting to its last completed lap.
+    """
+
+    __slots__ = (
+        'tracker_id', 'laps', 'flown', 'lap_started', 'last_lap', 'best_lap', 'total', 'crashed', 'finished')
+
+    def __init__(self, tracker_id):
+        self.tracker_id = tracker_id
+        self.laps = 0
+        self.flown = 0
+        self.lap_started = None
+        self.last_lap = None
+        self.best_lap = None
+        self.total = None
+        self.crashed = False
+        self.finished = False
+
+    @property
+    def racing(self):
+        return not (self.crashed or self.finished)
+
+
+class LiveHeat(object):
+
+    def __init__(self, heat_id, started_time=None, rules=None):
+        self.heat_id = heat_id
+        self.started_time = started_time
+        self.ended_time = None
+        self.rules = rules or HeatRules()
+        self.state = STATES.running.value if started_time is not None else STATES.waiting.value
+        self.trackers = {}
+        # trackers that haven't crashed or finished
+        self.racing = 0
+        self.leaderboard = Leaderboard()
+        # Triggers without an entry for the state the heat is in are ignored
+        self.transitions = {
+            (STATES.waiting.value, TRIGGERS.started.value): self.on_started,
+            (STATES.running.value, TRIGGERS.started.value): self.on_started,
+            (STATES.running.value, TRIGGERS.gate.value): self.on_gate,
+            (STATES.finishing.value, TRIGGERS.gate.value): self.on_gate,
+        }
+        for state in (STATES.waiting, STATES.running, STATES.finishing):
+            self.transitions[state.value, TRIGGERS.crash.value] = self.on_crash
+        for state in (STATES.waiting, STATES.running, STATES.finishing, STATES.finished):
+            self.transitions[state.value, TRIGGERS.ended.value] = self.on_ended
+
+    @classmethod
+    def from_heat(cls, heat):
+        """
+        Rebuild the live state of a heat from its stored events.
+        """
+        live, laps = cls.replay(heat)
+        return live
+
+    @classmethod
+    def replay(cls, heat):
+        """
+        Rebuild the live state of a heat from its stored events along with
+        the unsaved Laps they completed, triggers after the heat ended are
+        left out.
+        """
+        live = cls(heat.pk, heat.started_time, HeatRules.from_template(heat.event.template))
+        events = heat.triggered_events.order_by('triggered_time', 'created').only(
+            'tracker', 'trigger', 'triggered_time')
+        if heat.ended_time is not None:
+            events = events.filter(triggered_time__lte=heat.ended_time)
+        laps = [lap for lap in map(live.apply, events.iterator()) if lap is not None]
+        if heat.ended_time is not None:
+            live.end(heat.ended_time)
+        return live, laps
+
+    def apply(self, event):
+        """
+        Update the state with ``event``, returning the unsaved Lap it completed if any.
+        """
+        handler = self.transitions.get((self.state, event.trigger))
+        if handler is not None:
+            return handler(event)
+
+    def tracker(self, tracker_id):
+        state = self.trackers.get(tracker_id)
+        if state is None:
+            state = self.trackers[tracker_id] = TrackerState(tracker_id)
+            self.racing += 1
+            self.leaderboard.update(tracker_id)
+        return state
+
+    def on_gate(self, event):
+        if event.tracker_id is None:
+            return None
+        if event.tracker_id not in self.trackers and self.state == STATES.finishing.value:
+            # Too late to join once the race is finishing
+            return None
+        state = self.tracker(event.tracker_id)
+        if not state.racing:
+            return None
+        crossed = event.triggered_time
+        started, state.lap_started = state.lap_started, crossed
+        if started is None:
+            if self.rules.flying_start:
+                return None
+            started = self.started_time
+        lap = crossed - started
+        state.flown += 1
+        valid = self.rules.counts(lap)
+        if valid:
+            self.complete_lap(state, lap, crossed)
+        return Lap(
+            heat_id=self.heat_id, tracker_id=state.tracker_id, number=state.flown,
+            start=started, end=crossed, duration=lap, valid=valid)
+
+    def complete_lap(self, state, lap, crossed):
+        state.laps += 1
+        state.last_lap = lap
+        if state.best_lap is None or lap < state.best_lap:
+            state.best_lap = lap
+        state.total = crossed - self.started_time
+        self.leaderboard.update(state.tracker_id, state.laps, state.total)
+        if self.state == STATES.finishing.value or self.rules.finished(state.laps, state.total):
+            self.state = STATES.finishing.value
+            self.retire(state, finished=True)
+
+    def retire(self, state, finished=False):
+        """
+        Take a tracker out of the race, the heat is finished once no one is racing.
+        """
+        if not state.racing:
+            return
+        if finished:
+            state.finished = True
+        else:
+            state.crashed = True
+        self.racing -= 1
+        if not self.racing and self.state == STATES.finishing.value:
+            self.state = STATES.finished.value
+
+    def on_crash(self, event):
+        if event.tracker_id is not None:
+            self.retire(self.tracker(event.tracker_id))
+
+    def on_started(self, event):
+        self.started_time = event.triggered_time
+        self.state = STATES.running.value
+
+    def on_ended(self, event):
+        self.end(event.triggered_time)
+
+    def end(self, ended_time):
+        self.ended_time = ended_time
+        self.state = STATES.ended.value
+
+    def position(self, tracker_id):
+        return self.leaderboard.rank(tracker_id)
+
+    def standings(self):
+        """
+        Trackers in position order as dicts of plain values, times are in seconds.
+        """
+        leaderboard = self.leaderboard
+        leader = leaderboard.leader()
+        standings = []
+        ahead = None
+        for position, tracker_id in enumerate(leaderboard, 1):
+            state = self.trackers[tracker_id]
+            standings.append({
+                'position': position,
+                'tracker': tracker_id,
+                'laps': state.laps,
+                'last_lap': seconds(state.last_lap),
+                'best_lap': seconds(state.best_lap),
+                'total': seconds(state.total),
+                'crashed': state.crashed,
+                'finished': state.finished,
+                'gap_to_leader': seconds(leaderboard.gap(leader, tracker_id)),
+                'gap_to_next': seconds(leaderboard.gap(ahead, tracker_id)),
+            })
+            ahead = tracker_id
+        return standings
+
+
+def seconds(delta):
+    return delta.total_seconds() if delta is not None else None
+
+
+class LiveHeats(object):
+    """
+    The LiveHeat of every running heat this process has seen an event for.
+    """
+
+    def __init__(self):
+        self.heats = {}
+        self.lock = threading.Lock()
+
+    def get(self, heat):
+        with self.lock:
+            live = self.heats.get(heat.pk)
+            if live is None:
+                live = self.heats[heat.pk] = LiveHeat.from_heat(heat)
+            return live
+
+    def discard(self, heat):
+        with self.lock:
+            self.heats.pop(heat.pk, None)
+
+
+live_heats = LiveHeats()
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from base_station.races.models import Lap, RaceHeat
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the laps of heats from their stored gate triggers."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--heat', action='append', dest='heats', metavar='ID',
+            help="Heat to rebuild, may be given several times. Defaults to every started heat.")
+        parser.add_argument('--event', metavar='ID', help="Rebuild every heat of an event.")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        heats = RaceHeat.objects.filter(started_time__isnull=False)
+        if options['heats']:
+            heats = heats.filter(pk__in=options['heats'])
+        elif options['event']:
+            heats = heats.filter(event=options['event'])
+        heats = list(heats.only('pk'))
+        created = Lap.objects.rebuild(heats)
+        self.stdout.write("Rebuilt {} laps of {} heats in {:.3f}s".format(
+            created, len(heats), time.monotonic() - started))
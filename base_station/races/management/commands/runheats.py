@@ -0,0 +1,51 @@
+import asyncio
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from base_station.races.scheduler import HeatScheduler
+from base_station.utils.layers import cross_process_layer
+
+
+class Command(BaseCommand):
+    help = ("Runs the timers of every running heat's event template, firing start and end triggers "
+            "and broadcasting countdowns and live telemetry to everyone following the heat.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--layer', default=settings.SERIAL_CHANNEL_LAYER,
+            help="Channel layer countdowns and timer notifications are broadcast on.")
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help="Seconds between looking for heats that have started or ended.")
+        parser.add_argument(
+            '--countdown-interval', type=float, default=1.0,
+            help="Seconds between countdown broadcasts before each start and end timer.")
+        parser.add_argument(
+            '--frame-interval', type=float, default=settings.TELEMETRY_FRAME_INTERVAL,
+            help="Seconds between live telemetry broadcasts, 0 to send none.")
+        parser.add_argument(
+            '--frame-seconds', type=float, default=settings.TELEMETRY_FRAME_SECONDS,
+            help="Seconds of each tracker's latest telemetry sent in every broadcast.")
+        parser.add_argument(
+            '--frame-points', type=int, default=settings.TELEMETRY_FRAME_POINTS,
+            help="Most telemetry samples sent per tracker in every broadcast.")
+
+    def handle(self, *args, **options):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        scheduler = HeatScheduler(
+            loop, cross_process_layer(options['layer']), poll_interval=options['poll_interval'],
+            countdown_interval=options['countdown_interval'], frame_interval=options['frame_interval'],
+            frame_seconds=options['frame_seconds'], frame_points=options['frame_points'])
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, loop.stop)
+        self.stdout.write("Running heat timers, broadcasting on the '{}' channel layer".format(options['layer']))
+        scheduler.start()
+        try:
+            loop.run_forever()
+        finally:
+            scheduler.close()
+            loop.close()
+            self.stdout.write("Heat scheduler {}".format(scheduler.stats()))
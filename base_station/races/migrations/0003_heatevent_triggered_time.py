@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-17 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('races', '0002_auto_20160324_0525'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='heatevent',
+            name='triggered_time',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Triggered time'),
+        ),
+    ]
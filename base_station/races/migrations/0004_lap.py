@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-17 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django_extensions.db.fields
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trackers', '0002_auto_20160324_0525'),
+        ('races', '0003_heatevent_triggered_time'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Lap',
+            fields=[
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('number', models.PositiveSmallIntegerField(verbose_name='Lap number')),
+                ('start', models.DateTimeField(verbose_name='Lap started time')),
+                ('end', models.DateTimeField(verbose_name='Lap ended time')),
+                ('duration', models.DurationField(verbose_name='Lap time')),
+                ('valid', models.BooleanField(default=True, verbose_name='Valid')),
+                ('heat', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='laps', to='races.RaceHeat')),
+                ('tracker', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='laps', to='trackers.Tracker')),
+            ],
+            options={
+                'ordering': ('heat', 'tracker', 'number'),
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='lap',
+            index_together=set([('heat', 'tracker', 'number')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-17 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('races', '0004_lap'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='raceheat',
+            name='scheduled_time',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Heat scheduled time'),
+        ),
+    ]
@@ -2,8 +2,12 @@ import logging
 import json
 
 from catalog import Catalog
-from channels import Group
-from django.db import models
+from channels import Channel, Group
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
 from django_extensions.db.models import TimeStampedModel
 
@@ -26,9 +30,27 @@ logger = logging.getLogger(__name__)
 #
 #     """
 
+# Requests about a heat for the process consuming wireless packets
+HEAT_CHANNEL = 'wireless.heat'
+
+
 class RaceHeatQuerySet(models.QuerySet):
-    # For use in the future when we need to filter race heats by some mechanism
-    pass
+
+    def running(self):
+        return self.filter(started_time__isnull=False, ended_time__isnull=True)
+
+    def staged(self):
+        """
+        Heats given a scheduled time that haven't started yet, their start timers count from it.
+        """
+        return self.filter(scheduled_time__isnull=False, started_time__isnull=True, ended_time__isnull=True)
+
+    def timed(self):
+        """
+        Heats whose template's timers are due to fire, staged or running.
+        """
+        return self.filter(
+            models.Q(started_time__isnull=False) | models.Q(scheduled_time__isnull=False), ended_time__isnull=True)
 
 
 class RaceHeat(SyncModel, TimeStampedModel):
@@ -41,6 +63,8 @@ class RaceHeat(SyncModel, TimeStampedModel):
         _("Heat number"), blank=False, default=1)
     event = models.ForeignKey(Event)
 
+    # When the heat is set to start, the template's start timers count from it, see ``races.scheduler``
+    scheduled_time = models.DateTimeField(_("Heat scheduled time"), blank=True, null=True)
     started_time = models.DateTimeField(_("Heat started time"), blank=True, null=True)
     ended_time = models.DateTimeField(_("Heat ended time"), blank=True, null=True)
 
@@ -65,6 +89,66 @@ class RaceHeat(SyncModel, TimeStampedModel):
     def group_name(self):
         return "heat-{!s}".format(self.number)
 
+    def start(self, started_time=None):
+        """
+        Mark a staged heat started, only saves the started time so it isn't taken as an edit to the heat.
+        """
+        self.started_time = started_time or now()
+        self.save(update_fields=["started_time", "modified"])
+
+    def end(self, ended_time=None):
+        """
+        Mark the heat ended once every trigger waiting to be written is stored,
+        if storing them fails the error is raised and the heat isn't ended.
+
+        The triggers and telemetry are buffered by the process consuming the
+        wireless channel layer, so this only keeps that promise there. Other
+        processes use ``request_end``.
+        """
+        from base_station.telemetry.rings import telemetry_rings
+        from base_station.telemetry.store import telemetry_store
+        from .live import live_heats
+        from .writers import heat_events
+        heat_events.flush()
+        self.ended_time = ended_time or now()
+        self.save(update_fields=["ended_time", "modified"])
+        live_heats.discard(self)
+        telemetry_store.flush(self.pk)
+        telemetry_rings.discard(self.pk)
+
+    def send_control(self, content, channel_layer=None):
+        """
+        Send a request about the heat to the process consuming the wireless
+        channel layer, see ``wireless.consumers.heat_control``.
+        """
+        content = dict(content, heat=str(self.pk))
+        Channel(HEAT_CHANNEL, alias=settings.SERIAL_CHANNEL_LAYER, channel_layer=channel_layer).send(content)
+
+    def send_trigger(self, trigger, triggered_time=None, tracker_id=None, channel_layer=None):
+        """
+        Have the process consuming the wireless channel layer store a trigger,
+        so the live state of the heat it keeps sees it too.
+        """
+        from base_station.wireless.clock import datetime_wall
+        self.send_control({
+            "trigger": trigger,
+            "triggered_time": datetime_wall(triggered_time or now()),
+            "tracker": tracker_id,
+        }, channel_layer)
+
+    def request_end(self, ended_time=None, channel_layer=None):
+        """
+        Have the process consuming the wireless channel layer end the heat.
+        """
+        from base_station.wireless.clock import datetime_wall
+        self.send_control({"ended_time": datetime_wall(ended_time or now())}, channel_layer)
+
+    def changed(self):
+        """
+        Have the live state of the heat rebuilt once the current transaction commits.
+        """
+        HeatChanges.add(self.pk)
+
     def __str__(self):
         return "{} heat".format(self.event)
 
@@ -106,8 +190,115 @@ class HeatEvent(SyncModel, TimeStampedModel):
     # TODO: make a Category choice field?
     trigger = models.PositiveSmallIntegerField(
         _("trigger"), choices=TRIGGERS._zip("value", "label"))
+    # when the trigger happened, stamped as the packet was read for wireless triggers
+    triggered_time = models.DateTimeField(_("Triggered time"), default=now)
 
     objects = HeatEventQuerySet.as_manager()
 
     def __str__(self):
         return "{!s} {!s}".format(self.tracker, self.get_trigger_display())
+
+
+class LapQuerySet(models.QuerySet):
+
+    def valid(self):
+        return self.filter(valid=True)
+
+    def for_tracker(self, tracker):
+        return self.filter(tracker=tracker)
+
+    def rebuild(self, heats):
+        """
+        Replace the laps of ``heats`` with laps computed from their stored
+        triggers, returning how many were created.
+
+        Each heat's triggers are replayed through its live state, see
+        ``races.live``, so the rules of its template, the started trigger,
+        crashes and the finish are applied exactly as when the heat ran.
+        """
+        from .live import LiveHeat
+        heat_pks = [heat.pk for heat in heats]
+        laps = []
+        for heat in RaceHeat.objects.filter(pk__in=heat_pks).select_related('event__template'):
+            laps.extend(LiveHeat.replay(heat)[1])
+        with transaction.atomic():
+            self.filter(heat__in=heat_pks).delete()
+            self.bulk_create(laps)
+        return len(laps)
+
+
+class Lap(SyncModel, TimeStampedModel):
+    """
+    A lap completed by a tracker in a heat, from one of its gate triggers to the next.
+
+    Laps are created as gate triggers arrive by the live state of the heat,
+    see ``races.live``, and rebuilt from the stored triggers with
+    ``Lap.objects.rebuild`` when those change.
+    """
+
+    heat = models.ForeignKey(RaceHeat, related_name="laps")
+    tracker = models.ForeignKey(Tracker, related_name="laps")
+    # 1 for the lap started by the holeshot
+    number = models.PositiveSmallIntegerField(_("Lap number"))
+    start = models.DateTimeField(_("Lap started time"))
+    end = models.DateTimeField(_("Lap ended time"))
+    duration = models.DurationField(_("Lap time"))
+    # laps that don't count towards the result, e.g. shorter than the event's minimum lap time
+    valid = models.BooleanField(_("Valid"), default=True)
+
+    objects = LapQuerySet.as_manager()
+
+    class Meta:
+        ordering = ("heat", "tracker", "number")
+        index_together = ("heat", "tracker", "number")
+
+    def __str__(self):
+        return "{!s} lap {}".format(self.tracker, self.number)
+
+
+class HeatChanges(object):
+    """
+    Heats changed in a transaction, the process consuming the wireless
+    channel layer is told about each of them once when it commits.
+    """
+
+    def __init__(self):
+        self.heat_ids = set()
+
+    def __call__(self):
+        for heat_id in self.heat_ids:
+            RaceHeat(pk=heat_id).send_control({"changed": True})
+
+    @classmethod
+    def add(cls, heat_id):
+        # Outside a transaction nothing is waiting to commit and this is sent straight away
+        changes = next(
+            (func for sids, func in transaction.get_connection().run_on_commit if isinstance(func, cls)), None)
+        if changes is not None:
+            changes.heat_ids.add(heat_id)
+            return
+        changes = cls()
+        changes.heat_ids.add(heat_id)
+        transaction.on_commit(changes)
+
+
+# Saves that only start or end a heat, its live state follows those itself
+OWN_FIELDS = frozenset(["started_time", "ended_time", "modified"])
+
+
+@receiver([post_save, post_delete], sender=RaceHeat)
+@receiver([post_save, post_delete], sender=HeatEvent)
+def heat_changed(sender, instance, raw=False, created=False, update_fields=None, **kwargs):
+    """
+    Have the live state of a heat rebuilt when it or its triggers are edited,
+    e.g. in the admin. Triggers stored by ``races.writers`` are bulk created
+    and don't get here.
+    """
+    if raw:
+        return
+    if sender is RaceHeat:
+        if created or (update_fields and OWN_FIELDS.issuperset(update_fields)):
+            return
+        instance.changed()
+    else:
+        RaceHeat(pk=instance.heat_id).changed()
@@ -0,0 +1,50 @@
+"""
+Race rules of an EventTemplate compiled for running a heat.
+
+A template's rules are read once when the live state of a heat is built,
+see ``races.live``, and turned into plain attributes so checking them on
+every trigger is a few comparisons with nothing read from the database.
+"""
+
+from base_station.events.models import EventTemplate
+
+
+START_TYPES = EventTemplate.START_TYPES
+FINISH_CONDITIONS = EventTemplate.FINISH_CONDITIONS
+
+
+class HeatRules(object):
+    """
+    Without a template a heat has a flying start and runs until it is ended.
+    """
+
+    __slots__ = ('lap_count', 'time_limit', 'min_lap_time', 'flying_start')
+
+    def __init__(self, lap_count=None, time_limit=None, min_lap_time=None, flying_start=True):
+        self.lap_count = lap_count
+        self.time_limit = time_limit
+        self.min_lap_time = min_lap_time
+        self.flying_start = flying_start
+
+    @classmethod
+    def from_template(cls, template):
+        finish_condition = template.finish_condition
+        return cls(
+            lap_count=template.lap_count if finish_condition != FINISH_CONDITIONS.time.value else None,
+            time_limit=template.time_limit if finish_condition != FINISH_CONDITIONS.laps.value else None,
+            min_lap_time=template.min_lap_time,
+            flying_start=template.start_type == START_TYPES.flying.value)
+
+    def counts(self, lap):
+        """
+        True if a lap taking ``lap`` counts towards the result.
+        """
+        return self.min_lap_time is None or lap >= self.min_lap_time
+
+    def finished(self, laps, total):
+        """
+        True if completing lap number ``laps`` ``total`` after the heat started finishes the race.
+        """
+        if self.lap_count is not None and laps >= self.lap_count:
+            return True
+        return self.time_limit is not None and total >= self.time_limit
@@ -0,0 +1,308 @@
+"""
+Runs the Timers of running heats' EventTemplates.
+
+Every timer of every running heat sits in one heap ordered by the monotonic
+time it is due at, and the event loop is only ever waiting on the earliest
+of them. Due times are worked out from the heat's started time, so how
+late a heat is noticed doesn't move them, and the triggers a timer fires
+are stamped with the time it was due rather than when it ran.
+
+A heat given a scheduled time is staged until it starts: only its start
+timers are armed, counted from the scheduled time. Once the started
+trigger is stored the heat is armed again with the rest of its timers.
+
+Nothing that touches the database runs on the event loop: new heats are
+looked up and triggers written on a single worker thread, so one slow query
+can't hold up timers due for other heats. Countdown broadcasts are sent
+every ``countdown_interval`` seconds before each start and end timer,
+lined up so the last one lands a whole interval before it is due.
+
+Every ``frame_interval`` seconds the latest telemetry of each running heat
+is read from its ring file, see ``telemetry.rings``, downsampled to
+``frame_points`` per tracker and broadcast. Frames are put together on a
+thread of their own and one is skipped while the last is still going.
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from channels import Group
+from django.db import close_old_connections
+
+from base_station.events.models import Timer
+from base_station.telemetry.rings import telemetry_rings
+from base_station.wireless.clock import LatencyStats, monotonic_ns
+
+from .models import HeatEvent, RaceHeat
+
+
+logger = logging.getLogger(__name__)
+
+ACTIONS = Timer.ACTIONS
+TRIGGERS = HeatEvent.TRIGGERS
+
+# Timer action for the countdown broadcasts leading up to a start or end timer
+COUNTDOWN = -1
+# Triggers fired by timer actions, a timer is left out when its trigger is already stored
+ACTION_TRIGGERS = {
+    ACTIONS.start.value: TRIGGERS.started.value,
+    ACTIONS.end.value: TRIGGERS.ended.value,
+}
+
+
+def frame_columns(columns):
+    """
+    Telemetry columns as JSON lists, times in milliseconds so they survive JavaScript's numbers.
+    """
+    encoded = {name: values.tolist() for name, values in columns.items()}
+    encoded['time'] = (columns['time'] // 1000000).tolist()
+    return encoded
+
+
+class ScheduledTimer(object):
+    """
+    ``due`` is on the event loop's clock, ``when`` the datetime it stands for.
+    """
+
+    __slots__ = ('due', 'when', 'heat', 'armed', 'name', 'action', 'target')
+
+    def __init__(self, due, when, heat, armed, name, action, target=None):
+        self.due = due
+        self.when = when
+        self.heat = heat
+        self.armed = armed
+        self.name = name
+        self.action = action
+        self.target = target
+
+
+class HeatScheduler(object):
+
+    def __init__(self, loop=None, channel_layer=None, poll_interval=1.0, countdown_interval=1.0, stats_interval=60,
+                 frame_interval=None, frame_seconds=5, frame_points=150, rings=telemetry_rings):
+        self.loop = loop or asyncio.get_event_loop()
+        self.channel_layer = channel_layer
+        self.poll_interval = poll_interval
+        self.countdown_interval = countdown_interval
+        self.stats_interval = stats_interval
+        self.frame_interval = frame_interval
+        self.frame_seconds = frame_seconds
+        self.frame_points = frame_points
+        self.rings = rings
+        self.heap = []
+        self.sequence = itertools.count()
+        # Token per armed heat, timers of a heat that has been disarmed since are skipped
+        self.heats = {}
+        # Whether each armed heat was running or staged when armed, it is armed again once it starts
+        self.armed_started = {}
+        # Armed running heats by pk, for telemetry frames
+        self.running = {}
+        self.wakeup = None
+        self.jitter = LatencyStats()
+        # One thread so triggers are written in the order they fired
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.frame_executor = ThreadPoolExecutor(max_workers=1)
+        self.framing = None
+        self.frame_time = LatencyStats()
+        self.frames_skipped = 0
+        self.actions = {
+            ACTIONS.notify.value: self.notify,
+            ACTIONS.start.value: self.trigger,
+            ACTIONS.end.value: self.trigger,
+            COUNTDOWN: self.countdown,
+        }
+
+    def __len__(self):
+        return len(self.heap)
+
+    def start(self):
+        self.poll()
+        if self.frame_interval:
+            self.loop.call_later(self.frame_interval, self.frame)
+        if self.stats_interval:
+            self.loop.call_later(self.stats_interval, self.log_stats)
+
+    def close(self):
+        if self.wakeup is not None:
+            self.wakeup.cancel()
+        self.executor.shutdown()
+        self.frame_executor.shutdown()
+
+    def poll(self):
+        self.run(self.running_heats, dict(self.armed_started), callback=self.on_polled)
+        self.loop.call_later(self.poll_interval, self.poll)
+
+    def running_heats(self, armed):
+        """
+        Worker thread, returns the staged and running heats with the timers of those not
+        in ``armed``, which maps each armed heat to whether it was running when armed.
+        """
+        close_old_connections()
+        running = {}
+        for heat in RaceHeat.objects.timed().select_related('event'):
+            if armed.get(heat.pk) == heat.started:
+                running[heat.pk] = None
+                continue
+            fired = set(heat.triggered_events.filter(trigger__in=ACTION_TRIGGERS.values()).values_list(
+                'trigger', flat=True))
+            timers = Timer.objects.filter(tempalte=heat.event.template_id)
+            if heat.started:
+                timers = [
+                    (timer.name, timer.action, heat.started_time + timer.duration) for timer in timers
+                    if timer.action != ACTIONS.start.value and ACTION_TRIGGERS.get(timer.action) not in fired]
+            elif TRIGGERS.started.value not in fired:
+                timers = [
+                    (timer.name, timer.action, heat.scheduled_time + timer.duration) for timer in timers
+                    if timer.action == ACTIONS.start.value]
+            else:
+                # Started trigger waiting to be applied, the heat is armed again as running after it is
+                continue
+            running[heat.pk] = (heat, timers)
+        return running
+
+    def on_polled(self, running):
+        for heat_pk in set(self.heats) - set(running):
+            self.disarm(heat_pk)
+        for armed in running.values():
+            if armed is not None:
+                self.arm(*armed)
+
+    def arm(self, heat, timers):
+        """
+        Schedule ``timers`` of ``heat`` as ``(name, action, when)``, timers already due fire straight away.
+        Timers armed for the heat before are dropped.
+        """
+        armed = self.heats[heat.pk] = object()
+        self.armed_started[heat.pk] = heat.started
+        if heat.started:
+            self.running[heat.pk] = heat
+        now = self.loop.time()
+        offset = time.time() - now
+        for name, action, when in timers:
+            timer = self.push(when.timestamp() - offset, when, heat, armed, name, action)
+            if action not in ACTION_TRIGGERS:
+                continue
+            ahead = max(math.floor((timer.due - now) / self.countdown_interval), 0) * self.countdown_interval
+            if ahead:
+                self.push(timer.due - ahead, None, heat, armed, name, COUNTDOWN, timer)
+        self.reschedule()
+        logger.info("Armed {} timers for heat {}".format(len(timers), heat.pk))
+
+    def disarm(self, heat_pk):
+        self.heats.pop(heat_pk, None)
+        self.armed_started.pop(heat_pk, None)
+        self.running.pop(heat_pk, None)
+
+    def push(self, due, when, heat, armed, name, action, target=None):
+        timer = ScheduledTimer(due, when, heat, armed, name, action, target)
+        heapq.heappush(self.heap, (due, next(self.sequence), timer))
+        return timer
+
+    def reschedule(self):
+        if self.wakeup is not None:
+            self.wakeup.cancel()
+        self.wakeup = self.loop.call_at(self.heap[0][0], self.fire) if self.heap else None
+
+    def fire(self):
+        self.wakeup = None
+        now = self.loop.time()
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            due, _, timer = heapq.heappop(heap)
+            if self.heats.get(timer.heat.pk) is not timer.armed:
+                continue
+            self.jitter.add(int((now - due) * 1000000000))
+            self.actions[timer.action](timer)
+        self.reschedule()
+
+    def notify(self, timer):
+        self.broadcast(timer.heat, {"timer": timer.name, "action": timer.action})
+
+    def trigger(self, timer):
+        trigger = ACTION_TRIGGERS[timer.action]
+        self.run(self.record, timer.heat, trigger, timer.when)
+        if trigger == TRIGGERS.ended.value:
+            self.disarm(timer.heat.pk)
+        self.notify(timer)
+
+    def countdown(self, timer):
+        target = timer.target
+        self.broadcast(timer.heat, {"timer": target.name, "countdown": round(target.due - timer.due, 3)})
+        due = timer.due + self.countdown_interval
+        # Not a tick on top of the timer itself
+        if due < target.due - self.countdown_interval / 2:
+            self.push(due, None, timer.heat, timer.armed, timer.name, COUNTDOWN, target)
+
+    def record(self, heat, trigger, triggered_time):
+        """
+        Worker thread, hands the trigger a timer fired to the process keeping the heat's live state to store.
+        """
+        heat.send_trigger(trigger, triggered_time, channel_layer=self.channel_layer)
+
+    def frame(self):
+        self.loop.call_later(self.frame_interval, self.frame)
+        if not self.running:
+            return
+        if self.framing is not None and not self.framing.done():
+            self.frames_skipped += 1
+            return
+        self.framing = self.run(
+            self.telemetry_frames, list(self.running.values()), callback=self.send_frames,
+            executor=self.frame_executor)
+
+    def telemetry_frames(self, heats):
+        """
+        Frame thread, the latest telemetry of each of ``heats`` downsampled for broadcast.
+        """
+        started = monotonic_ns()
+        frames = []
+        for heat in heats:
+            trackers = self.rings.frame(heat.pk, self.frame_seconds, self.frame_points)
+            if trackers:
+                frames.append((heat, {"telemetry": {
+                    str(tracker_id): frame_columns(columns) for tracker_id, columns in trackers.items()}}))
+        self.frame_time.add(monotonic_ns() - started)
+        return frames
+
+    def send_frames(self, frames):
+        for heat, content in frames:
+            self.broadcast(heat, content)
+
+    def broadcast(self, heat, content):
+        content["heat"] = str(heat.pk)
+        Group(heat.group_name, channel_layer=self.channel_layer).send({"text": json.dumps(content)})
+
+    def run(self, func, *args, callback=None, executor=None):
+        """
+        Call ``func(*args)`` on the worker thread, or ``executor``, then ``callback`` with its result on the event loop.
+        """
+        def done(future):
+            try:
+                result = future.result()
+            except Exception:
+                logger.exception("Heat scheduler {} failed".format(func.__name__))
+                return
+            if callback is not None:
+                callback(result)
+        future = self.loop.run_in_executor(executor or self.executor, func, *args)
+        future.add_done_callback(done)
+        return future
+
+    def stats(self):
+        return {
+            'heats': len(self.heats),
+            'pending': len(self),
+            'jitter': self.jitter.stats(),
+            'frames': self.frame_time.stats(),
+            'frames_skipped': self.frames_skipped,
+        }
+
+    def log_stats(self):
+        logger.info("Heat scheduler {}".format(self.stats()))
+        self.loop.call_later(self.stats_interval, self.log_stats)
@@ -4,7 +4,7 @@ from graphene.contrib.django import DjangoNode, DjangoObjectType
 from graphene.contrib.django.filter import DjangoFilterConnectionField
 from graphene.core.types.custom_scalars import DateTime
 
-from .models import RaceHeat, HeatEvent
+from .models import RaceHeat, HeatEvent, Lap
 from base_station.utils.interfaces import TimeStampedInterface, SyncModelInterface
 
 
@@ -22,6 +22,7 @@ class RaceHeatNode(SyncModelInterface, TimeStampedInterface, DjangoNode):
     event_template = graphene.String()
 
     # events = DjangoFilterConnectionField(HeatEventNode, description='Heat Race Events')
+    laps = graphene.List('LapNode', description='Laps completed in the heat')
 
     class Meta:
         model = RaceHeat
@@ -30,6 +31,9 @@ class RaceHeatNode(SyncModelInterface, TimeStampedInterface, DjangoNode):
     def get_node(cls, _id, info):
         return RaceHeatNode(RaceHeat.objects.get(_id))
 
+    def resolve_laps(self, args, info):
+        return [LapNode(lap) for lap in self.instance.laps.select_related('tracker')]
+
 
 class HeatEventNode(SyncModelInterface, TimeStampedInterface, DjangoNode):
 
@@ -38,6 +42,7 @@ class HeatEventNode(SyncModelInterface, TimeStampedInterface, DjangoNode):
     trigger = graphene.Int()
     trigger_label = graphene.String()
     trigger_verbose_label = graphene.String()
+    triggered_time = DateTime()
 
 
     class Meta:
@@ -54,6 +59,29 @@ class HeatEventNode(SyncModelInterface, TimeStampedInterface, DjangoNode):
         return HeatEvent.TRIGGERS(self.trigger).label
 
 
+class LapNode(SyncModelInterface, TimeStampedInterface, DjangoNode):
+
+    heat = relay.NodeField(RaceHeatNode)
+
+    number = graphene.Int()
+    start = DateTime()
+    end = DateTime()
+    duration = graphene.Float(description='Lap time in seconds')
+    valid = graphene.Boolean()
+
+    class Meta:
+        model = Lap
+
+        filter_fields = {
+            'heat': ('exact',),
+            'tracker': ('exact',),
+            'valid': ('exact',),
+        }
+
+    def resolve_duration(self, args, info):
+        return self.duration.total_seconds()
+
+
 class RaceQuery(graphene.ObjectType):
     heat = relay.NodeField(RaceHeatNode)
     all_heats = DjangoFilterConnectionField(RaceHeatNode, description='All Race Heats')
@@ -61,5 +89,8 @@ class RaceQuery(graphene.ObjectType):
     event = relay.NodeField(HeatEventNode)
     all_events = DjangoFilterConnectionField(HeatEventNode, description='All Race Events')
 
+    lap = relay.NodeField(LapNode)
+    all_laps = DjangoFilterConnectionField(LapNode, description='All Race Laps')
+
 
 schema.query = RaceQuery
@@ -1,3 +1,369 @@
-from django.test import TestCase
+import asyncio
+from collections import OrderedDict
+from datetime import timedelta
 
-# Create your tests here.
+import numpy as np
+from django.db import IntegrityError, transaction
+from django.test import SimpleTestCase, TestCase
+from django.utils.timezone import now
+from model_mommy import mommy
+
+from .leaderboard import Leaderboard
+from .live import LiveHeat
+from .models import HeatChanges, HeatEvent, Lap, RaceHeat
+from .rules import HeatRules
+from .scheduler import ACTIONS, HeatScheduler
+from .writers import HeatEventWriter, heat_events
+
+
+class HeatTestMixin(object):
+
+    def setUp(self):
+        self.heat = mommy.make(RaceHeat, started_time=now(), event__recurrences='')
+        self.tracker = mommy.make('trackers.Tracker', transponder_id=12)
+
+    def gate_event(self):
+        return HeatEvent(heat=self.heat, tracker=self.tracker, trigger=HeatEvent.TRIGGERS.gate.value)
+
+
+class TestHeatEventWriter(HeatTestMixin, TestCase):
+
+    def test_writes_full_batches(self):
+        writer = HeatEventWriter(batch_size=3, interval=None)
+        writer.extend([self.gate_event(), self.gate_event()])
+        self.assertEqual(HeatEvent.objects.count(), 0)
+        writer.add(self.gate_event())
+        self.assertEqual(HeatEvent.objects.count(), 3)
+        self.assertEqual(writer.stats(), {'pending': 0, 'flushes': 1, 'written': 3})
+
+    def test_flush(self):
+        writer = HeatEventWriter(batch_size=3, interval=None)
+        writer.add(self.gate_event())
+        self.assertEqual(writer.flush(), 1)
+        self.assertEqual(writer.flush(), 0)
+        self.assertEqual(HeatEvent.objects.count(), 1)
+
+
+    def test_failed_write_keeps_the_batch(self):
+        writer = HeatEventWriter(batch_size=3, interval=None)
+        broken = self.gate_event()
+        broken.trigger = None
+        writer.extend([self.gate_event(), broken])
+        with self.assertRaises(IntegrityError):
+            writer.flush()
+        self.assertEqual(len(writer), 2)
+        broken.trigger = HeatEvent.TRIGGERS.gate.value
+        self.assertEqual(writer.flush(), 2)
+
+
+class TestRaceHeat(HeatTestMixin, TestCase):
+
+    def test_end_writes_pending_events(self):
+        # Keep the writes on this thread so they happen inside the test's transaction
+        self.addCleanup(setattr, heat_events, 'interval', heat_events.interval)
+        heat_events.interval = None
+        heat_events.add(self.gate_event())
+        self.heat.end()
+        self.assertEqual(self.heat.triggered_events.count(), 1)
+        self.assertFalse(RaceHeat.objects.running().exists())
+
+    def test_not_ended_when_pending_events_fail(self):
+        self.addCleanup(setattr, heat_events, 'interval', heat_events.interval)
+        self.addCleanup(setattr, heat_events, 'pending', [])
+        heat_events.interval = None
+        broken = self.gate_event()
+        broken.trigger = None
+        heat_events.add(broken)
+        with self.assertRaises(IntegrityError):
+            self.heat.end()
+        self.assertTrue(RaceHeat.objects.running().exists())
+
+
+class TestHeatChanges(HeatTestMixin, TestCase):
+
+    def pending(self):
+        return [
+            func.heat_ids for sids, func in transaction.get_connection().run_on_commit if isinstance(func, HeatChanges)]
+
+    def test_once_per_heat_and_transaction(self):
+        self.assertEqual(self.pending(), [])
+        first = HeatEvent.objects.create(heat=self.heat, trigger=HeatEvent.TRIGGERS.crash.value, triggered_time=now())
+        HeatEvent.objects.create(heat=self.heat, trigger=HeatEvent.TRIGGERS.crash.value, triggered_time=now())
+        first.delete()
+        self.assertEqual(self.pending(), [{self.heat.pk}])
+
+    def test_ending_a_heat_isnt_a_change(self):
+        self.heat.end()
+        self.assertEqual(self.pending(), [])
+        self.heat.save()
+        self.assertEqual(self.pending(), [{self.heat.pk}])
+
+
+class TestLeaderboard(SimpleTestCase):
+
+    def setUp(self):
+        self.leaderboard = Leaderboard()
+        for tracker_id in 'abc':
+            self.leaderboard.update(tracker_id)
+
+    def test_keeps_entry_order_without_laps(self):
+        self.assertEqual(list(self.leaderboard), ['a', 'b', 'c'])
+        self.assertEqual(self.leaderboard.rank('c'), 3)
+
+    def test_ranks_by_laps_then_time(self):
+        self.assertEqual(self.leaderboard.update('c', 1, timedelta(seconds=20)), 1)
+        self.assertEqual(self.leaderboard.update('a', 1, timedelta(seconds=21)), 2)
+        self.assertEqual(self.leaderboard.update('b', 2, timedelta(seconds=45)), 1)
+        self.assertEqual(list(self.leaderboard), ['b', 'c', 'a'])
+        self.assertEqual(self.leaderboard.ahead('a'), 'c')
+        self.assertEqual(self.leaderboard.gap_to_next('a'), timedelta(seconds=1))
+        self.assertIsNone(self.leaderboard.gap_to_leader('a'))
+        self.assertIsNone(self.leaderboard.gap_to_next('b'))
+
+
+class TestLiveHeat(SimpleTestCase):
+
+    def setUp(self):
+        self.started = now()
+        self.live = LiveHeat(1, self.started)
+
+    def gate(self, tracker_id, seconds):
+        return self.live.apply(HeatEvent(
+            tracker_id=tracker_id, trigger=HeatEvent.TRIGGERS.gate.value,
+            triggered_time=self.started + timedelta(seconds=seconds)))
+
+    def test_counts_laps_from_holeshot(self):
+        self.assertIsNone(self.gate(1, 2))
+        self.gate(1, 22)
+        lap = self.gate(1, 41)
+        self.assertEqual((lap.tracker_id, lap.number, lap.duration), (1, 2, timedelta(seconds=19)))
+        state = self.live.trackers[1]
+        self.assertEqual(state.laps, 2)
+        self.assertEqual(state.last_lap, timedelta(seconds=19))
+        self.assertEqual(state.best_lap, timedelta(seconds=19))
+        self.assertEqual(state.total, timedelta(seconds=41))
+
+    def test_overtaking_moves_tracker_up(self):
+        for tracker_id in (1, 2, 3):
+            self.gate(tracker_id, tracker_id)
+        self.gate(1, 21)
+        self.gate(3, 22)
+        self.gate(2, 23)
+        self.assertEqual(list(self.live.leaderboard), [1, 3, 2])
+        self.gate(2, 40)
+        standings = self.live.standings()
+        self.assertEqual([standing['tracker'] for standing in standings], [2, 1, 3])
+        self.assertEqual(standings[1]['gap_to_leader'], None)
+        self.assertEqual(standings[2]['gap_to_next'], 1.0)
+
+    def test_ignores_gates_after_crash_and_end(self):
+        self.gate(1, 1)
+        self.live.apply(HeatEvent(tracker_id=1, trigger=HeatEvent.TRIGGERS.crash.value, triggered_time=self.started))
+        self.gate(1, 20)
+        self.gate(2, 1)
+        self.live.apply(HeatEvent(trigger=HeatEvent.TRIGGERS.ended.value, triggered_time=self.started))
+        self.gate(2, 20)
+        self.assertEqual(self.live.trackers[1].laps, 0)
+        self.assertEqual(self.live.trackers[2].laps, 0)
+
+
+class TestHeatRules(SimpleTestCase):
+
+    def setUp(self):
+        self.started = now()
+
+    def gates(self, live, *crossings):
+        return [
+            live.apply(HeatEvent(
+                tracker_id=tracker_id, trigger=HeatEvent.TRIGGERS.gate.value,
+                triggered_time=self.started + timedelta(seconds=seconds)))
+            for tracker_id, seconds in crossings]
+
+    def test_lap_count_finishes_everyone_on_their_next_crossing(self):
+        live = LiveHeat(1, self.started, HeatRules(lap_count=2))
+        self.gates(live, (1, 1), (2, 2), (1, 20), (2, 22), (1, 40))
+        self.assertEqual(live.state, 'finishing')
+        self.assertTrue(live.trackers[1].finished)
+        lap, ignored = self.gates(live, (2, 43), (1, 60))
+        self.assertEqual(lap.number, 2)
+        self.assertIsNone(ignored)
+        self.assertEqual(live.state, 'finished')
+        self.assertEqual([standing['laps'] for standing in live.standings()], [2, 2])
+
+    def test_time_limit(self):
+        live = LiveHeat(1, self.started, HeatRules(time_limit=timedelta(seconds=30)))
+        self.gates(live, (1, 1), (1, 20))
+        self.assertEqual(live.state, 'running')
+        self.gates(live, (1, 40))
+        self.assertEqual(live.state, 'finished')
+
+    def test_short_laps_dont_count(self):
+        live = LiveHeat(1, self.started, HeatRules(min_lap_time=timedelta(seconds=10)))
+        short, lap = self.gates(live, (1, 1), (1, 5), (1, 25))[1:]
+        self.assertFalse(short.valid)
+        self.assertEqual((lap.number, lap.valid, lap.duration), (2, True, timedelta(seconds=20)))
+        self.assertEqual(live.trackers[1].laps, 1)
+
+    def test_grid_start_times_first_lap_from_the_start(self):
+        live = LiveHeat(1, self.started, HeatRules(flying_start=False))
+        lap = self.gates(live, (1, 18))[0]
+        self.assertEqual((lap.number, lap.duration), (1, timedelta(seconds=18)))
+
+    def test_waits_for_the_start(self):
+        live = LiveHeat(1)
+        self.assertEqual(self.gates(live, (1, 1)), [None])
+        live.apply(HeatEvent(trigger=HeatEvent.TRIGGERS.started.value, triggered_time=self.started))
+        self.gates(live, (1, 2), (1, 22))
+        self.assertEqual(live.trackers[1].laps, 1)
+
+
+class RecordingScheduler(HeatScheduler):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.broadcasts = []
+        self.recorded = []
+
+    def broadcast(self, heat, content):
+        self.broadcasts.append(content)
+
+    def record(self, heat, trigger, triggered_time):
+        self.recorded.append((trigger, triggered_time))
+
+
+class TestHeatScheduler(SimpleTestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.scheduler = RecordingScheduler(self.loop, countdown_interval=0.02, stats_interval=None)
+        self.addCleanup(self.scheduler.close)
+        self.heat = RaceHeat(number=1, started_time=now())
+
+    def run_until(self, seconds):
+        self.loop.call_later(seconds, self.loop.stop)
+        self.loop.run_forever()
+
+    def test_fires_start_and_end_triggers(self):
+        start = self.heat.started_time + timedelta(seconds=0.05)
+        end = self.heat.started_time + timedelta(seconds=0.1)
+        self.scheduler.arm(self.heat, [('Go', ACTIONS.start.value, start), ('Over', ACTIONS.end.value, end)])
+        self.run_until(0.15)
+        self.assertEqual(self.scheduler.recorded, [
+            (HeatEvent.TRIGGERS.started.value, start), (HeatEvent.TRIGGERS.ended.value, end)])
+        self.assertNotIn(self.heat.pk, self.scheduler.heats)
+        countdowns = [content['countdown'] for content in self.scheduler.broadcasts if 'countdown' in content]
+        self.assertEqual(countdowns[-2:], [0.04, 0.02])
+        self.assertLess(self.scheduler.jitter.stats()['max_us'], 50000)
+
+    def test_disarmed_heats_dont_fire(self):
+        self.scheduler.arm(self.heat, [('Note', ACTIONS.notify.value, now() + timedelta(seconds=0.02))])
+        self.scheduler.disarm(self.heat.pk)
+        self.run_until(0.04)
+        self.assertEqual(self.scheduler.broadcasts, [])
+        self.assertEqual(len(self.scheduler), 0)
+
+
+class TestStagedHeats(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.scheduler = RecordingScheduler(self.loop, stats_interval=None)
+        self.addCleanup(self.scheduler.close)
+        self.heat = mommy.make(RaceHeat, scheduled_time=now(), event__recurrences='')
+        for action, seconds in [(ACTIONS.start, 10), (ACTIONS.notify, 20), (ACTIONS.end, 60)]:
+            mommy.make('events.Timer', tempalte=self.heat.event.template, action=action.value,
+                       duration=timedelta(seconds=seconds))
+
+    def timers(self):
+        heat, timers = self.scheduler.running_heats(self.scheduler.armed_started)[self.heat.pk]
+        self.scheduler.arm(heat, timers)
+        return [(action, when) for name, action, when in timers]
+
+    def test_start_timers_count_from_the_scheduled_time(self):
+        self.assertEqual(self.timers(), [(ACTIONS.start.value, self.heat.scheduled_time + timedelta(seconds=10))])
+        self.assertEqual(self.scheduler.running, {})
+        self.assertEqual(self.scheduler.running_heats(self.scheduler.armed_started), {self.heat.pk: None})
+
+    def test_armed_again_once_started(self):
+        self.timers()
+        self.heat.start()
+        self.assertEqual(self.timers(), [
+            (ACTIONS.notify.value, self.heat.started_time + timedelta(seconds=20)),
+            (ACTIONS.end.value, self.heat.started_time + timedelta(seconds=60))])
+        self.assertIn(self.heat.pk, self.scheduler.running)
+
+
+class FrameRings(object):
+
+    def __init__(self):
+        self.read = []
+
+    def frame(self, heat_id, seconds, points):
+        self.read.append((heat_id, seconds, points))
+        times = np.arange(3, dtype=np.int64) * 4000000 + 1500000000000000000
+        return {'tracker': OrderedDict([('time', times), ('x', np.arange(3))])}
+
+
+class TestTelemetryFrames(SimpleTestCase):
+
+    def test_broadcasts_downsampled_telemetry_of_running_heats(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        rings = FrameRings()
+        scheduler = RecordingScheduler(
+            loop, poll_interval=60, stats_interval=None, frame_interval=0.02, frame_points=100, rings=rings)
+        self.addCleanup(scheduler.close)
+        heat = RaceHeat(number=1, started_time=now())
+        scheduler.running_heats = lambda armed: {heat.pk: None}
+        scheduler.arm(heat, [])
+        scheduler.start()
+        loop.call_later(0.1, loop.stop)
+        loop.run_forever()
+        self.assertEqual(rings.read[0], (heat.pk, 5, 100))
+        self.assertEqual(scheduler.broadcasts[0], {
+            'telemetry': {'tracker': {'time': [1500000000000, 1500000000004, 1500000000008], 'x': [0, 1, 2]}}})
+
+
+class StoredGatesMixin(HeatTestMixin):
+
+    def store(self, trigger, *seconds):
+        for offset in seconds:
+            HeatEvent.objects.create(
+                heat=self.heat, tracker=self.tracker, trigger=trigger,
+                triggered_time=self.heat.started_time + timedelta(seconds=offset))
+
+
+class TestLiveHeatRebuild(StoredGatesMixin, TestCase):
+
+    def test_rebuilds_from_stored_events(self):
+        self.store(HeatEvent.TRIGGERS.gate.value, 1, 21, 40)
+        live = LiveHeat.from_heat(self.heat)
+        self.assertEqual(live.trackers[self.tracker.pk].laps, 2)
+        self.assertEqual(live.trackers[self.tracker.pk].best_lap, timedelta(seconds=19))
+
+
+class TestLapRebuild(StoredGatesMixin, TestCase):
+
+    def test_pairs_gate_triggers(self):
+        self.store(HeatEvent.TRIGGERS.gate.value, 1, 21, 40)
+        self.assertEqual(Lap.objects.rebuild([self.heat]), 2)
+        self.assertEqual(
+            list(self.heat.laps.values_list('number', 'duration')),
+            [(1, timedelta(seconds=20)), (2, timedelta(seconds=19))])
+
+    def test_replaces_laps_and_stops_at_crash(self):
+        self.store(HeatEvent.TRIGGERS.gate.value, 1, 21, 40)
+        self.store(HeatEvent.TRIGGERS.crash.value, 30)
+        Lap.objects.rebuild([self.heat])
+        self.assertEqual(Lap.objects.rebuild([self.heat]), 1)
+        self.assertEqual(self.heat.laps.count(), 1)
+
+    def test_stops_counting_once_finished(self):
+        template = self.heat.event.template
+        template.lap_count = 2
+        template.save()
+        self.store(HeatEvent.TRIGGERS.gate.value, 1, 21, 40, 60)
+        self.assertEqual(Lap.objects.rebuild([self.heat]), 2)
+        self.assertEqual(list(self.heat.laps.values_list('number', flat=True)), [1, 2])
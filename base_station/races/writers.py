@@ -0,0 +1,100 @@
+"""
+Batched writes of HeatEvents.
+
+Triggers arrive far faster than it is worth making a transaction each for,
+so they are buffered and written with one ``bulk_create`` in one transaction
+once ``batch_size`` are waiting or the oldest has waited ``interval``
+seconds. A heat flushes the writer before it is marked ended, see
+``RaceHeat.end``, and isn't marked ended if that fails.
+"""
+
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .models import HeatEvent
+
+
+logger = logging.getLogger(__name__)
+
+
+class HeatEventWriter(object):
+    """
+    With ``interval`` set a daemon thread flushes events that have waited
+    that long, otherwise they are only written when the batch fills up or
+    ``flush`` is called.
+    """
+
+    def __init__(self, batch_size=100, interval=0.05):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.pending = []
+        self.lock = threading.Lock()
+        # Held while writing so a flush returns only once everything before it is stored
+        self.writing = threading.Lock()
+        self.waiting = threading.Condition(self.lock)
+        self.flusher = None
+        self.flushes = 0
+        self.written = 0
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, event):
+        self.extend([event])
+
+    def extend(self, events):
+        with self.lock:
+            self.pending.extend(events)
+            full = len(self.pending) >= self.batch_size
+            if not full and self.pending and self.interval:
+                if self.flusher is None:
+                    self.flusher = threading.Thread(target=self.run_flusher, name="heat-event-writer", daemon=True)
+                    self.flusher.start()
+                self.waiting.notify()
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        Write every buffered event, returning how many were written. If
+        writing fails the events stay buffered and the error is raised.
+        """
+        with self.writing:
+            with self.lock:
+                events, self.pending = self.pending, []
+            if not events:
+                return 0
+            try:
+                with transaction.atomic():
+                    HeatEvent.objects.bulk_create(events)
+            except Exception:
+                # Kept for the next flush, ahead of anything added meanwhile
+                with self.lock:
+                    self.pending[:0] = events
+                raise
+            self.flushes += 1
+            self.written += len(events)
+            return len(events)
+
+    def run_flusher(self):
+        while True:
+            with self.lock:
+                while not self.pending:
+                    self.waiting.wait()
+            # Give the batch the interval to fill up
+            time.sleep(self.interval)
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to write buffered heat events")
+
+    def stats(self):
+        return {'pending': len(self), 'flushes': self.flushes, 'written': self.written}
+
+
+heat_events = HeatEventWriter(settings.HEAT_EVENT_BATCH_SIZE, settings.HEAT_EVENT_FLUSH_INTERVAL)
@@ -0,0 +1,204 @@
+"""
+Delta coding of telemetry columns.
+
+Consecutive samples of a tracker differ by little: times go up by the
+transponder's sample interval, positions move by centimetres and battery
+voltage hardly changes. Each column is stored as the differences between
+consecutive values, zig-zag mapped so small negative differences stay
+small, and then packed one of two ways:
+
+* LEB128 varints of 7 bits a byte, ``encode_columns``. Most differences
+  fit in one or two bytes where the raw columns take up to eight.
+* Fixed width, ``pack_columns``. Every difference in a column is packed in
+  as many bits as its largest one needs, and differences of differences
+  are taken instead when they are narrower, as they are for evenly spaced
+  times and steady movement. A chunk of evenly spaced times packs into no
+  bits at all past its first two values.
+
+Encoding and decoding work on whole columns with NumPy, there is no loop
+over values in Python. Decoding varints marks the last byte of every
+varint by its clear continuation bit, shifts each byte's 7 bits into place
+by its position within its varint and ORs each varint's bytes together
+with one ``reduceat``. Either way the zig-zag mapping and the differences
+are then undone with cumulative sums.
+"""
+
+import struct
+
+import numpy as np
+
+
+# Byte length of a column's varints
+COLUMN_LENGTH = struct.Struct('<I')
+# Times differences were taken and bits per packed value
+PACKED_COLUMN = struct.Struct('<BB')
+
+UINT64 = np.dtype('<u8')
+SHIFTS = np.arange(10, dtype=UINT64) * 7
+
+
+def zigzag(values):
+    values = values.astype(np.int64)
+    return ((values << 1) ^ (values >> 63)).view(UINT64)
+
+
+def unzigzag(encoded):
+    return (encoded >> 1).view(np.int64) ^ -(encoded & 1).view(np.int64)
+
+
+def encode_varints(values):
+    """
+    LEB128 varint bytes for an array of unsigned 64 bit integers.
+    """
+    values = np.asarray(values, dtype=UINT64)
+    if not len(values):
+        return b''
+    # Bytes needed by each value, at least one even for zero
+    lengths = np.ones(len(values), dtype=np.int64)
+    for shift in SHIFTS[1:]:
+        lengths += values >= (np.uint64(1) << shift)
+    owner = np.repeat(np.arange(len(values)), lengths)
+    starts = np.cumsum(lengths) - lengths
+    position = np.arange(len(owner)) - starts[owner]
+    encoded = (values[owner] >> SHIFTS[position]) & np.uint64(0x7F)
+    # Every byte but the last of a value carries the continuation bit
+    encoded |= (position < lengths[owner] - 1).astype(UINT64) << np.uint64(7)
+    return encoded.astype(np.uint8).tobytes()
+
+
+def decode_varints(data):
+    """
+    Array of unsigned 64 bit integers from LEB128 varint bytes.
+    """
+    data = np.frombuffer(data, dtype=np.uint8)
+    if not len(data):
+        return np.empty(0, dtype=UINT64)
+    last = (data & 0x80) == 0
+    ends = np.flatnonzero(last)
+    starts = np.empty(len(ends), dtype=np.int64)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    owner = np.cumsum(last) - last
+    position = np.arange(len(data)) - starts[owner]
+    parts = (data & 0x7F).astype(UINT64) << SHIFTS[position]
+    return np.bitwise_or.reduceat(parts, starts)
+
+
+def encode_deltas(column):
+    """
+    Varint bytes of a column's zig-zagged differences, the first from zero.
+    """
+    values = np.asarray(column).astype(np.int64)
+    deltas = values.copy()
+    deltas[1:] -= values[:-1]
+    return encode_varints(zigzag(deltas))
+
+
+def decode_deltas(data, dtype):
+    return np.cumsum(unzigzag(decode_varints(data))).astype(dtype)
+
+
+def encode_columns(columns):
+    """
+    Delta coded ``columns``, each preceded by its length.
+    """
+    parts = []
+    for column in columns:
+        encoded = encode_deltas(column)
+        parts.append(COLUMN_LENGTH.pack(len(encoded)))
+        parts.append(encoded)
+    return b''.join(parts)
+
+
+def decode_columns(body, dtypes):
+    """
+    Arrays of ``dtypes`` from the bytes written by ``encode_columns``.
+    """
+    body = memoryview(body)
+    columns = []
+    offset = 0
+    for dtype in dtypes:
+        length, = COLUMN_LENGTH.unpack_from(body, offset)
+        offset += COLUMN_LENGTH.size
+        columns.append(decode_deltas(body[offset:offset + length], dtype))
+        offset += length
+    return columns
+
+
+def differences(values, order):
+    """
+    ``values`` differenced ``order`` times, the first ``order`` values are kept as they are.
+    """
+    deltas = values.copy()
+    for start in range(1, order + 1):
+        deltas[start:] = deltas[start:] - deltas[start - 1:-1]
+    return deltas
+
+
+def undo_differences(deltas, order):
+    for start in range(order, 0, -1):
+        deltas[start - 1:] = np.cumsum(deltas[start - 1:])
+    return deltas
+
+
+def pack_bits(values, width):
+    """
+    The low ``width`` bits of every value, packed end to end.
+    """
+    if not width:
+        return b''
+    bits = (values[:, None] >> np.arange(width, dtype=UINT64)) & np.uint64(1)
+    return np.packbits(bits.astype(np.uint8).ravel()).tobytes()
+
+
+def unpack_bits(data, count, width):
+    if not width:
+        return np.zeros(count, dtype=UINT64)
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8))[:count * width].reshape(count, width)
+    return np.bitwise_or.reduce(bits.astype(UINT64) << np.arange(width, dtype=UINT64), axis=1)
+
+
+def pack_columns(columns, orders=(1, 2)):
+    """
+    Fixed width delta coded ``columns``, each packed with whichever of ``orders`` of differences is narrowest.
+    """
+    parts = []
+    for column in columns:
+        values = np.asarray(column).astype(np.int64)
+        best = None
+        for order in orders:
+            deltas = differences(values, order)
+            # The values kept as they are go in as varints, the rest are packed
+            head, tail = zigzag(deltas[:order]), zigzag(deltas[order:])
+            width = int(tail.max()).bit_length() if len(tail) else 0
+            if best is None or width < best[1]:
+                best = (order, width, head, tail)
+        order, width, head, tail = best
+        parts.append(PACKED_COLUMN.pack(order, width))
+        parts.append(encode_varints(head))
+        parts.append(pack_bits(tail, width))
+    return b''.join(parts)
+
+
+def unpack_columns(body, count, dtypes):
+    """
+    ``count`` long arrays of ``dtypes`` from the bytes written by ``pack_columns``.
+    """
+    body = memoryview(body)
+    data = np.frombuffer(body, dtype=np.uint8)
+    columns = []
+    offset = 0
+    for dtype in dtypes:
+        order, width = PACKED_COLUMN.unpack_from(body, offset)
+        offset += PACKED_COLUMN.size
+        kept = min(order, count)
+        # The kept values' varints end at the kept'th byte without the continuation bit
+        head_length = int(np.flatnonzero((data[offset:offset + 10 * kept] & 0x80) == 0)[kept - 1]) + 1 if kept else 0
+        head = decode_varints(body[offset:offset + head_length])
+        offset += head_length
+        packed_length = ((count - kept) * width + 7) // 8
+        tail = unpack_bits(body[offset:offset + packed_length], count - kept, width)
+        offset += packed_length
+        deltas = unzigzag(np.concatenate([head, tail]))
+        columns.append(undo_differences(deltas, kept).astype(dtype))
+    return columns
@@ -0,0 +1,123 @@
+"""
+Downsampling a tracker's telemetry to a budget of points for display.
+
+Two ways of picking which samples to keep, both pick whole samples so every
+column of the ones kept still belongs together:
+
+* Largest triangle three buckets, ``lttb``. The samples between the first
+  and the last are split into equal buckets and the one kept from each is
+  the one making the largest triangle with the buckets either side, so the
+  corners of a flight line survive where evenly spaced picks cut them off.
+  Textbook LTTB measures the triangle against the sample picked from the
+  bucket before, which makes every bucket wait on the one before it. Here
+  all buckets are worked out at once, the first pass against the mean of
+  the bucket before and each further pass against the samples the pass
+  before picked. Three passes come close to what textbook LTTB picks.
+* Lowest and highest per bucket, ``min_max``, for a single column such as
+  RSSI or battery where the peaks are what matter.
+
+Both are a handful of passes over the arrays with no Python loop over
+samples, cheap enough to run on the latest seconds of every tracker for each frame
+sent to the screens.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+from catalog import Catalog
+
+
+class METHODS(Catalog):
+    _attrs = ('value', 'label')
+    lttb = (0, 'Largest triangle three buckets on position')
+    min_max = (1, 'Lowest and highest of a column per bucket')
+
+
+def bucket_starts(start, stop, buckets):
+    """
+    Starts of ``buckets`` near equal buckets covering ``start`` to ``stop``.
+    """
+    return start + (np.arange(buckets) * (stop - start)) // buckets
+
+
+def first_max(values, starts, owner):
+    """
+    Index of the first of the largest ``values`` of each bucket.
+    """
+    largest = np.maximum.reduceat(values, starts)
+    hits = np.flatnonzero(values == largest[owner])
+    first = np.ones(len(hits), dtype=bool)
+    first[1:] = owner[hits[1:]] != owner[hits[:-1]]
+    return hits[first]
+
+
+def lttb(coordinates, points, passes=3):
+    """
+    Indices of at most ``points`` samples picked by the largest triangle
+    their ``coordinates``, any number of equal length columns, make.
+    """
+    count = len(coordinates[0])
+    if points >= count:
+        return np.arange(count)
+    if points < 3:
+        return np.array([0, count - 1][:points], dtype=np.int64)
+    if len(coordinates) == 1:
+        # A single column is plotted against its position
+        coordinates = [np.arange(count), coordinates[0]]
+    buckets = points - 2
+    starts = bucket_starts(1, count - 1, buckets)
+    sizes = np.diff(np.append(starts, count - 1))
+    owner = np.repeat(np.arange(buckets), sizes)
+    columns = [np.asarray(column, dtype=np.float64) for column in coordinates]
+    # The first and last samples are buckets of their own either end
+    means = [
+        np.concatenate([column[:1], np.add.reduceat(column[1:-1], starts - 1) / sizes, column[-1:]])
+        for column in columns]
+    anchors = [column_means[:-2] for column_means in means]
+    for _ in range(passes):
+        # Sides of each sample's triangle from the anchor before, to the sample and to the next bucket's mean
+        sides = []
+        for column, column_means, column_anchors in zip(columns, means, anchors):
+            before = column_anchors[owner]
+            sides.append((column[1:-1] - before, column_means[2:][owner] - before))
+        # Twice the triangle's area squared, the sum of the squares of the cross product's components
+        area = np.zeros(count - 2)
+        for first in range(len(sides)):
+            for second in range(first + 1, len(sides)):
+                cross = sides[first][0] * sides[second][1] - sides[second][0] * sides[first][1]
+                area += cross * cross
+        picked = first_max(area, starts - 1, owner) + 1
+        anchors = [np.concatenate([column[:1], column[picked[:-1]]]) for column in columns]
+    return np.concatenate([[0], picked, [count - 1]])
+
+
+def min_max(values, points):
+    """
+    Indices of at most ``points`` samples, the lowest and highest of ``values`` in each bucket, in order.
+    """
+    values = np.asarray(values)
+    count = len(values)
+    if points >= count:
+        return np.arange(count)
+    if points < 2:
+        # No room for a bucket's lowest and highest, the highest is kept alone
+        return np.array([np.argmax(values)] if points == 1 else [], dtype=np.int64)
+    buckets = points // 2
+    starts = bucket_starts(0, count, buckets)
+    owner = np.repeat(np.arange(buckets), np.diff(np.append(starts, count)))
+    picked = np.concatenate([first_max(values, starts, owner), first_max(-values.astype(np.float64), starts, owner)])
+    return np.unique(picked)
+
+
+def downsample(columns, points, method=METHODS.lttb, column='rssi'):
+    """
+    ``columns`` of a tracker's samples cut down to at most ``points`` of them,
+    as they are when they already fit. ``column`` is the one ``min_max`` picks by.
+    """
+    if points is None or len(columns['time']) <= points:
+        return columns
+    if method == METHODS.lttb:
+        picked = lttb([columns['x'], columns['y'], columns['z']], points)
+    else:
+        picked = min_max(columns[column], points)
+    return OrderedDict((name, values[picked]) for name, values in columns.items())
@@ -0,0 +1,273 @@
+"""
+Live telemetry of running heats shared between processes through memory mapped ring files.
+
+Every running heat gets one fixed size file, ``<root>/<heat>.ring``, that
+the processes ingesting telemetry append to and any other process maps read
+only. The first writer to come along creates it, any other opens the one
+already there and writers take turns through a lock on the file. Reading
+the latest samples of a tracker is a couple of index calculations and gives
+NumPy views straight into the mapping, nothing is copied and neither the
+channel layer nor the database is involved.
+
+    header | slot table | samples of slot 0 | samples of slot 1 | ...
+
+Each tracker is given a slot when its first sample arrives, a slot holds
+its tracker id, the number of samples ever written to it and room for
+``capacity`` samples, stored twice over: sample ``n`` goes at ``n %
+capacity`` and again ``capacity`` further on. Whatever the write position,
+the latest ``capacity`` samples are then one contiguous run, so they can be
+returned as a view without stitching the two ends of the ring together.
+
+A slot's count is only moved on once its samples are in place, and counts
+are 8 byte aligned so readers never see one half written. A view stays
+valid until the writers have gone round the ring past it, views of the
+latest ``n`` samples can be held while ``capacity - n`` more are written.
+Copy anything kept for longer.
+"""
+
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+from .downsample import METHODS, downsample
+from .store import COLUMNS, SAMPLE, empty_columns
+
+
+logger = logging.getLogger(__name__)
+
+# magic, slots, samples per slot, padded so the slot table is aligned
+HEADER = struct.Struct('<4sII52x')
+MAGIC = b'TLMR'
+# Samples written, tracker id
+SLOT = np.dtype([('count', '<u8'), ('tracker', 'S56')])
+EXTENSION = '.ring'
+
+
+def ring_size(slots, capacity):
+    return HEADER.size + slots * SLOT.itemsize + slots * 2 * capacity * SAMPLE.itemsize
+
+
+class TelemetryRing(object):
+    """
+    A heat's ring file mapped into this process, writers keep ``ring_file`` open to lock it.
+    """
+
+    def __init__(self, path, mapping, ring_file=None):
+        self.path = path
+        self.mapping = mapping
+        self.ring_file = ring_file
+        magic, slots, capacity = HEADER.unpack_from(mapping)
+        if magic != MAGIC:
+            raise ValueError("{} is not a telemetry ring".format(path))
+        self.capacity = capacity
+        self.slots = np.frombuffer(mapping, SLOT, slots, HEADER.size)
+        self.samples = np.frombuffer(
+            mapping, SAMPLE, slots * 2 * capacity, HEADER.size + slots * SLOT.itemsize).reshape(slots, 2 * capacity)
+        # Slot index by tracker id, filled in as slots are looked up
+        self.by_tracker = {}
+
+    @classmethod
+    def create(cls, path, slots, capacity):
+        """
+        Make a new ring file to write to, it is only linked into place at
+        ``path`` once set up so readers never see it half made. If another
+        writer got there first its ring is opened instead.
+        """
+        size = ring_size(slots, capacity)
+        partial = "{}.{}".format(path, os.getpid())
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        ring_file = open(partial, 'w+b')
+        try:
+            ring_file.truncate(size)
+            mapping = mmap.mmap(ring_file.fileno(), size)
+            HEADER.pack_into(mapping, 0, MAGIC, slots, capacity)
+            try:
+                # Unlike a rename this never replaces a ring another writer already has samples in
+                os.link(partial, path)
+            except FileExistsError:
+                mapping.close()
+                ring_file.close()
+                return cls.open(path, writable=True)
+        except BaseException:
+            ring_file.close()
+            raise
+        finally:
+            os.remove(partial)
+        return cls(path, mapping, ring_file)
+
+    @classmethod
+    def open(cls, path, writable=False):
+        if writable:
+            ring_file = open(path, 'r+b')
+            return cls(path, mmap.mmap(ring_file.fileno(), 0), ring_file)
+        with open(path, 'rb') as ring_file:
+            mapping = mmap.mmap(ring_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(path, mapping)
+
+    def close(self):
+        self.slots = self.samples = None
+        self.by_tracker = {}
+        if self.ring_file is not None:
+            self.ring_file.close()
+            self.ring_file = None
+        try:
+            self.mapping.close()
+        except BufferError:
+            # Views handed out are still alive, the mapping goes once they do
+            pass
+
+    def slot(self, tracker_id):
+        """
+        Index of the slot of ``tracker_id``, None if it has none.
+        """
+        index = self.by_tracker.get(tracker_id)
+        if index is None:
+            matches = np.flatnonzero(self.slots['tracker'] == str(tracker_id).encode())
+            if not len(matches):
+                return None
+            index = self.by_tracker[tracker_id] = int(matches[0])
+        return index
+
+    def trackers(self):
+        return [tracker.decode() for tracker in self.slots['tracker'] if tracker]
+
+    def append(self, tracker_id, rows):
+        """
+        Write ``rows`` of COLUMNS values to the slot of ``tracker_id``, False if every slot is taken.
+        """
+        # Other writers may be taking slots and moving counts on as well
+        fcntl.flock(self.ring_file, fcntl.LOCK_EX)
+        try:
+            return self.write(tracker_id, rows)
+        finally:
+            fcntl.flock(self.ring_file, fcntl.LOCK_UN)
+
+    def write(self, tracker_id, rows):
+        index = self.slot(tracker_id)
+        if index is None:
+            free = np.flatnonzero(self.slots['tracker'] == b'')
+            if not len(free):
+                return False
+            index = self.by_tracker[tracker_id] = int(free[0])
+            self.slots['tracker'][index] = str(tracker_id).encode()
+        capacity = self.capacity
+        samples = np.array(rows, dtype=SAMPLE)
+        count = int(self.slots['count'][index])
+        # Only the last capacity of them would survive
+        skipped = max(len(samples) - capacity, 0)
+        samples = samples[skipped:]
+        positions = (count + skipped + np.arange(len(samples))) % capacity
+        ring = self.samples[index]
+        ring[positions] = samples
+        ring[positions + capacity] = samples
+        self.slots['count'][index] = count + len(rows)
+        return True
+
+    def latest(self, tracker_id, seconds=None):
+        """
+        Views of the COLUMNS of the latest samples of ``tracker_id``, all of
+        them the ring holds or those of the last ``seconds`` before the latest.
+        """
+        index = self.slot(tracker_id)
+        if index is None:
+            return empty_columns()
+        capacity = self.capacity
+        count = int(self.slots['count'][index])
+        end = count % capacity + capacity
+        samples = self.samples[index, end - min(count, capacity):end]
+        if seconds is not None and len(samples):
+            times = samples['time']
+            samples = samples[np.searchsorted(times, times[-1] - int(seconds * 1000000000)):]
+        return OrderedDict((name, samples[name]) for name in COLUMNS)
+
+
+class TelemetryRings(object):
+    """
+    The ring files of running heats this process has open, written or read.
+    """
+
+    def __init__(self, root, slots=16, capacity=8192):
+        self.root = root
+        self.slots = slots
+        self.capacity = capacity
+        self.writers = {}
+        self.readers = {}
+        self.lock = threading.Lock()
+
+    def path(self, heat_id):
+        return os.path.join(self.root, "{}{}".format(heat_id, EXTENSION))
+
+    def append(self, heat_id, tracker_id, rows):
+        with self.lock:
+            ring = self.writers.get(str(heat_id))
+            if ring is None:
+                self.close_removed(self.writers)
+                ring = self.writers[str(heat_id)] = TelemetryRing.create(
+                    self.path(heat_id), self.slots, self.capacity)
+            if not ring.append(tracker_id, rows):
+                logger.warning("No ring slot left for tracker {} in heat {}".format(tracker_id, heat_id))
+
+    def reader(self, heat_id):
+        """
+        The ring of ``heat_id`` mapped read only, None if the heat has none.
+        """
+        with self.lock:
+            ring = self.readers.get(str(heat_id))
+            if ring is not None and not os.path.exists(ring.path):
+                # Removed when the heat ended, mapped files stay in memory until closed
+                self.close_removed(self.readers)
+                ring = None
+            if ring is None:
+                try:
+                    ring = self.readers[str(heat_id)] = TelemetryRing.open(self.path(heat_id))
+                except FileNotFoundError:
+                    return None
+            return ring
+
+    def latest(self, heat_id, seconds=None):
+        """
+        Views of the latest samples of every tracker in the ring of ``heat_id`` by tracker id.
+        """
+        ring = self.reader(heat_id)
+        if ring is None:
+            return {}
+        return OrderedDict((tracker_id, ring.latest(tracker_id, seconds)) for tracker_id in ring.trackers())
+
+    def frame(self, heat_id, seconds, points, method=METHODS.lttb):
+        """
+        The latest ``seconds`` of every tracker in the ring of ``heat_id``, each downsampled to ``points``.
+        """
+        return OrderedDict(
+            (tracker_id, downsample(columns, points, method))
+            for tracker_id, columns in self.latest(heat_id, seconds).items())
+
+    def close_removed(self, rings):
+        for heat_id, ring in list(rings.items()):
+            if not os.path.exists(ring.path):
+                del rings[heat_id]
+                ring.close()
+
+    def discard(self, heat_id):
+        """
+        Close and remove the ring of an ended heat, processes that still have it mapped keep their mapping.
+        """
+        with self.lock:
+            for rings in (self.writers, self.readers):
+                ring = rings.pop(str(heat_id), None)
+                if ring is not None:
+                    ring.close()
+            try:
+                os.remove(self.path(heat_id))
+            except FileNotFoundError:
+                pass
+
+
+telemetry_rings = TelemetryRings(
+    settings.TELEMETRY_RING_ROOT, settings.TELEMETRY_RING_SLOTS, settings.TELEMETRY_RING_CAPACITY)
@@ -0,0 +1,282 @@
+"""
+Append-only columnar storage of telemetry samples for each heat and tracker.
+
+Telemetry comes in at hundreds of samples a second per tracker, far too many
+to store as rows. Samples are buffered per heat and tracker and written out
+in chunks to one file per stream, ``<root>/<heat>/<tracker>.tlm``, as typed
+columns laid end to end:
+
+    header | time column | x column | ... | battery column
+
+The header holds the codec the columns are stored with, the number of
+samples and the range of times they cover, so a range read only reads the
+chunks that overlap it. Columns come back as NumPy arrays. Chunks are delta
+coded and bit packed by default, see ``telemetry.codecs``, and the codec is
+recorded per chunk so streams written with another one stay readable.
+
+A stream's samples are written once ``chunk_size`` are waiting or
+``flush_interval`` seconds after the first of them arrived, whichever comes
+first, by a daemon thread when nothing more arrives for the stream.
+``RaceHeat.end`` flushes whatever is left of a heat.
+"""
+
+import logging
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from catalog import Catalog
+from django.conf import settings
+
+from .codecs import decode_columns, encode_columns, pack_columns, unpack_columns
+from .downsample import METHODS, downsample
+
+
+logger = logging.getLogger(__name__)
+
+# UTC nanoseconds the sample was read at, position in millimetres, battery in millivolts
+COLUMNS = OrderedDict([
+    ('time', np.dtype('<i8')),
+    ('x', np.dtype('<i4')),
+    ('y', np.dtype('<i4')),
+    ('z', np.dtype('<i4')),
+    ('rssi', np.dtype('u1')),
+    ('battery', np.dtype('<u2')),
+])
+SAMPLE = np.dtype(list(COLUMNS.items()))
+
+# codec, sample count, first time, last time, body length
+CHUNK = struct.Struct('<BIqqI')
+EXTENSION = '.tlm'
+
+
+class CODECS(Catalog):
+    _attrs = ('value', 'label')
+    raw = (0, 'Little endian columns')
+    delta_varint = (1, 'Delta coded zig-zag varints')
+    delta_packed = (2, 'Delta coded fixed width bits')
+
+
+def encode_raw(samples):
+    return b''.join(np.ascontiguousarray(samples[name]).tobytes() for name in COLUMNS)
+
+
+def decode_raw(body, count):
+    columns = OrderedDict()
+    offset = 0
+    for name, dtype in COLUMNS.items():
+        columns[name] = np.frombuffer(body, dtype, count, offset)
+        offset += count * dtype.itemsize
+    return columns
+
+
+def encode_delta_varint(samples):
+    return encode_columns(samples[name] for name in COLUMNS)
+
+
+def decode_delta_varint(body, count):
+    return OrderedDict(zip(COLUMNS, decode_columns(body, COLUMNS.values())))
+
+
+def encode_delta_packed(samples):
+    return pack_columns(samples[name] for name in COLUMNS)
+
+
+def decode_delta_packed(body, count):
+    return OrderedDict(zip(COLUMNS, unpack_columns(body, count, COLUMNS.values())))
+
+
+# (encode, decode) by codec value
+codecs = {
+    CODECS.raw.value: (encode_raw, decode_raw),
+    CODECS.delta_varint.value: (encode_delta_varint, decode_delta_varint),
+    CODECS.delta_packed.value: (encode_delta_packed, decode_delta_packed),
+}
+
+
+def empty_columns():
+    return OrderedDict((name, np.empty(0, dtype)) for name, dtype in COLUMNS.items())
+
+
+class TelemetryStream(object):
+
+    __slots__ = ('path', 'pending', 'since')
+
+    def __init__(self, path):
+        self.path = path
+        self.pending = []
+        self.since = None
+
+
+class TelemetryStore(object):
+    """
+    Safe to append to from several threads, a stream file is only ever
+    appended to by the process that owns the store.
+
+    With ``flush_interval`` set a daemon thread writes the samples of
+    streams that have waited that long, otherwise they are only written
+    when a chunk fills up or ``flush`` is called.
+    """
+
+    def __init__(self, root, chunk_size=256, flush_interval=1.0, codec=CODECS.delta_packed):
+        self.root = root
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+        self.codec = codec
+        self.streams = {}
+        self.lock = threading.Lock()
+        self.waiting = threading.Condition(self.lock)
+        self.flusher = None
+        self.chunks = 0
+        self.samples = 0
+        self.bytes = 0
+
+    def path(self, heat_id, tracker_id):
+        return os.path.join(self.root, str(heat_id), "{}{}".format(tracker_id, EXTENSION))
+
+    def append(self, heat_id, tracker_id, samples):
+        """
+        Add ``samples`` as tuples of COLUMNS values.
+        """
+        with self.lock:
+            key = (str(heat_id), str(tracker_id))
+            stream = self.streams.get(key)
+            if stream is None:
+                stream = self.streams[key] = TelemetryStream(self.path(heat_id, tracker_id))
+            if not stream.pending:
+                stream.since = time.monotonic()
+            stream.pending.extend(samples)
+            if len(stream.pending) >= self.chunk_size or self.due(stream, time.monotonic()):
+                self.write(stream)
+            elif stream.pending and self.flush_interval:
+                if self.flusher is None:
+                    self.flusher = threading.Thread(target=self.run_flusher, name="telemetry-store", daemon=True)
+                    self.flusher.start()
+                self.waiting.notify()
+
+    def due(self, stream, now):
+        return self.flush_interval is not None and bool(stream.pending) and now - stream.since >= self.flush_interval
+
+    def flush(self, heat_id=None):
+        """
+        Write every buffered sample, or only those of ``heat_id``.
+        """
+        with self.lock:
+            for (stream_heat, _), stream in list(self.streams.items()):
+                if heat_id is None or stream_heat == str(heat_id):
+                    self.write(stream)
+            if heat_id is not None:
+                # Nothing more is expected for an ended heat
+                for key in [key for key in self.streams if key[0] == str(heat_id)]:
+                    del self.streams[key]
+
+    def flush_due(self):
+        """
+        Write the samples of streams that have waited ``flush_interval``, returning how many streams were written.
+        """
+        with self.lock:
+            now = time.monotonic()
+            due = [stream for stream in self.streams.values() if self.due(stream, now)]
+            for stream in due:
+                self.write(stream)
+            return len(due)
+
+    def run_flusher(self):
+        while True:
+            with self.lock:
+                while not any(stream.pending for stream in self.streams.values()):
+                    self.waiting.wait()
+            # The streams pending now are due by the time this is up
+            time.sleep(self.flush_interval)
+            try:
+                self.flush_due()
+            except Exception:
+                logger.exception("Failed to write buffered telemetry")
+
+    def write(self, stream):
+        if not stream.pending:
+            return
+        samples = np.array(stream.pending, dtype=SAMPLE)
+        stream.pending = []
+        samples = samples[np.argsort(samples['time'], kind='mergesort')]
+        encode, _ = codecs[self.codec.value]
+        body = encode(samples)
+        header = CHUNK.pack(self.codec.value, len(samples), samples['time'][0], samples['time'][-1], len(body))
+        os.makedirs(os.path.dirname(stream.path), exist_ok=True)
+        with open(stream.path, 'ab') as chunk_file:
+            chunk_file.write(header + body)
+        self.chunks += 1
+        self.samples += len(samples)
+        self.bytes += len(header) + len(body)
+
+    def read(self, heat_id, tracker_id, start=None, end=None, points=None, method=METHODS.lttb):
+        """
+        Columns of the samples from ``start`` up to and including ``end``, as
+        UTC nanoseconds, in time order. Samples still buffered are included.
+        With ``points`` they are downsampled to at most that many by ``method``.
+        """
+        path = self.path(heat_id, tracker_id)
+        # Chunks are written whole under the lock, so the file up to its length then and the samples
+        # still buffered are every sample once. Reading and decoding can then go on without holding up appends.
+        with self.lock:
+            length = os.path.getsize(path) if os.path.exists(path) else 0
+            stream = self.streams.get((str(heat_id), str(tracker_id)))
+            pending = np.array(stream.pending, dtype=SAMPLE) if stream is not None and stream.pending else None
+        parts = []
+        if length:
+            with open(path, 'rb') as chunk_file:
+                parts.extend(read_chunks(chunk_file, start, end, length))
+        if pending is not None:
+            parts.append(OrderedDict((name, pending[name]) for name in COLUMNS))
+        if not parts:
+            return empty_columns()
+        columns = OrderedDict((name, np.concatenate([part[name] for part in parts])) for name in COLUMNS)
+        times = columns['time']
+        keep = np.ones(len(times), dtype=bool)
+        if start is not None:
+            keep &= times >= start
+        if end is not None:
+            keep &= times <= end
+        order = np.argsort(times[keep], kind='mergesort')
+        return downsample(
+            OrderedDict((name, column[keep][order]) for name, column in columns.items()), points, method)
+
+    def trackers(self, heat_id):
+        """
+        Ids of the trackers with telemetry stored for a heat.
+        """
+        directory = os.path.join(self.root, str(heat_id))
+        if not os.path.isdir(directory):
+            return []
+        return sorted(name[:-len(EXTENSION)] for name in os.listdir(directory) if name.endswith(EXTENSION))
+
+    def stats(self):
+        return {'chunks': self.chunks, 'samples': self.samples, 'bytes': self.bytes}
+
+
+def read_chunks(chunk_file, start=None, end=None, until=None):
+    """
+    Decode the chunks of a stream file that overlap ``start`` to ``end``, skipping over the rest.
+    With ``until`` chunks from that far into the file on are left out.
+    """
+    while until is None or chunk_file.tell() < until:
+        header = chunk_file.read(CHUNK.size)
+        if len(header) < CHUNK.size:
+            return
+        codec, count, first, last, length = CHUNK.unpack(header)
+        if (start is not None and last < start) or (end is not None and first > end):
+            chunk_file.seek(length, os.SEEK_CUR)
+            continue
+        body = chunk_file.read(length)
+        if len(body) < length:
+            # Cut short by a write in progress
+            return
+        _, decode = codecs[codec]
+        yield decode(body, count)
+
+
+telemetry_store = TelemetryStore(
+    settings.TELEMETRY_ROOT, settings.TELEMETRY_CHUNK_SIZE, settings.TELEMETRY_FLUSH_INTERVAL)
@@ -0,0 +1,216 @@
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from .codecs import decode_columns, decode_varints, encode_columns, encode_varints, pack_columns, unpack_columns
+from .downsample import METHODS, downsample, lttb, min_max
+from .rings import TelemetryRing, TelemetryRings
+from .store import CHUNK, CODECS, TelemetryStore, read_chunks
+
+
+def samples(times):
+    return [(time, time * 2, -time, 1000, 90, 16000 - time) for time in times]
+
+
+class TestTelemetryStore(SimpleTestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.store = TelemetryStore(self.root, chunk_size=4, flush_interval=None, codec=CODECS.raw)
+
+    def test_writes_full_chunks(self):
+        self.store.append('heat', 'tracker', samples(range(3)))
+        self.assertFalse(os.path.exists(self.store.path('heat', 'tracker')))
+        self.store.append('heat', 'tracker', samples(range(3, 6)))
+        self.assertEqual(self.store.stats()['chunks'], 1)
+        self.assertEqual(self.store.stats()['samples'], 6)
+        self.assertEqual(self.store.trackers('heat'), ['tracker'])
+
+    def test_reads_stored_and_buffered_samples_in_order(self):
+        self.store.append('heat', 'tracker', samples([5, 4, 6, 7]))
+        self.store.append('heat', 'tracker', samples([8, 9]))
+        columns = self.store.read('heat', 'tracker')
+        np.testing.assert_array_equal(columns['time'], np.arange(4, 10))
+        np.testing.assert_array_equal(columns['x'], np.arange(4, 10) * 2)
+        self.assertEqual(columns['battery'].dtype, np.dtype('<u2'))
+
+    def test_writes_waiting_samples_after_the_interval(self):
+        self.store.flush_interval = 0.01
+        self.store.append('heat', 'tracker', samples(range(3)))
+        for _ in range(100):
+            if self.store.stats()['chunks']:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.store.stats()['samples'], 3)
+        np.testing.assert_array_equal(self.store.read('heat', 'tracker')['time'], np.arange(3))
+
+    def test_range_read_skips_chunks(self):
+        for first in range(0, 12, 4):
+            self.store.append('heat', 'tracker', samples(range(first, first + 4)))
+        columns = self.store.read('heat', 'tracker', start=5, end=6)
+        np.testing.assert_array_equal(columns['time'], [5, 6])
+        self.assertEqual(os.path.getsize(self.store.path('heat', 'tracker')), self.store.stats()['bytes'])
+        self.assertEqual(self.store.stats()['bytes'], 3 * (CHUNK.size + 4 * 23))
+
+    def test_reads_chunks_up_to_a_length(self):
+        self.store.append('heat', 'tracker', samples(range(4)))
+        length = os.path.getsize(self.store.path('heat', 'tracker'))
+        self.store.append('heat', 'tracker', samples(range(4, 8)))
+        with open(self.store.path('heat', 'tracker'), 'rb') as chunk_file:
+            chunks = list(read_chunks(chunk_file, until=length))
+        self.assertEqual(len(chunks), 1)
+        np.testing.assert_array_equal(chunks[0]['time'], np.arange(4))
+
+    def test_missing_stream(self):
+        self.assertEqual(len(self.store.read('heat', 'other')['time']), 0)
+        self.assertEqual(self.store.trackers('other'), [])
+
+    def test_read_downsampled(self):
+        self.store.append('heat', 'tracker', samples(range(20)))
+        read = self.store.read('heat', 'tracker', start=2, points=5)
+        self.assertEqual(len(read['time']), 5)
+        self.assertEqual((read['time'][0], read['time'][-1]), (2, 19))
+        np.testing.assert_array_equal(read['x'], read['time'] * 2)
+
+    def test_reads_chunks_of_either_codec(self):
+        self.store.append('heat', 'tracker', samples(range(4)))
+        self.store.codec = CODECS.delta_varint
+        self.store.append('heat', 'tracker', samples(range(4, 8)))
+        self.store.codec = CODECS.delta_packed
+        self.store.append('heat', 'tracker', samples(range(8, 12)))
+        np.testing.assert_array_equal(self.store.read('heat', 'tracker')['y'], -np.arange(12))
+
+
+class TestCodecs(SimpleTestCase):
+
+    def test_varints(self):
+        values = np.array([0, 1, 127, 128, 300, 2 ** 64 - 1], dtype=np.uint64)
+        self.assertEqual(encode_varints([300]), b'\xac\x02')
+        np.testing.assert_array_equal(decode_varints(encode_varints(values)), values)
+
+    def test_round_trips_columns(self):
+        times = 1476700000000000000 + np.cumsum(np.random.randint(0, 5000000, 1000)).astype(np.int64)
+        x = np.random.randint(-2 ** 31, 2 ** 31 - 1, 1000).astype(np.int32)
+        rssi = np.random.randint(0, 255, 1000).astype(np.uint8)
+        dtypes = [times.dtype, x.dtype, rssi.dtype]
+        for count in (0, 1, 2, 1000):
+            columns = [times[:count], x[:count], rssi[:count]]
+            for decoded in (decode_columns(encode_columns(columns), dtypes),
+                            unpack_columns(pack_columns(columns), count, dtypes)):
+                for column, original in zip(decoded, columns):
+                    self.assertEqual(column.dtype, original.dtype)
+                    np.testing.assert_array_equal(column, original)
+
+    def test_small_deltas_take_a_byte(self):
+        self.assertEqual(len(encode_columns([np.arange(100, 200)])), 4 + 2 + 99)
+
+    def test_even_spacing_packs_to_nothing(self):
+        times = 1476700000000000000 + np.arange(256, dtype=np.int64) * 4000000
+        # Order and width, then the first time and the spacing as varints
+        self.assertEqual(len(pack_columns([times])), 2 + 9 + 4)
+
+
+class TestTelemetryRings(SimpleTestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.rings = TelemetryRings(self.root, slots=2, capacity=8)
+
+    def test_readers_share_the_writers_samples(self):
+        self.rings.append('heat', 'tracker', samples(range(5)))
+        reader = TelemetryRing.open(self.rings.path('heat'))
+        self.addCleanup(reader.close)
+        self.assertEqual(reader.trackers(), ['tracker'])
+        np.testing.assert_array_equal(reader.latest('tracker')['time'], np.arange(5))
+        self.rings.append('heat', 'tracker', samples(range(5, 7)))
+        np.testing.assert_array_equal(reader.latest('tracker')['time'], np.arange(7))
+
+    def test_writers_share_one_ring(self):
+        other = TelemetryRings(self.root, slots=2, capacity=8)
+        self.addCleanup(other.discard, 'heat')
+        self.rings.append('heat', 'one', samples(range(3)))
+        other.append('heat', 'two', samples(range(2)))
+        other.append('heat', 'one', samples(range(3, 5)))
+        self.rings.append('heat', 'one', samples(range(5, 6)))
+        latest = TelemetryRings(self.root).latest('heat')
+        self.assertEqual(list(latest), ['one', 'two'])
+        np.testing.assert_array_equal(latest['one']['time'], np.arange(6))
+        np.testing.assert_array_equal(latest['two']['time'], np.arange(2))
+        self.assertEqual(os.listdir(self.root), ['heat.ring'])
+
+    def test_latest_are_contiguous_views_across_the_wrap(self):
+        for start in range(0, 21, 3):
+            self.rings.append('heat', 'tracker', samples(range(start, start + 3)))
+        latest = self.rings.latest('heat')['tracker']
+        np.testing.assert_array_equal(latest['time'], np.arange(13, 21))
+        self.assertTrue(np.may_share_memory(latest['x'], latest['time']))
+        self.assertFalse(latest['x'].flags.writeable)
+
+    def test_latest_seconds(self):
+        self.rings.append('heat', 'tracker', [(time * 500000000, 0, 0, 0, 90, 16000) for time in range(6)])
+        latest = self.rings.reader('heat').latest('tracker', seconds=1)
+        np.testing.assert_array_equal(latest['time'], np.arange(3, 6) * 500000000)
+
+    def test_full_ring_keeps_other_trackers_out(self):
+        for tracker in ('one', 'two', 'three'):
+            self.rings.append('heat', tracker, samples(range(20)))
+        ring = self.rings.reader('heat')
+        self.assertEqual(ring.trackers(), ['one', 'two'])
+        np.testing.assert_array_equal(ring.latest('two')['time'], np.arange(12, 20))
+        self.assertEqual(len(ring.latest('three')['time']), 0)
+
+    def test_frame_downsamples_every_tracker(self):
+        self.rings.append('heat', 'one', samples(range(8)))
+        self.rings.append('heat', 'two', samples(range(2)))
+        frame = self.rings.frame('heat', seconds=None, points=4)
+        self.assertEqual([len(frame[tracker]['time']) for tracker in ('one', 'two')], [4, 2])
+
+    def test_discard_removes_ring(self):
+        self.rings.append('heat', 'tracker', samples(range(3)))
+        self.rings.discard('heat')
+        self.assertFalse(os.path.exists(self.rings.path('heat')))
+        self.assertIsNone(self.rings.reader('heat'))
+        self.assertEqual(self.rings.latest('heat'), {})
+
+
+class TestDownsample(SimpleTestCase):
+
+    def setUp(self):
+        turn = np.linspace(0, 2 * np.pi, 1000)
+        self.x = (np.cos(turn) * 20000).astype(np.int32)
+        self.y = (np.sin(turn) * 20000).astype(np.int32)
+        self.z = np.full(1000, 1500, dtype=np.int32)
+
+    def test_lttb_keeps_ends_and_corners(self):
+        self.z[600] += 5000
+        picked = lttb([self.x, self.y, self.z], 50)
+        self.assertEqual(len(picked), 50)
+        self.assertEqual((picked[0], picked[-1]), (0, 999))
+        self.assertTrue((np.diff(picked) > 0).all())
+        self.assertIn(600, picked)
+
+    def test_lttb_of_one_column(self):
+        values = np.zeros(100)
+        values[37] = 1
+        self.assertIn(37, lttb([values], 10))
+
+    def test_min_max_keeps_extremes(self):
+        picked = min_max(self.y, 20)
+        self.assertLessEqual(len(picked), 20)
+        self.assertEqual(self.y[picked].min(), self.y.min())
+        self.assertEqual(self.y[picked].max(), self.y.max())
+
+    def test_min_max_under_two_points(self):
+        np.testing.assert_array_equal(min_max(self.y, 1), [np.argmax(self.y)])
+        self.assertEqual(len(min_max(self.y, 0)), 0)
+
+    def test_downsample_leaves_what_fits(self):
+        columns = {'time': np.arange(10), 'rssi': np.arange(10) % 3}
+        self.assertIs(downsample(columns, 10), columns)
+        self.assertEqual(len(downsample(columns, 4, METHODS.min_max)['time']), 4)
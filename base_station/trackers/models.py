@@ -12,6 +12,16 @@ class TRACKER_TYPES(Catalog):
     ilap = (2, 'iLap', 'ilap')
 
 
+class TrackerQuerySet(models.QuerySet):
+
+    def by_transponder(self, tracker_type, transponder_ids):
+        """
+        Map transponder ids to their trackers for a single type of tracker hardware.
+        """
+        trackers = self.filter(tracker_type=tracker_type, transponder_id__in=transponder_ids)
+        return {tracker.transponder_id: tracker for tracker in trackers}
+
+
 class Tracker(SyncModel, TimeStampedModel):
     """
     Represents a peices of tracker hardware that is transmitting from a vehicle.
@@ -27,5 +37,7 @@ class Tracker(SyncModel, TimeStampedModel):
         choices=TRACKER_TYPES._zip('value', 'label'),
         default=TRACKER_TYPES.unknown.value)
 
+    objects = TrackerQuerySet.as_manager()
+
     def __str__(self):
         return "{!s} - {!s}".format(self.transponder_id, self.get_tracker_type_display())
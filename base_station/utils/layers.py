@@ -0,0 +1,15 @@
+from channels import channel_layers
+from django.core.management.base import CommandError
+
+
+def cross_process_layer(alias):
+    """
+    The channel layer ``alias`` for a command sending to consumers that run
+    in another process, refusing layers that only exist inside one process.
+    """
+    channel_layer = channel_layers[alias]
+    if channel_layer.local_only():
+        raise CommandError(
+            "The '{}' channel layer only exists inside one process, messages sent on it never reach the "
+            "worker. Configure a cross-process layer such as asgi_redis in CHANNEL_LAYERS.".format(alias))
+    return channel_layer
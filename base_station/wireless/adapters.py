@@ -1,34 +1,60 @@
+import errno
 import logging
-# import pyserial
-import serial
-# import json
-
-from channels import Channel
-from django.conf import settings
-
-
-logger = logging.getLogger('wireless adapters')
-
+import os
 
-# Open the serial interface
-serial_interface = serial.Serial(
-    settings.SERIAL_INTERFACE,
-    settings.SERIAL_BAUD,
-    timeout=60)
-
-# FIX: this won't work
-
-def serial_response_encode(response):
-    return {'response': response}
-
-try:
-    while 1:
-        response = serial_interface.readline()
-        if response:
-            Channel('wireless.packet').send(serial_response_encode(response))
-except Exception as e:
-    logger.error(e)
-    serial_interface.close()
+import serial
 
 
-# TODO, send a wireless message
+logger = logging.getLogger(__name__)
+
+
+class SerialPortAdapter(object):
+    """
+    Non-blocking wrapper around a serial receiver for use inside an event loop.
+
+    pyserial is only used to open and configure the device, reads and writes go
+    straight to the file descriptor so they never wait on the receiver.
+    """
+
+    def __init__(self, interface, baud):
+        self.interface = interface
+        self.baud = baud
+        self.port = None
+
+    def open(self):
+        self.port = serial.Serial(self.interface, self.baud, timeout=0)
+        logger.info("Opened serial interface {} at {} baud".format(self.interface, self.baud))
+        return self
+
+    def close(self):
+        if self.port is not None:
+            self.port.close()
+            self.port = None
+
+    def fileno(self):
+        return self.port.fileno()
+
+    def readinto(self, view):
+        """
+        Read whatever is waiting on the port straight into ``view`` and return
+        the number of bytes read, zero if a wakeup had nothing to read.
+        Raises OSError once the receiver has hung up.
+        """
+        try:
+            count = os.readv(self.fileno(), (view,))
+        except BlockingIOError:
+            return 0
+        if not count and len(view):
+            # Readable with nothing to read is end of file, the device is gone
+            raise OSError(errno.EIO, "{} hung up".format(self.interface))
+        return count
+
+    def write(self, data):
+        """
+        Write as much of ``data`` as the port will take without blocking and
+        return the number of bytes written.
+        """
+        try:
+            return os.write(self.fileno(), data)
+        except BlockingIOError:
+            return 0
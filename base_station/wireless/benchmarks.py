@@ -0,0 +1,247 @@
+"""
+End to end benchmark of the wireless ingest path.
+
+Reads, either recorded in a capture log or made up by a simulated fleet, are
+pushed through every stage a packet goes through on race day:
+
+:decode: the receiver's decoder over a reusable receive buffer.
+:detect: reducing the detections to gate passes.
+:channel: a send and receive through the in-memory channel layer.
+:consume: the ``wireless.packet`` consumer itself, resolving trackers,
+    storing telemetry, updating the heat's live state, storing the laps it
+    completes, buffering HeatEvents and broadcasting the standings.
+:persist: writing the buffered HeatEvents and telemetry at the end.
+
+Each stage is timed per batch, giving throughput and p50/p99 latency, and
+``sys.getallocatedblocks`` is sampled around it to give the number of
+objects per frame still alive when the stage hands its output on. Database
+work happens inside a transaction that is rolled back and telemetry goes to
+a temporary directory, so a benchmark can be pointed at a local Postgres
+without leaving anything behind.
+"""
+
+import gc
+import shutil
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from asgiref.inmemory import ChannelLayer
+from channels.message import Message
+from django.db import transaction
+from django.utils.timezone import now
+
+from base_station.events.models import Event, EventTemplate
+from base_station.races.live import live_heats
+from base_station.races.models import RaceHeat
+from base_station.races.writers import HeatEventWriter
+from base_station.telemetry.rings import TelemetryRings
+from base_station.telemetry.store import TelemetryStore
+from base_station.trackers.models import Tracker
+
+from .buffers import ReceiveBuffer
+from .capture import CaptureReader
+from .clock import WallClock, monotonic_ns
+from .consumers import packet
+from .decoders import Detection, get_decoder
+from .gates import GatePassDetector
+from .simulation import Fleet
+
+
+STAGES = ('decode', 'detect', 'channel', 'consume', 'persist')
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(int(round(percent / 100.0 * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+class StageStats(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.frames = 0
+        self.blocks = 0
+
+    def add(self, seconds, frames, blocks):
+        self.latencies.append(seconds)
+        self.frames += frames
+        self.blocks += blocks
+
+    def report(self):
+        elapsed = sum(self.latencies)
+        return OrderedDict((
+            ('stage', self.name),
+            ('frames', self.frames),
+            ('frames_per_second', self.frames / elapsed if elapsed else 0.0),
+            ('p50_ms', percentile(self.latencies, 50) * 1000),
+            ('p99_ms', percentile(self.latencies, 99) * 1000),
+            ('blocks_per_frame', self.blocks / self.frames if self.frames else 0.0),
+        ))
+
+
+def fleet_reads(tracker_type, count=8, laps=10, gates=1, read_size=256, seed=1):
+    """
+    Receivers and ``(receiver index, UTC read time, data)`` reads for a
+    simulated race, the frames are split into reads of ``read_size`` bytes
+    with whatever is left of each gate's frames read last.
+    """
+    encode = get_decoder(tracker_type).encode
+    clock = WallClock()
+    started = monotonic_ns()
+    pending = [bytearray() for _ in range(gates)]
+    last_read = [None] * gates
+    reads = []
+    for simulated in Fleet(count, laps=laps, gates=gates, seed=seed).detections():
+        data = pending[simulated.gate]
+        data += encode(simulated.detection)
+        wall = last_read[simulated.gate] = clock.to_wall(started + int(simulated.time * 1000000000))
+        if len(data) >= read_size:
+            reads.append((simulated.gate, wall, bytes(data)))
+            del data[:]
+    for gate, data in enumerate(pending):
+        if data:
+            reads.append((gate, last_read[gate], bytes(data)))
+    receivers = [('gate-{}'.format(gate), tracker_type) for gate in range(gates)]
+    return receivers, reads
+
+
+def capture_reads(path):
+    reader = CaptureReader(path)
+    return reader.receivers, [(index, wall, bytes(data)) for index, received, wall, data in reader]
+
+
+class IngestBenchmark(object):
+
+    def __init__(self, receivers, reads):
+        self.receivers = receivers
+        self.reads = reads
+        self.channel_layer = ChannelLayer()
+        # Flushed in the benchmark's own transaction rather than from a background thread
+        self.writer = HeatEventWriter(interval=None)
+        self.stats = OrderedDict((stage, StageStats(stage)) for stage in STAGES)
+
+    def transponder_ids(self):
+        """
+        Transponder ids seen per tracker type, so the trackers can exist before timing starts.
+        """
+        seen = {}
+        for receiver, data in self.decoded_reads():
+            seen.setdefault(receiver[1].value, set()).update(record.transponder_id for record in data)
+        return seen
+
+    def decoded_reads(self):
+        decoders = [(get_decoder(tracker_type), ReceiveBuffer()) for name, tracker_type in self.receivers]
+        for index, wall, data in self.reads:
+            decoder, buffer = decoders[index]
+            buffer.free[:len(data)] = data
+            buffer.filled(len(data))
+            records, consumed = decoder.decode(buffer)
+            buffer.consume(consumed)
+            yield self.receivers[index], records
+
+    def setup_heat(self):
+        started = now()
+        template = EventTemplate.objects.create(name="Ingest benchmark")
+        event = Event.objects.create(
+            title="Ingest benchmark", start=started, end=started + timedelta(hours=1),
+            template=template, recurrences='')
+        for tracker_type, transponder_ids in self.transponder_ids().items():
+            Tracker.objects.bulk_create(
+                Tracker(tracker_type=tracker_type, transponder_id=transponder_id)
+                for transponder_id in transponder_ids)
+        return RaceHeat.objects.create(event=event, started_time=started)
+
+    def run(self):
+        root = tempfile.mkdtemp(prefix='ingest-benchmark-')
+        self.store = TelemetryStore(root)
+        self.rings = TelemetryRings(root)
+        try:
+            with transaction.atomic():
+                heat = self.setup_heat()
+                gc.collect()
+                gc.disable()
+                try:
+                    self.run_pipeline(heat)
+                finally:
+                    gc.enable()
+                    transaction.set_rollback(True)
+                    live_heats.discard(heat)
+                    self.rings.discard(heat.pk)
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+        return [stats.report() for stats in self.stats.values()]
+
+    def run_pipeline(self, heat):
+        decoders = [
+            (get_decoder(tracker_type), ReceiveBuffer(), GatePassDetector())
+            for name, tracker_type in self.receivers]
+        channel_layer = self.channel_layer
+        stats = self.stats
+        clock = time.perf_counter
+        blocks = sys.getallocatedblocks
+        records = passes = message = None
+        for index, wall, data in self.reads:
+            name, tracker_type = self.receivers[index]
+            decoder, buffer, detector = decoders[index]
+            buffer.free[:len(data)] = data
+            buffer.filled(len(data))
+
+            start_blocks, start = blocks(), clock()
+            records, consumed = decoder.decode(buffer)
+            buffer.consume(consumed)
+            end, end_blocks = clock(), blocks()
+            stats['decode'].add(end - start, len(records), end_blocks - start_blocks)
+            if not records:
+                continue
+
+            start_blocks, start = blocks(), clock()
+            # Only detections make gate passes, as in the serial server
+            detections = [record for record in records if isinstance(record, Detection)]
+            passes = detector.feed(detections, [wall] * len(detections))
+            end, end_blocks = clock(), blocks()
+            stats['detect'].add(end - start, len(records), end_blocks - start_blocks)
+
+            start_blocks, start = blocks(), clock()
+            channel_layer.send('wireless.packet', {
+                'receiver': name,
+                'tracker_type': tracker_type.value,
+                'packets': records,
+                'received': [wall] * len(records),
+                'passes': passes,
+            })
+            channel, message = channel_layer.receive_many(['wireless.packet'])
+            end, end_blocks = clock(), blocks()
+            stats['channel'].add(end - start, len(records), end_blocks - start_blocks)
+
+            self.consume(message, len(records))
+
+            # Free this batch outside of the measurements so it isn't counted against the next one
+            records = detections = passes = message = None
+
+        for (name, tracker_type), (decoder, buffer, detector) in zip(self.receivers, decoders):
+            passes = detector.finish()
+            if passes:
+                self.consume({
+                    'receiver': name, 'tracker_type': tracker_type.value, 'packets': [], 'received': [],
+                    'passes': passes}, 0)
+
+        start_blocks, start = blocks(), clock()
+        self.writer.flush()
+        self.store.flush()
+        end, end_blocks = clock(), blocks()
+        # The frames were already counted as they were consumed
+        stats['persist'].add(end - start, 0, end_blocks - start_blocks)
+
+    def consume(self, content, frames):
+        start_blocks, start = sys.getallocatedblocks(), time.perf_counter()
+        packet(
+            Message(content, 'wireless.packet', self.channel_layer),
+            writer=self.writer, store=self.store, rings=self.rings)
+        end, end_blocks = time.perf_counter(), sys.getallocatedblocks()
+        self.stats['consume'].add(end - start, frames, end_blocks - start_blocks)
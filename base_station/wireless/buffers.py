@@ -0,0 +1,136 @@
+import threading
+
+from catalog import Catalog
+
+
+class ReceiveBuffer(object):
+    """
+    Fixed size receive buffer that is reused for every read from a port.
+
+    Decoders parse straight out of ``data``/``view`` and report how many
+    bytes they consumed, only an unfinished trailing frame is ever moved.
+    """
+
+    def __init__(self, size=65536):
+        self.data = bytearray(size)
+        self.view = memoryview(self.data)
+        self.length = 0
+
+    @property
+    def free(self):
+        return self.view[self.length:]
+
+    def filled(self, count):
+        self.length += count
+
+    def consume(self, count):
+        """
+        Drop ``count`` bytes from the front of the buffer.
+        """
+        remaining = self.length - count
+        if remaining > 0:
+            self.data[:remaining] = self.view[count:self.length]
+        self.length = max(remaining, 0)
+
+    def clear(self):
+        self.length = 0
+
+
+class OVERFLOW_POLICIES(Catalog):
+    _attrs = ('value', 'label')
+    block = (0, 'Refuse new entries until there is room')
+    drop_oldest = (1, 'Overwrite the oldest entry')
+    coalesce = (2, 'Replace a queued entry with the same key, otherwise overwrite the oldest')
+
+
+class PacketRing(object):
+    """
+    Bounded, preallocated queue of packets shared between the serial reader
+    and the dispatcher thread that sends them to the channel layer.
+
+    When the ring is full ``put`` follows the overflow policy, with ``block``
+    it returns False so the reader can stop reading and leave packets in the
+    OS serial buffer until the dispatcher catches up. ``coalesce`` needs a
+    ``key`` function and keeps only the latest packet per key under pressure.
+    """
+
+    def __init__(self, capacity, policy=OVERFLOW_POLICIES.block, key=None):
+        if policy == OVERFLOW_POLICIES.coalesce and key is None:
+            raise ValueError("Coalescing ring buffers need a key function")
+        self.slots = [None] * capacity
+        self.capacity = capacity
+        self.policy = policy
+        self.key = key
+        self.keys = {}
+        self.head = 0
+        self.count = 0
+        self.lock = threading.Lock()
+        # Accounting
+        self.high_water = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.refused = 0
+
+    def __len__(self):
+        return self.count
+
+    def put(self, item):
+        """
+        Queue an item, returning False if it was refused because the ring is full.
+        """
+        with self.lock:
+            if self.count == self.capacity:
+                if self.policy == OVERFLOW_POLICIES.block:
+                    self.refused += 1
+                    return False
+                if self.policy == OVERFLOW_POLICIES.coalesce:
+                    slot = self.keys.get(self.key(item))
+                    if slot is not None:
+                        self.slots[slot] = item
+                        self.coalesced += 1
+                        return True
+                self.drop_oldest()
+            slot = (self.head + self.count) % self.capacity
+            self.slots[slot] = item
+            self.count += 1
+            if self.key is not None:
+                self.keys[self.key(item)] = slot
+            if self.count > self.high_water:
+                self.high_water = self.count
+            return True
+
+    def drop_oldest(self):
+        self.release(self.head)
+        self.head = (self.head + 1) % self.capacity
+        self.count -= 1
+        self.dropped += 1
+
+    def release(self, slot):
+        item = self.slots[slot]
+        self.slots[slot] = None
+        if self.key is not None:
+            key = self.key(item)
+            if self.keys.get(key) == slot:
+                del self.keys[key]
+        return item
+
+    def drain(self, limit=None):
+        """
+        Remove and return up to ``limit`` of the oldest items.
+        """
+        with self.lock:
+            count = self.count if limit is None else min(limit, self.count)
+            items = [self.release((self.head + offset) % self.capacity) for offset in range(count)]
+            self.head = (self.head + count) % self.capacity
+            self.count -= count
+            return items
+
+    def stats(self):
+        return {
+            'size': self.count,
+            'capacity': self.capacity,
+            'high_water': self.high_water,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'refused': self.refused,
+        }
@@ -0,0 +1,166 @@
+"""
+Append-only capture logs of the raw bytes read from each receiver.
+
+A log starts with a header naming the receivers it holds, followed by one
+record per read: the monotonic time it was read at, the receiver index and
+the bytes exactly as they came off the port. Clock records carry the
+monotonic to UTC offset whenever the serial server resynchronises its clock,
+so read times can be mapped back onto wall clock time.
+
+Logs are replayed into a serial device (usually one end of the pty pair made
+by ``script/fake_serial``) or decoded straight into the channel layer.
+"""
+
+import struct
+import time
+
+from base_station.trackers.models import TRACKER_TYPES
+
+from .buffers import ReceiveBuffer
+from .decoders import Detection, get_decoder
+from .gates import GatePassDetector
+
+
+CAPTURE_MAGIC = b'BSCAP\x02'
+# receiver count
+CAPTURE_HEADER = struct.Struct('<B')
+# tracker type, name length
+CAPTURE_RECEIVER = struct.Struct('<BB')
+# monotonic read time in nanoseconds, receiver index, data length
+CAPTURE_RECORD = struct.Struct('<qBI')
+# Record headers by log version, the first had too short a length for a full ReceiveBuffer read
+CAPTURE_RECORDS = {
+    b'BSCAP\x01': struct.Struct('<qBH'),
+    CAPTURE_MAGIC: CAPTURE_RECORD,
+}
+# monotonic to UTC offset in nanoseconds
+CAPTURE_CLOCK = struct.Struct('<q')
+CLOCK_RECORD = 0xFF
+
+
+class CaptureWriter(object):
+
+    def __init__(self, path, receivers):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.file.write(CAPTURE_MAGIC)
+        self.file.write(CAPTURE_HEADER.pack(len(receivers)))
+        for receiver in receivers:
+            name = receiver.name.encode('utf-8')
+            self.file.write(CAPTURE_RECEIVER.pack(receiver.tracker_type.value, len(name)))
+            self.file.write(name)
+
+    def write(self, index, received, data):
+        self.file.write(CAPTURE_RECORD.pack(received, index, len(data)))
+        self.file.write(data)
+
+    def write_clock(self, received, offset):
+        self.file.write(CAPTURE_RECORD.pack(received, CLOCK_RECORD, CAPTURE_CLOCK.size))
+        self.file.write(CAPTURE_CLOCK.pack(offset))
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class CaptureReader(object):
+    """
+    Iterates over the reads in a capture log as ``(receiver index, monotonic
+    read time, UTC read time, data)`` tuples, reading the log a record at a
+    time so logs of a whole race day don't have to fit in memory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as capture:
+            self.record = CAPTURE_RECORDS.get(capture.read(len(CAPTURE_MAGIC)))
+            if self.record is None:
+                raise ValueError("{} is not a serial capture log".format(path))
+            count, = CAPTURE_HEADER.unpack(capture.read(CAPTURE_HEADER.size))
+            self.receivers = []
+            for _ in range(count):
+                tracker_type, length = CAPTURE_RECEIVER.unpack(capture.read(CAPTURE_RECEIVER.size))
+                name = capture.read(length).decode('utf-8')
+                self.receivers.append((name, TRACKER_TYPES(tracker_type)))
+            self.start = capture.tell()
+
+    def __iter__(self):
+        record = self.record
+        offset = 0
+        with open(self.path, 'rb') as capture:
+            capture.seek(self.start)
+            while True:
+                header = capture.read(record.size)
+                if len(header) < record.size:
+                    return
+                received, index, length = record.unpack(header)
+                data = capture.read(length)
+                if len(data) < length:
+                    # Truncated by the server being killed mid write
+                    return
+                if index == CLOCK_RECORD:
+                    offset, = CAPTURE_CLOCK.unpack(data)
+                else:
+                    yield index, received, received + offset, data
+
+
+def paced(reader, speed=1.0):
+    """
+    Yield the reads from a capture spaced out as they were recorded, ``speed``
+    times faster. A speed of zero yields them as fast as possible.
+    """
+    first = None
+    started = time.monotonic()
+    for record in reader:
+        if speed:
+            received = record[1]
+            if first is None:
+                first = received
+            delay = started + (received - first) / 1e9 / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        yield record
+
+
+class ChannelReplay(object):
+    """
+    Decodes captured reads and sends them to the channel layer as the serial server would.
+    """
+
+    def __init__(self, channel_layer, receivers):
+        self.channel_layer = channel_layer
+        self.receivers = [
+            (name, tracker_type, get_decoder(tracker_type), ReceiveBuffer(), GatePassDetector())
+            for name, tracker_type in receivers]
+
+    def feed(self, index, wall, data):
+        name, tracker_type, decoder, buffer, detector = self.receivers[index]
+        buffer.free[:len(data)] = data
+        buffer.filled(len(data))
+        records, consumed = decoder.decode(buffer)
+        buffer.consume(consumed)
+        detections = [record for record in records if isinstance(record, Detection)]
+        passes = detector.feed(detections, [wall] * len(detections))
+        if records or passes:
+            self.send(name, tracker_type, records, [wall] * len(records), passes)
+        return len(records)
+
+    def finish(self):
+        """
+        Send the passes still in progress at the end of the capture.
+        """
+        for name, tracker_type, decoder, buffer, detector in self.receivers:
+            passes = detector.finish()
+            if passes:
+                self.send(name, tracker_type, [], [], passes)
+
+    def send(self, name, tracker_type, records, received, passes):
+        self.channel_layer.send('wireless.packet', {
+            'receiver': name,
+            'tracker_type': tracker_type.value,
+            'packets': records,
+            'received': received,
+            'passes': passes,
+        })
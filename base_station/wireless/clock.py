@@ -0,0 +1,114 @@
+"""
+Receive timestamps for packets.
+
+Packets are stamped with the monotonic clock as soon as they are read, which
+can't jump when NTP steps the system clock. ``WallClock`` keeps the offset
+between the monotonic clock and UTC so stamps can be turned into wall clock
+times off the read path.
+
+Telemetry samples carry the transponder's own timestamp as well, and
+``TransponderClock`` places them by it so the serial server's batching of
+reads doesn't jitter their times.
+"""
+
+import time
+from datetime import datetime, timedelta, timezone
+
+from .gates import clock_delta
+
+
+try:
+    monotonic_ns = time.monotonic_ns
+except AttributeError:
+    def monotonic_ns():
+        return int(time.monotonic() * 1000000000)
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def datetime_wall(when):
+    """
+    Nanoseconds since the epoch for an aware datetime, the inverse of ``wall_datetime``.
+    """
+    return (when - EPOCH) // timedelta(microseconds=1) * 1000
+
+
+def wall_datetime(wall_ns):
+    """
+    Aware UTC datetime for nanoseconds since the epoch.
+    """
+    seconds, nanoseconds = divmod(wall_ns, 1000000000)
+    return datetime.fromtimestamp(seconds, timezone.utc).replace(microsecond=nanoseconds // 1000)
+
+
+class WallClock(object):
+    """
+    Maps monotonic nanosecond stamps onto nanoseconds since the epoch.
+    """
+
+    def __init__(self):
+        self.sync()
+
+    def sync(self):
+        """
+        Measure the monotonic to UTC offset, call periodically to follow NTP adjustments.
+        """
+        before = monotonic_ns()
+        wall = int(time.time() * 1000000000)
+        after = monotonic_ns()
+        self.offset = wall - (before + after) // 2
+        return self.offset
+
+    def to_wall(self, monotonic):
+        return monotonic + self.offset
+
+
+class TransponderClock(object):
+    """
+    Maps transponders' wrapping 32 bit microsecond timestamps onto UTC nanoseconds.
+
+    Each transponder's clock is anchored to the time its first sample was
+    received and followed from one sample to the next, it is anchored again
+    when it strays from the received times by more than ``tolerance``
+    nanoseconds, say after the transponder restarts.
+    """
+
+    def __init__(self, tolerance=250000000):
+        self.tolerance = tolerance
+        # (UTC nanoseconds, timestamp) of the last sample per transponder
+        self.anchors = {}
+
+    def to_wall(self, transponder_id, timestamp, received):
+        anchor = self.anchors.get(transponder_id)
+        wall = received
+        if anchor is not None:
+            placed = anchor[0] + clock_delta(timestamp, anchor[1]) * 1000
+            if abs(placed - received) <= self.tolerance:
+                wall = placed
+        self.anchors[transponder_id] = (wall, timestamp)
+        return wall
+
+
+class LatencyStats(object):
+    """
+    Running count, mean and maximum of nanosecond latencies.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, latency):
+        self.count += 1
+        self.total += latency
+        if latency > self.max:
+            self.max = latency
+
+    def stats(self):
+        return {
+            'count': self.count,
+            'mean_us': self.total / self.count / 1000 if self.count else 0.0,
+            'max_us': self.max / 1000,
+        }
@@ -0,0 +1,120 @@
+"""
+Outbound command queue for a receiver's serial port.
+
+Commands queued while the event loop is busy are written together on its
+next tick, so configuring a whole fleet before a heat is one write rather
+than a round trip per transponder. Urgent commands such as a heat start go
+ahead of queued configuration, and a command for a transponder replaces one
+of the same kind still waiting to be written.
+"""
+
+import logging
+from collections import OrderedDict
+
+from .clock import LatencyStats, monotonic_ns
+
+
+logger = logging.getLogger(__name__)
+
+
+class CommandWriter(object):
+    """
+    Writes commands to ``receiver`` from ``loop`` without ever blocking on the port.
+
+    If the port won't take a whole batch the rest is written when it
+    becomes writable again. ``latency`` is the time from the first command of
+    a batch being queued to the last byte of it being written.
+    """
+
+    def __init__(self, receiver, loop, latency=None):
+        self.receiver = receiver
+        self.loop = loop
+        self.latency = latency if latency is not None else LatencyStats()
+        # Encoded frames keyed by (command, transponder id)
+        self.urgent = OrderedDict()
+        self.bulk = OrderedDict()
+        # When the oldest command still in ``urgent`` or ``bulk`` was queued
+        self.queued = None
+        # Remainder of the batch being written and when its first command was queued
+        self.pending = None
+        self.started = None
+        self.scheduled = False
+        self.waiting = False
+        self.writes = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self.urgent) + len(self.bulk)
+
+    def queue(self, command, transponder_id, argument):
+        """
+        Queue a COMMANDS member for a receiver whose decoder ``takes_commands``.
+        """
+        frame = self.receiver.decoder.encode_command(command, transponder_id, argument)
+        commands = self.urgent if command.urgent else self.bulk
+        key = (command.value, transponder_id)
+        if key in commands:
+            self.coalesced += 1
+        commands[key] = frame
+        if self.queued is None:
+            self.queued = monotonic_ns()
+        if not self.scheduled and not self.waiting:
+            self.scheduled = True
+            self.loop.call_soon(self.flush)
+
+    def flush(self):
+        self.scheduled = False
+        port = self.receiver.port
+        if port is None:
+            self.discard()
+            return
+        while True:
+            if not self.pending:
+                if not self:
+                    break
+                self.pending = memoryview(b''.join(list(self.urgent.values()) + list(self.bulk.values())))
+                self.urgent.clear()
+                self.bulk.clear()
+                self.started, self.queued = self.queued, None
+            try:
+                written = port.write(self.pending)
+            except OSError as e:
+                logger.error("Serial write failed on {}: {}".format(self.receiver, e))
+                self.discard()
+                return
+            self.pending = self.pending[written:]
+            if self.pending:
+                if not self.waiting:
+                    self.loop.add_writer(port.fileno(), self.flush)
+                    self.waiting = True
+                return
+            self.latency.add(monotonic_ns() - self.started)
+            self.writes += 1
+        if self.waiting:
+            self.loop.remove_writer(port.fileno())
+            self.waiting = False
+
+    def discard(self):
+        """
+        Drop everything queued, used when the port has gone away.
+        """
+        if len(self) or self.pending:
+            logger.warning("Discarding {} queued commands and {} unwritten bytes for {}".format(
+                len(self), len(self.pending or b''), self.receiver))
+        self.urgent.clear()
+        self.bulk.clear()
+        self.pending = None
+        self.queued = None
+
+    def close(self):
+        if self.waiting:
+            self.loop.remove_writer(self.receiver.fileno())
+            self.waiting = False
+        self.discard()
+
+    def stats(self):
+        return {
+            'writes': self.writes,
+            'coalesced': self.coalesced,
+            'queued': len(self),
+        }
@@ -1,8 +1,195 @@
-# from channels import Channel, Group
+import fcntl
+import json
+import logging
+import os
+
+from channels import Group
+from django.conf import settings
 # from channels.decorators import channel_session, linearize
 # from channels.auth import http_session_user, channel_session_user, transfer_user
 
+from base_station.races.live import live_heats
+from base_station.races.models import HeatEvent, Lap, RaceHeat
+from base_station.races.writers import heat_events
+from base_station.telemetry.rings import telemetry_rings
+from base_station.telemetry.store import telemetry_store
+from base_station.trackers.models import Tracker
+from .clock import TransponderClock, wall_datetime
+from .decoders import Telemetry
+from .gates import GatePass
+
+
+logger = logging.getLogger(__name__)
+
+transponder_clock = TransponderClock()
+
+
+class IngestLock(object):
+    """
+    Held by the one process consuming the wireless channel layer, see the
+    ``runingest`` command.
+
+    The live state of running heats and their buffered triggers and telemetry
+    are kept in that process's memory, so a second worker would keep a
+    diverging copy. The consumers don't check it so tests and benchmarks can
+    call them in any process.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_file = None
+
+    def acquire(self):
+        """
+        Take the lock for the life of this process, False if another process holds it.
+        """
+        if self.lock_file is not None:
+            return True
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        lock_file = open(self.path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self.lock_file = lock_file
+        return True
+
+
+ingest_lock = IngestLock(os.path.join(settings.TELEMETRY_RING_ROOT, 'ingest.lock'))
+
+
+def resolve_trackers(tracker_type, passes):
+    return Tracker.objects.by_transponder(tracker_type, {gate_pass.transponder_id for gate_pass in passes})
+
+
+def record_passes(heat, trackers, passes, writer=heat_events):
+    """
+    Record a gate trigger on ``heat`` for every pass by a known tracker, the
+    HeatEvents are written in batches by ``writer``.
+    """
+    events = []
+    for gate_pass in passes:
+        tracker = trackers.get(gate_pass.transponder_id)
+        if tracker is None:
+            logger.debug("Gate pass by unknown transponder {}".format(gate_pass.transponder_id))
+            continue
+        events.append(HeatEvent(
+            heat=heat,
+            tracker=tracker,
+            trigger=HeatEvent.TRIGGERS.gate.value,
+            triggered_time=wall_datetime(gate_pass.time)))
+    writer.extend(events)
+    return events
+
+
+def record_telemetry(heat, trackers, samples, store=telemetry_store, rings=telemetry_rings, clock=transponder_clock):
+    """
+    Store ``(Telemetry, received)`` samples by known trackers in the telemetry
+    of ``heat``, timed by the transponder's clock so they stay evenly spaced,
+    and share them with other processes through the heat's ring file.
+    """
+    streams = {}
+    for record, received in samples:
+        tracker = trackers.get(record.transponder_id)
+        if tracker is not None:
+            time = clock.to_wall(record.transponder_id, record.timestamp, received)
+            streams.setdefault(tracker.pk, []).append(
+                (time, record.x, record.y, record.z, record.rssi, record.battery))
+    for tracker_pk, rows in streams.items():
+        store.append(heat.pk, tracker_pk, rows)
+        rings.append(heat.pk, tracker_pk, rows)
+
+
+def broadcast_standings(heat, live, channel_layer=None):
+    """
+    Send the running order of ``heat`` to the websockets following it.
+    """
+    Group(heat.group_name, channel_layer=channel_layer).send({
+        "text": json.dumps({
+            "heat": str(heat.pk),
+            "number": heat.number,
+            "state": live.state,
+            "standings": live.standings(),
+        }),
+    })
+
+
+# Connected to wireless.packet
+def packet(message, writer=heat_events, store=telemetry_store, rings=telemetry_rings):
+    """
+    Batch of transponder detections and telemetry read by the serial server
+    from a single receiver, along with the gate passes they completed.
+    """
+    passes = [GatePass._make(payload) for payload in message.content.get('passes', ())]
+    samples = [
+        (Telemetry._make(packet), received)
+        for packet, received in zip(message.content['packets'], message.content['received'])
+        if len(packet) == len(Telemetry._fields)]
+    if not passes and not samples:
+        return
+    heat = RaceHeat.objects.running().order_by('-started_time').first()
+    if heat is None:
+        logger.debug("Ignoring {} gate passes and {} telemetry samples with no heat running".format(
+            len(passes), len(samples)))
+        return
+    trackers = resolve_trackers(message.content['tracker_type'], passes + [sample for sample, _ in samples])
+    if samples:
+        record_telemetry(heat, trackers, samples, store=store, rings=rings)
+    if not passes:
+        return
+    # Before recording so a rebuild from the database can't include these passes already
+    live = live_heats.get(heat)
+    events = record_passes(heat, trackers, passes, writer=writer)
+    if not events:
+        return
+    laps = [lap for lap in map(live.apply, events) if lap is not None]
+    if laps:
+        # Only a gate pass in a while completes a lap so these aren't worth batching
+        Lap.objects.bulk_create(laps)
+    broadcast_standings(heat, live, message.channel_layer)
+
+
+def record_trigger(heat, content, writer=heat_events, channel_layer=None):
+    """
+    Store a trigger sent by another process, e.g. the heat scheduler, and
+    apply it to the live state of the heat.
+    """
+    event = HeatEvent(
+        heat=heat,
+        tracker_id=content.get('tracker'),
+        trigger=content['trigger'],
+        triggered_time=wall_datetime(content['triggered_time']))
+    if heat.ended:
+        writer.add(event)
+        return
+    # Before recording so a rebuild from the database can't include it already
+    live = live_heats.get(heat)
+    writer.add(event)
+    live.apply(event)
+    if event.trigger == HeatEvent.TRIGGERS.ended.value:
+        heat.end(event.triggered_time)
+        return
+    if event.trigger == HeatEvent.TRIGGERS.started.value and not heat.started:
+        # Fired for a staged heat, gate passes count towards it from now on
+        heat.start(event.triggered_time)
+    broadcast_standings(heat, live, channel_layer)
+
 
-def packet(message):
-    # print(message)
-    return 'wat'
+# Connected to wireless.heat
+def heat_control(message, writer=heat_events):
+    """
+    Requests about a heat from other processes, see ``RaceHeat.send_control``.
+    They are handled here as this is the process holding the live state of
+    the heat and its buffered triggers and telemetry.
+    """
+    content = message.content
+    heat = RaceHeat.objects.filter(pk=content['heat']).first()
+    if heat is None or content.get('changed'):
+        # Edited elsewhere, rebuilt from the database once everything waiting is stored there
+        writer.flush()
+        live_heats.discard(heat or RaceHeat(pk=content['heat']))
+    elif 'trigger' in content:
+        record_trigger(heat, content, writer=writer, channel_layer=message.channel_layer)
+    elif 'ended_time' in content and not heat.ended:
+        heat.end(wall_datetime(content['ended_time']))
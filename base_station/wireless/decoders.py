@@ -0,0 +1,300 @@
+"""
+Decoders turn the raw bytes read from a wireless receiver into packet records.
+
+A decoder parses in place over a ``ReceiveBuffer`` and returns the records it
+found along with the number of bytes it consumed, any unfinished frame at the
+end of the buffer is left for the next read.
+
+Each type of tracker hardware registers a decoder with ``register`` and
+declares how its frames are delimited on the wire, the shared framing code
+then splits every complete frame in a buffer in a single pass. Frames that
+fail validation are dropped in the reader and counted along with any garbage
+bytes skipped over, see ``stats``. Decoders for hardware that can be
+configured also encode the commands sent back to it.
+"""
+
+import binascii
+import struct
+from collections import namedtuple
+
+from catalog import Catalog
+
+from base_station.trackers.models import TRACKER_TYPES
+
+
+class FRAME_KINDS(Catalog):
+    _attrs = ('value', 'label')
+    detection = (0x01, 'Transponder detection')
+    telemetry = (0x02, 'Transponder telemetry')
+
+
+class COMMANDS(Catalog):
+    """
+    Commands sent to a receiver, ``urgent`` ones are written ahead of any queued configuration.
+    """
+    _attrs = ('value', 'label', 'urgent')
+    arm = (0x10, 'Arm transponder', False)
+    set_id = (0x11, 'Set transponder id', False)
+    telemetry_rate = (0x12, 'Set telemetry rate', False)
+    heat_start = (0x20, 'Start heat', True)
+
+
+# Transponder id that addresses every transponder a receiver can hear
+BROADCAST_ID = 0xFFFF
+
+
+Detection = namedtuple('Detection', ('transponder_id', 'sequence', 'timestamp', 'rssi'))
+# Position in millimetres from the track origin and battery voltage in millivolts
+Telemetry = namedtuple('Telemetry', ('transponder_id', 'timestamp', 'x', 'y', 'z', 'rssi', 'battery'))
+
+# Records that lap timing depends on, these are never dropped on their way to the channel layer
+TIMING_RECORDS = (Detection,)
+
+
+# Decoder classes keyed by TRACKER_TYPES value
+registry = {}
+
+
+def register(decoder_class):
+    registry[decoder_class.tracker_type.value] = decoder_class
+    return decoder_class
+
+
+def get_decoder(tracker_type):
+    """
+    Return a new decoder for a TRACKER_TYPES member or value.
+    """
+    value = getattr(tracker_type, 'value', tracker_type)
+    try:
+        return registry[value]()
+    except KeyError:
+        raise ValueError("No decoder registered for tracker type {!r}".format(tracker_type))
+
+
+class BaseDecoder(object):
+    """
+    What every decoder shares, the framing classes below fill in ``decode``.
+
+    ``rejected`` counts frames that failed validation and ``garbage`` the
+    bytes dropped along with them. Decoders for hardware that can be
+    configured set ``takes_commands`` and implement ``encode_command``.
+    """
+
+    tracker_type = None
+    takes_commands = False
+
+    def __init__(self):
+        self.rejected = 0
+        self.garbage = 0
+
+    def decode(self, buffer):
+        """
+        Records of the complete frames in ``buffer`` and the number of bytes they took up.
+        """
+        raise NotImplementedError
+
+    def stats(self):
+        return {'rejected': self.rejected, 'garbage_bytes': self.garbage}
+
+    def encode(self, record):
+        """
+        Frame for a record as the receiver would send it, used to simulate receivers.
+        """
+        raise NotImplementedError
+
+    def encode_command(self, command, transponder_id, argument):
+        """
+        Frame for a COMMANDS member, only for decoders that take commands.
+        """
+        raise NotImplementedError
+
+
+class DelimitedDecoder(BaseDecoder):
+    """
+    Framing for protocols that terminate every frame with a fixed delimiter.
+
+    All complete frames in the buffer are split out with one ``bytes.split``
+    and handed to ``parse_frame`` which returns a record or None to skip it.
+    """
+
+    delimiter = b'\n'
+
+    def decode(self, buffer):
+        last = buffer.data.rfind(self.delimiter, 0, buffer.length)
+        if last == -1:
+            return [], 0
+        parse_frame = self.parse_frame
+        records = []
+        append = records.append
+        for frame in bytes(buffer.view[:last]).split(self.delimiter):
+            record = parse_frame(frame)
+            if record is not None:
+                append(record)
+            else:
+                self.rejected += 1
+                self.garbage += len(frame) + len(self.delimiter)
+        return records, last + len(self.delimiter)
+
+    def parse_frame(self, frame):
+        raise NotImplementedError
+
+
+class LengthPrefixedDecoder(BaseDecoder):
+    """
+    Framing for binary protocols laid out as ``sync | length | kind | payload | crc16``.
+
+    ``length`` counts the kind byte and payload, the CRC-16/CCITT covers
+    every byte from ``length`` up to the CRC itself and is checked with the C
+    implementation in ``binascii``. Frames are located by scanning for the
+    sync byte with ``bytearray.find`` so the stream resynchronises after
+    garbage without looking at it byte by byte in Python. ``parse_payload`` is
+    given the buffer and payload offset and returns a record or None to skip
+    the frame.
+
+    ``rejected`` counts frames that failed their CRC or had an impossible
+    length, ``garbage`` the bytes skipped over to find the next frame and
+    ``ignored`` valid frames ``parse_payload`` skipped.
+    """
+
+    sync = 0xA5
+    max_length = 64
+    header = struct.Struct('<BBB')
+    crc = struct.Struct('<H')
+    crc_init = 0xFFFF
+
+    def __init__(self):
+        super().__init__()
+        self.ignored = 0
+
+    @classmethod
+    def encode_frame(cls, kind, payload):
+        body = bytes((len(payload) + 1, kind)) + payload
+        return bytes((cls.sync,)) + body + cls.crc.pack(binascii.crc_hqx(body, cls.crc_init))
+
+    def decode(self, buffer):
+        data = buffer.data
+        view = buffer.view
+        end = buffer.length
+        records = []
+        append = records.append
+        sync = self.sync
+        max_length = self.max_length
+        header_size = self.header.size
+        crc_size = self.crc.size
+        unpack_header = self.header.unpack_from
+        unpack_crc = self.crc.unpack_from
+        parse_payload = self.parse_payload
+        crc = binascii.crc_hqx
+        crc_init = self.crc_init
+        rejected = garbage = ignored = 0
+        pos = 0
+        try:
+            while True:
+                found = data.find(sync, pos, end)
+                if found != pos:
+                    # Out of sync, only looked at when there is garbage to skip
+                    if found == -1:
+                        garbage += end - pos
+                        return records, end
+                    garbage += found - pos
+                    pos = found
+                if end - pos < header_size:
+                    return records, pos
+                _, length, kind = unpack_header(data, pos)
+                if not length or length > max_length:
+                    rejected += 1
+                    garbage += 1
+                    pos += 1
+                    continue
+                crc_pos = pos + 2 + length
+                if crc_pos + crc_size > end:
+                    return records, pos
+                if crc(view[pos + 1:crc_pos], crc_init) != unpack_crc(data, crc_pos)[0]:
+                    rejected += 1
+                    garbage += 1
+                    pos += 1
+                    continue
+                record = parse_payload(data, pos + header_size, kind, length - 1)
+                if record is not None:
+                    append(record)
+                else:
+                    ignored += 1
+                pos = crc_pos + crc_size
+        finally:
+            # Counted in locals as attribute lookups add up over every frame
+            self.rejected += rejected
+            self.garbage += garbage
+            self.ignored += ignored
+
+    def parse_payload(self, data, offset, kind, length):
+        raise NotImplementedError
+
+    def stats(self):
+        return dict(super().stats(), ignored=self.ignored)
+
+
+# transponder id, sequence, transponder clock in microseconds, rssi
+RW_DETECTION = struct.Struct('<HHIB')
+DETECTION = FRAME_KINDS.detection.value
+# transponder id, transponder clock in microseconds, x, y, z, rssi, battery
+RW_TELEMETRY = struct.Struct('<HIiiiBH')
+TELEMETRY = FRAME_KINDS.telemetry.value
+# transponder id, command argument
+RW_COMMAND = struct.Struct('<HI')
+
+
+@register
+class RWTransponderDecoder(LengthPrefixedDecoder):
+    """
+    Binary frame decoder for Rotor Widgets transponder v1 receivers.
+    """
+
+    tracker_type = TRACKER_TYPES.rw_transponder
+    takes_commands = True
+
+    def parse_payload(self, data, offset, kind, length):
+        if kind == DETECTION and length == RW_DETECTION.size:
+            return Detection._make(RW_DETECTION.unpack_from(data, offset))
+        if kind == TELEMETRY and length == RW_TELEMETRY.size:
+            return Telemetry._make(RW_TELEMETRY.unpack_from(data, offset))
+        return None
+
+    def encode(self, record):
+        if isinstance(record, Telemetry):
+            return self.encode_frame(TELEMETRY, RW_TELEMETRY.pack(*record))
+        return encode_rw_detection(*record)
+
+    def encode_command(self, command, transponder_id, argument):
+        return self.encode_frame(command.value, RW_COMMAND.pack(transponder_id, argument))
+
+
+def encode_rw_detection(transponder_id, sequence, timestamp, rssi):
+    return RWTransponderDecoder.encode_frame(
+        DETECTION, RW_DETECTION.pack(transponder_id, sequence, timestamp, rssi))
+
+
+@register
+class ILapDecoder(DelimitedDecoder):
+    """
+    Line decoder for legacy iLap receivers.
+
+    Every detection is a CRLF terminated ASCII line of tab separated fields:
+    transponder id, receiver clock in milliseconds and signal strength. iLap
+    frames carry no sequence number so it is always reported as zero.
+    """
+
+    tracker_type = TRACKER_TYPES.ilap
+    delimiter = b'\r\n'
+
+    def parse_frame(self, frame):
+        fields = frame.split(b'\t')
+        if len(fields) != 3:
+            return None
+        try:
+            return Detection(int(fields[0]), 0, int(fields[1]) * 1000, int(fields[2]))
+        except ValueError:
+            return None
+
+    def encode(self, detection):
+        return '{}\t{}\t{}\r\n'.format(
+            detection.transponder_id, detection.timestamp // 1000, detection.rssi).encode('ascii')
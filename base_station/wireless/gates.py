@@ -0,0 +1,171 @@
+"""
+Streaming gate pass detection.
+
+A transponder flying through a gate is heard by its receiver as a burst of
+detections whose RSSI rises and falls around the moment it crosses. Rather
+than trigger on every detection the burst is tracked per transponder and
+reduced to one GatePass at the RSSI peak when it ends.
+
+Samples are smoothed with a short moving average, each average is placed at
+the mean time of the samples in it so smoothing doesn't delay the peak. The
+crossing is put at the vertex of a parabola through the highest average and
+the averages a window either side of it, which lands between samples. Sample times come from the
+transponder's own clock, anchored to the wall clock time the pass's first
+sample was read at, so batching in the serial reads doesn't blur them.
+
+Memory per transponder is bounded by the smoothing window whatever the
+sample rate, and passes are forgotten as soon as they are reported.
+"""
+
+from collections import deque, namedtuple
+
+
+# ``time`` is UTC nanoseconds, ``rssi`` the smoothed peak and ``samples`` the detections in the pass
+GatePass = namedtuple('GatePass', ('transponder_id', 'time', 'rssi', 'samples'))
+
+
+def clock_delta(timestamp, since):
+    """
+    Microseconds from ``since`` to ``timestamp`` on a wrapping 32 bit transponder clock.
+    """
+    delta = (timestamp - since) & 0xFFFFFFFF
+    return delta - 0x100000000 if delta & 0x80000000 else delta
+
+
+def parabola_vertex(x0, y0, x1, y1, x2, y2):
+    """
+    Integer x of the top of the parabola through three points, or ``x1`` if they don't make a peak.
+    """
+    # Relative to x1 so the squares stay well within float precision
+    a0, a2 = x0 - x1, x2 - x1
+    denominator = a0 * a2 * (a0 - a2)
+    if not denominator:
+        return x1
+    a = (a2 * (y0 - y1) - a0 * (y2 - y1)) / denominator
+    b = (a0 * a0 * (y2 - y1) - a2 * a2 * (y0 - y1)) / denominator
+    if a >= 0:
+        return x1
+    # Only the offset is a float so large nanosecond times keep their precision
+    return x1 + int(min(max(-b / (2 * a), a0), a2))
+
+
+class TransponderPass(object):
+    """
+    State of one transponder's pass through a gate while it is in range.
+    """
+
+    __slots__ = (
+        'transponder_id', 'anchor', 'anchor_timestamp', 'last_read', 'samples',
+        'window', 'sum_time', 'sum_rssi', 'recent', 'since_peak', 'before', 'peak', 'after')
+
+    def __init__(self, transponder_id, timestamp, received, smoothing):
+        self.transponder_id = transponder_id
+        self.anchor = received
+        self.anchor_timestamp = timestamp
+        self.last_read = received
+        self.samples = 0
+        self.window = deque(maxlen=smoothing)
+        self.sum_time = 0
+        self.sum_rssi = 0
+        # Smoothed (time, rssi) points, the last few and the highest with its neighbours a window either side
+        self.recent = deque(maxlen=smoothing)
+        self.since_peak = 0
+        self.before = self.peak = self.after = None
+
+    def add(self, timestamp, rssi, received):
+        self.last_read = received
+        self.samples += 1
+        time = self.anchor + clock_delta(timestamp, self.anchor_timestamp) * 1000
+        window = self.window
+        if len(window) == window.maxlen:
+            old_time, old_rssi = window[0]
+            self.sum_time -= old_time
+            self.sum_rssi -= old_rssi
+        window.append((time, rssi))
+        self.sum_time += time
+        self.sum_rssi += rssi
+        point = (self.sum_time // len(window), self.sum_rssi / len(window))
+        recent = self.recent
+        if self.peak is None or point[1] > self.peak[1]:
+            self.before = recent[0] if recent else None
+            self.peak, self.after = point, None
+            self.since_peak = 0
+        else:
+            self.since_peak += 1
+            if self.since_peak == window.maxlen or self.after is None:
+                self.after = point
+        recent.append(point)
+
+    def crossing(self):
+        if self.before is None or self.after is None:
+            return self.peak[0]
+        return parabola_vertex(*(self.before + self.peak + self.after))
+
+
+class GatePassDetector(object):
+    """
+    Turns one receiver's detections into GatePasses.
+
+    A pass ends once its transponder hasn't been heard for ``gap`` seconds,
+    it is only reported if its smoothed RSSI peaked at ``threshold`` or
+    above, so a transponder heard faintly from elsewhere on the track
+    doesn't trigger the gate. ``smoothing`` is the number of samples
+    averaged.
+    """
+
+    def __init__(self, threshold=80, smoothing=5, gap=0.25):
+        self.threshold = threshold
+        self.smoothing = smoothing
+        self.gap = int(gap * 1000000000)
+        self.passes = {}
+
+    def __len__(self):
+        return len(self.passes)
+
+    def feed(self, detections, received):
+        """
+        Add detections read at the matching UTC nanosecond ``received`` times
+        and return the passes that ended before the last of them.
+        """
+        passes = self.passes
+        gap = self.gap
+        ended = []
+        for detection, read in zip(detections, received):
+            current = passes.get(detection.transponder_id)
+            if current is not None and read - current.last_read > gap:
+                ended.append(current)
+                current = None
+            if current is None:
+                current = passes[detection.transponder_id] = TransponderPass(
+                    detection.transponder_id, detection.timestamp, read, self.smoothing)
+            current.add(detection.timestamp, detection.rssi, read)
+        if received:
+            ended.extend(self.pop_idle(received[-1]))
+        return self.report(ended)
+
+    def expire(self, now):
+        """
+        Return the passes whose transponder has been silent for ``gap`` at UTC nanoseconds ``now``.
+        """
+        return self.report(self.pop_idle(now))
+
+    def finish(self):
+        """
+        End and return every pass in progress.
+        """
+        ended = list(self.passes.values())
+        self.passes.clear()
+        return self.report(ended)
+
+    def pop_idle(self, now):
+        idle = [current for current in self.passes.values() if now - current.last_read > self.gap]
+        for current in idle:
+            del self.passes[current.transponder_id]
+        return idle
+
+    def report(self, ended):
+        threshold = self.threshold
+        return sorted(
+            (GatePass(current.transponder_id, current.crossing(), current.peak[1], current.samples)
+             for current in ended if current.peak[1] >= threshold),
+            key=lambda gate_pass: gate_pass.time)
@@ -0,0 +1,52 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from base_station.trackers.models import TRACKER_TYPES
+from base_station.wireless.benchmarks import IngestBenchmark, capture_reads, fleet_reads
+from base_station.wireless.decoders import registry
+
+
+class Command(BaseCommand):
+    help = ("Benchmarks the wireless ingest path from raw serial reads to persisted HeatEvents. "
+            "Database changes are rolled back.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--capture', metavar='PATH', help="Benchmark a capture log instead of a simulated race.")
+        parser.add_argument('--trackers', type=int, default=8, help="Transponders in the simulated race.")
+        parser.add_argument('--laps', type=int, default=10, help="Laps in the simulated race.")
+        parser.add_argument('--gates', type=int, default=1, help="Gates around the simulated lap.")
+        parser.add_argument(
+            '--tracker-type', default=settings.SERIAL_TRACKER_TYPE,
+            choices=[TRACKER_TYPES(value).serializer_label for value in registry],
+            help="Type of tracker hardware to simulate.")
+        parser.add_argument('--read-size', type=int, default=256, help="Bytes per simulated serial read.")
+        parser.add_argument('--seed', type=int, default=1, help="Random seed of the simulated race.")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+
+    def handle(self, *args, **options):
+        if options['capture']:
+            receivers, reads = capture_reads(options['capture'])
+        else:
+            receivers, reads = fleet_reads(
+                TRACKER_TYPES(options['tracker_type'], 'serializer_label'),
+                count=options['trackers'],
+                laps=options['laps'],
+                gates=options['gates'],
+                read_size=options['read_size'],
+                seed=options['seed'])
+        results = IngestBenchmark(receivers, reads).run()
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write("{:<10}{:>10}{:>14}{:>10}{:>10}{:>14}".format(
+            "stage", "frames", "frames/s", "p50 ms", "p99 ms", "blocks/frame"))
+        for result in results:
+            self.stdout.write("{stage:<10}{frames:>10}{frames_per_second:>14.0f}{p50_ms:>10.3f}"
+                              "{p99_ms:>10.3f}{blocks_per_frame:>14.2f}".format(**result))
+        total = sum(result['frames'] / result['frames_per_second'] for result in results if result['frames_per_second'])
+        # Every frame goes through decode, later stages may only see the gate passes they make
+        frames = results[0]['frames']
+        self.stdout.write("End to end: {:.0f} frames/s".format(frames / total if total else 0))
@@ -0,0 +1,76 @@
+import time
+
+import serial
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from base_station.utils.layers import cross_process_layer
+from base_station.wireless.capture import CaptureReader, ChannelReplay, paced
+
+
+class Command(BaseCommand):
+    help = "Plays a serial capture log back into serial devices or straight into the channel layer."
+
+    def add_arguments(self, parser):
+        parser.add_argument('capture', help="Capture log written by runserial --capture.")
+        parser.add_argument(
+            '--speed', type=float, default=1.0,
+            help="Playback speed multiplier, 0 plays back as fast as possible.")
+        parser.add_argument(
+            '--interface', action='append', dest='interfaces', metavar='RECEIVER=INTERFACE',
+            help="Serial device to write a captured receiver's bytes to, such as the master end "
+                 "of script/fake_serial. May be given once per receiver.")
+        parser.add_argument(
+            '--baud', type=int, default=settings.SERIAL_BAUD,
+            help="Baud rate of the serial devices.")
+        parser.add_argument(
+            '--direct', action='store_true',
+            help="Decode the capture and send packets straight to the channel layer.")
+        parser.add_argument(
+            '--layer', default=settings.SERIAL_CHANNEL_LAYER,
+            help="Channel layer alias packets are sent to with --direct.")
+
+    def handle(self, *args, **options):
+        reader = CaptureReader(options['capture'])
+        if options['direct']:
+            replay = ChannelReplay(cross_process_layer(options['layer']), reader.receivers)
+
+            def write(index, wall, data):
+                replay.feed(index, wall, data)
+        else:
+            ports = self.open_ports(reader.receivers, options['interfaces'] or [], options['baud'])
+
+            def write(index, wall, data):
+                if ports[index] is not None:
+                    ports[index].write(data)
+
+        started = time.monotonic()
+        reads = 0
+        read_bytes = 0
+        for index, received, wall, data in paced(reader, options['speed']):
+            write(index, wall, data)
+            reads += 1
+            read_bytes += len(data)
+        if options['direct']:
+            replay.finish()
+        self.stdout.write("Replayed {} reads ({} bytes) in {:.3f}s".format(
+            reads, read_bytes, time.monotonic() - started))
+
+    def open_ports(self, receivers, interfaces, baud):
+        names = [name for name, tracker_type in receivers]
+        mapping = {}
+        for value in interfaces:
+            name, sep, interface = value.partition('=')
+            if not sep:
+                if len(names) != 1:
+                    raise CommandError("Name the receiver for {!r}, the capture holds {}".format(
+                        value, ", ".join(names)))
+                name, interface = names[0], value
+            if name not in names:
+                raise CommandError("The capture has no receiver named {!r}".format(name))
+            mapping[name] = interface
+        if not mapping:
+            raise CommandError("Give an --interface to replay into or use --direct")
+        return [
+            serial.Serial(mapping[name], baud) if name in mapping else None
+            for name in names]
@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from base_station.races.models import RaceHeat
+from base_station.wireless.capture import CaptureReader
+from base_station.wireless.clock import wall_datetime
+from base_station.wireless.retiming import capture_passes, retime_heat
+
+
+class Command(BaseCommand):
+    help = ("Re-times the gate triggers of finished heats from the raw detections in a capture log, "
+            "replacing each heat's gate HeatEvents.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('capture', help="Capture log written by runserial --capture.")
+        parser.add_argument(
+            '--heat', action='append', dest='heats', metavar='ID',
+            help="Heat to re-time, may be given several times. Defaults to every heat the capture covers.")
+        parser.add_argument('--event', metavar='ID', help="Re-time every heat of an event.")
+        parser.add_argument(
+            '--threshold', type=int, default=80,
+            help="Lowest peak RSSI of a transponder pass that triggers a gate.")
+        parser.add_argument('--smoothing', type=int, default=5, help="Number of RSSI samples averaged.")
+        parser.add_argument(
+            '--gap', type=float, default=0.25,
+            help="Seconds a transponder has to be silent for before its pass is over.")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        reader = CaptureReader(options['capture'])
+        passes = capture_passes(
+            reader, threshold=options['threshold'], smoothing=options['smoothing'], gap=options['gap'])
+        self.stdout.write("Found {} gate passes in {:.3f}s".format(len(passes), time.monotonic() - started))
+
+        heats = RaceHeat.objects.filter(started_time__isnull=False, ended_time__isnull=False)
+        if options['heats']:
+            heats = heats.filter(pk__in=options['heats'])
+        elif options['event']:
+            heats = heats.filter(event=options['event'])
+        elif passes:
+            times = [gate_pass.time for tracker_type, gate_pass in passes]
+            heats = heats.filter(started_time__lte=wall_datetime(max(times)), ended_time__gte=wall_datetime(min(times)))
+        else:
+            raise CommandError("The capture has no gate passes to re-time heats with")
+
+        for heat in heats.order_by('started_time'):
+            removed, added = retime_heat(heat, passes)
+            self.stdout.write("{} #{}: replaced {} gate triggers with {}".format(heat, heat.number, removed, added))
+        self.stdout.write("Re-timed in {:.3f}s".format(time.monotonic() - started))
@@ -0,0 +1,21 @@
+from channels.management.commands.runworker import Command as RunWorkerCommand
+from django.conf import settings
+from django.core.management.base import CommandError
+
+from base_station.wireless.consumers import ingest_lock
+
+
+class Command(RunWorkerCommand):
+    help = (
+        "Runs the one worker consuming the wireless channel layer, it keeps the live state of running heats "
+        "and their buffered triggers and telemetry.")
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.set_defaults(layer=settings.SERIAL_CHANNEL_LAYER)
+
+    def handle(self, *args, **options):
+        if not ingest_lock.acquire():
+            raise CommandError("Another process is already consuming the wireless channel layer, it holds {}".format(
+                ingest_lock.path))
+        super().handle(*args, **options)
@@ -0,0 +1,83 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from base_station.trackers.models import TRACKER_TYPES
+from base_station.utils.layers import cross_process_layer
+from base_station.wireless.buffers import OVERFLOW_POLICIES
+from base_station.wireless.decoders import registry
+from base_station.wireless.server import Receiver, Server
+
+
+class Command(BaseCommand):
+    help = "Runs the serial server that reads wireless packets from every receiver into the channel layer."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--receiver', action='append', dest='receivers', metavar='NAME:INTERFACE[:BAUD[:TRACKER_TYPE]]',
+            help="Receiver to read, may be given several times. Defaults to settings.SERIAL_RECEIVERS.")
+        parser.add_argument(
+            '--layer', default=settings.SERIAL_CHANNEL_LAYER,
+            help="Channel layer alias packets are sent to.")
+        parser.add_argument(
+            '--batch-size', type=int, default=64,
+            help="Number of pending packets that sends a batch immediately.")
+        parser.add_argument(
+            '--batch-interval', type=float, default=0.005,
+            help="Seconds to wait for a batch to fill before sending it anyway.")
+        parser.add_argument(
+            '--ring-size', type=int, default=4096,
+            help="Number of packets buffered between the receivers and the channel layer.")
+        parser.add_argument(
+            '--telemetry-policy', default=OVERFLOW_POLICIES.coalesce.name,
+            choices=[policy.name for policy in OVERFLOW_POLICIES],
+            help="What to do with telemetry when its ring buffer is full, timing packets are never dropped.")
+        parser.add_argument(
+            '--capture', metavar='PATH',
+            help="Also write every read to a capture log that can be played back with replayserial.")
+        parser.add_argument(
+            '--ping-interval', type=float, default=20,
+            help="Seconds between pings on each receiver's reply channel.")
+        parser.add_argument(
+            '--ping-timeout', type=float,
+            help="Close a receiver nothing has been read from for this many seconds, never by default.")
+        parser.add_argument(
+            '--gate-threshold', type=int, default=80,
+            help="Lowest peak RSSI of a transponder pass that triggers a gate.")
+
+    def handle(self, *args, **options):
+        if options['receivers']:
+            receivers = [self.parse_receiver(value) for value in options['receivers']]
+        else:
+            receivers = [self.build_receiver(**config) for config in settings.SERIAL_RECEIVERS]
+        channel_layer = cross_process_layer(options['layer'])
+        for receiver in receivers:
+            self.stdout.write("Reading {} at {} baud into the '{}' channel layer".format(
+                receiver, receiver.baud, options['layer']))
+        Server(
+            channel_layer,
+            receivers,
+            batch_size=options['batch_size'],
+            batch_interval=options['batch_interval'],
+            ring_size=options['ring_size'],
+            telemetry_policy=getattr(OVERFLOW_POLICIES, options['telemetry_policy']),
+            capture=options['capture'],
+            ping_interval=options['ping_interval'],
+            ping_timeout=options['ping_timeout'],
+            gate_threshold=options['gate_threshold'],
+        ).run()
+
+    def parse_receiver(self, value):
+        parts = value.split(':')
+        if not 2 <= len(parts) <= 4:
+            raise CommandError("Receivers are given as NAME:INTERFACE[:BAUD[:TRACKER_TYPE]], not {!r}".format(value))
+        config = dict(zip(('name', 'interface', 'baud', 'tracker_type'), parts))
+        if 'baud' in config:
+            config['baud'] = int(config['baud'])
+        return self.build_receiver(**config)
+
+    def build_receiver(self, name, interface, baud=None, tracker_type=None):
+        tracker_type = tracker_type or settings.SERIAL_TRACKER_TYPE
+        member = TRACKER_TYPES(tracker_type, 'serializer_label')
+        if member is None or member.value not in registry:
+            raise CommandError("No decoder for tracker type {!r} on receiver {!r}".format(tracker_type, name))
+        return Receiver(name, interface, baud or settings.SERIAL_BAUD, tracker_type=member)
@@ -0,0 +1,183 @@
+import time
+
+import serial
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from base_station.trackers.models import TRACKER_TYPES, Tracker
+from base_station.utils.layers import cross_process_layer
+from base_station.wireless.clock import WallClock, monotonic_ns
+from base_station.wireless.decoders import get_decoder, registry
+from base_station.wireless.gates import GatePassDetector
+from base_station.wireless.simulation import Fleet
+
+
+class Command(BaseCommand):
+    help = "Simulates a fleet of transponders racing laps and feeds their detections to the wireless pipeline."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trackers', type=int, default=8, help="Number of transponders in the air.")
+        parser.add_argument('--laps', type=int, default=10, help="Laps each transponder flies.")
+        parser.add_argument(
+            '--gates', default='start',
+            help="Comma separated receiver names around the lap, the first is start/finish.")
+        parser.add_argument(
+            '--tracker-type', default=settings.SERIAL_TRACKER_TYPE,
+            choices=[TRACKER_TYPES(value).serializer_label for value in registry],
+            help="Type of tracker hardware to simulate.")
+        parser.add_argument('--first-id', type=int, default=1, help="Transponder id of the first tracker.")
+        parser.add_argument('--lap-time', type=float, default=20.0, help="Mean lap time in seconds.")
+        parser.add_argument('--lap-jitter', type=float, default=1.5, help="Lap time standard deviation in seconds.")
+        parser.add_argument('--sample-rate', type=int, default=100, help="Detections per second while in range.")
+        parser.add_argument('--dropout', type=float, default=0.05, help="Chance of losing a single detection.")
+        parser.add_argument('--crash-chance', type=float, default=0.01, help="Chance of crashing out on any lap.")
+        parser.add_argument('--seed', type=int, help="Random seed for a repeatable race.")
+        parser.add_argument(
+            '--speed', type=float, default=1.0,
+            help="Playback speed multiplier, 0 runs as fast as possible.")
+        parser.add_argument(
+            '--interface', action='append', dest='interfaces', metavar='GATE=INTERFACE',
+            help="Serial device to write a gate's frames to, such as the slave end of script/fake_serial.")
+        parser.add_argument(
+            '--baud', type=int, default=settings.SERIAL_BAUD,
+            help="Baud rate of the serial devices.")
+        parser.add_argument(
+            '--direct', action='store_true',
+            help="Send detections straight to the channel layer instead of a serial device.")
+        parser.add_argument(
+            '--layer', default=settings.SERIAL_CHANNEL_LAYER,
+            help="Channel layer alias detections are sent to with --direct.")
+        parser.add_argument(
+            '--batch-interval', type=float, default=0.005,
+            help="Seconds of simulated time grouped into one write or channel message.")
+        parser.add_argument(
+            '--create-trackers', action='store_true',
+            help="Create Tracker rows for the simulated transponders if they don't exist.")
+
+    def handle(self, *args, **options):
+        gates = options['gates'].split(',')
+        tracker_type = TRACKER_TYPES(options['tracker_type'], 'serializer_label')
+        fleet = Fleet(
+            options['trackers'],
+            laps=options['laps'],
+            gates=len(gates),
+            first_id=options['first_id'],
+            lap_time=options['lap_time'],
+            lap_jitter=options['lap_jitter'],
+            sample_rate=options['sample_rate'],
+            dropout=options['dropout'],
+            crash_chance=options['crash_chance'],
+            seed=options['seed'])
+        if options['create_trackers']:
+            for transponder in fleet.transponders:
+                Tracker.objects.get_or_create(
+                    tracker_type=tracker_type.value, transponder_id=transponder.transponder_id)
+
+        if options['direct']:
+            self.sink = DirectSink(cross_process_layer(options['layer']), gates, tracker_type)
+        else:
+            self.sink = SerialSink(self.parse_interfaces(gates, options['interfaces'] or []), options['baud'],
+                                   get_decoder(tracker_type))
+
+        started = time.monotonic()
+        count = 0
+        batch_end = options['batch_interval']
+        for simulated in fleet.detections():
+            if simulated.time >= batch_end:
+                self.pace(started, batch_end, options['speed'])
+                self.sink.flush()
+                batch_end = simulated.time + options['batch_interval']
+            self.sink.add(simulated)
+            count += 1
+        self.sink.flush()
+        self.sink.finish()
+        elapsed = time.monotonic() - started
+        self.stdout.write("Sent {} detections from {} transponders in {:.3f}s ({:.0f}/s)".format(
+            count, len(fleet.transponders), elapsed, count / elapsed if elapsed else 0))
+
+    def pace(self, started, simulated_time, speed):
+        if speed:
+            delay = started + simulated_time / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    def parse_interfaces(self, gates, interfaces):
+        mapping = {}
+        for value in interfaces:
+            gate, sep, interface = value.partition('=')
+            if not sep:
+                gate, interface = gates[0], value
+            if gate not in gates:
+                raise CommandError("There is no gate named {!r}".format(gate))
+            mapping[gate] = interface
+        if not mapping:
+            raise CommandError("Give an --interface to write to or use --direct")
+        return [mapping.get(gate) for gate in gates]
+
+
+class SerialSink(object):
+    """
+    Writes encoded frames to a serial device per gate, one write per batch.
+    """
+
+    def __init__(self, interfaces, baud, decoder):
+        self.ports = [serial.Serial(interface, baud) if interface else None for interface in interfaces]
+        self.pending = [bytearray() for _ in interfaces]
+        self.encode = decoder.encode
+
+    def add(self, simulated):
+        if self.ports[simulated.gate] is not None:
+            self.pending[simulated.gate] += self.encode(simulated.detection)
+
+    def flush(self):
+        for port, pending in zip(self.ports, self.pending):
+            if pending:
+                port.write(pending)
+                del pending[:]
+
+    def finish(self):
+        pass
+
+
+class DirectSink(object):
+    """
+    Sends detections and the gate passes they make to the channel layer
+    batched per gate, as the serial server does.
+    """
+
+    def __init__(self, channel_layer, gates, tracker_type):
+        self.channel_layer = channel_layer
+        self.gates = gates
+        self.tracker_type = tracker_type
+        self.pending = [([], []) for _ in gates]
+        self.detectors = [GatePassDetector() for _ in gates]
+        self.clock = WallClock()
+        self.started = monotonic_ns()
+
+    def add(self, simulated):
+        packets, received = self.pending[simulated.gate]
+        packets.append(simulated.detection)
+        received.append(self.clock.to_wall(self.started + int(simulated.time * 1000000000)))
+
+    def flush(self):
+        for gate, detector, (packets, received) in zip(self.gates, self.detectors, self.pending):
+            passes = detector.feed(packets, received)
+            if packets or passes:
+                self.send(gate, list(packets), list(received), passes)
+                del packets[:]
+                del received[:]
+
+    def finish(self):
+        for gate, detector in zip(self.gates, self.detectors):
+            passes = detector.finish()
+            if passes:
+                self.send(gate, [], [], passes)
+
+    def send(self, gate, packets, received, passes):
+        self.channel_layer.send('wireless.packet', {
+            'receiver': gate,
+            'tracker_type': self.tracker_type.value,
+            'packets': packets,
+            'received': received,
+            'passes': passes,
+        })
@@ -1,5 +1,11 @@
 import time
 import logging
+import threading
+
+from .clock import LatencyStats, monotonic_ns
+from .commands import CommandWriter
+from .decoders import BROADCAST_ID, COMMANDS
+from .timers import TimerWheel
 
 logger = logging.getLogger(__name__)
 
@@ -7,27 +13,45 @@ logger = logging.getLogger(__name__)
 class SerialProtocol(object):
     """
     Protocol that does stuff with serial connections
+
+    One is opened per receiver, messages sent to its reply channel are
+    dispatched to it by the serial server. A message is either a single
+    command or a list of them under ``commands``::
+
+        {"command": "set_id", "transponder_id": 12, "argument": 40}
+        {"commands": [{"command": "arm"}, {"command": "heat_start", "argument": 3}]}
+
+    ``command`` is the name of a COMMANDS member and ``transponder_id``
+    defaults to every transponder the receiver can hear.
     """
 
-    def on_connect(self, request):
+    def __init__(self, factory, receiver):
+        self.factory = factory
+        self.channel_layer = factory.channel_layer
+        self.receiver = receiver
+        self.writer = CommandWriter(receiver, factory.loop, factory.write_latency)
+        self.ping_timer = None
+        self.timeout_timer = None
+
+    def on_connect(self):
         self.request_info = {
-            "action": request.action,
-            # "headers": self.clean_headers,
+            "receiver": self.receiver.name,
+            "tracker_type": self.receiver.tracker_type.value,
         }
 
     def on_open(self):
         self.reply_channel = self.channel_layer.new_channel("!serial.send.?")
         self.request_info["reply_channel"] = self.reply_channel
         self.last_ping = time.time()
-        # TODO link factory
-        self.factory.reply_protocols[self.reply_channel] = self
+        self.factory.add_protocol(self)
         logger.debug("Serial connection open for {}".format(self.reply_channel))
         self.channel_layer.send("serial.connect", self.request_info)
 
     def on_close(self):
         logger.debug("Serial connection closed for {}".format(self.reply_channel))
         if hasattr(self, "reply_channel"):
-            del self.factory.reply_protocols[self.reply_channel]
+            self.factory.remove_protocol(self)
+            self.writer.close()
             self.channel_layer.send("serial.disconnect", {
                 "reply_channel": self.reply_channel
             })
@@ -36,23 +60,109 @@ class SerialProtocol(object):
         logger.debug("Serial incoming message on {}".format(self.reply_channel))
 
     def send_message(self, content):
-        logger.debug("Sent Serial message to client for {}".format(self.reply_channel))
+        for command in content.get("commands", [content]):
+            self.queue_command(command)
+        logger.debug("Queued Serial message to client for {}".format(self.reply_channel))
+
+    def queue_command(self, content):
+        command = COMMANDS(content.get("command"), "name")
+        if command is None:
+            logger.warning("Unknown serial command {!r} for {}".format(content.get("command"), self.receiver))
+            return
+        if not self.receiver.decoder.takes_commands:
+            logger.warning("{} receivers don't take commands".format(self.receiver.tracker_type.label))
+            return
+        self.writer.queue(command, content.get("transponder_id", BROADCAST_ID), content.get("argument", 0))
 
     def set_ping(self):
+        self.last_ping = time.time()
         self.channel_layer.send("serial.ping", {
             "reply_channel": self.reply_channel
         })
 
 
 class SerialFactory(object):
+    """
+    Keeps track of the open protocols by reply channel.
+
+    Protocols are added and removed on the event loop while the serial
+    server's reply thread waits on ``changed`` for the set of channels it
+    should listen on. Commands are written to the ports from ``loop``.
 
-    def __init__(self, channel_layer):
+    Every open protocol is pinged each ``ping_interval`` seconds. With
+    ``ping_timeout`` set, a protocol whose receiver hasn't been read from
+    for that many seconds is handed to ``on_timeout``. Both deadlines live
+    on ``timers`` which ``start`` advances from the event loop.
+    """
+
+    def __init__(self, channel_layer, loop=None, ping_interval=20, ping_timeout=None, on_timeout=None):
         self.channel_layer = channel_layer
+        self.loop = loop
+        self.write_latency = LatencyStats()
         self.reply_protocols = {}
+        self.changed = threading.Condition()
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.on_timeout = on_timeout
+        self.timers = TimerWheel()
+
+    def build_protocol(self, receiver):
+        protocol = SerialProtocol(self, receiver)
+        protocol.on_connect()
+        protocol.on_open()
+        return protocol
+
+    def add_protocol(self, protocol):
+        with self.changed:
+            self.reply_protocols[protocol.reply_channel] = protocol
+            self.changed.notify_all()
+        protocol.ping_timer = self.timers.schedule(self.ping_interval, self.ping, protocol)
+        if self.ping_timeout:
+            protocol.timeout_timer = self.timers.schedule(self.ping_timeout, self.check_timeout, protocol)
+
+    def remove_protocol(self, protocol):
+        with self.changed:
+            del self.reply_protocols[protocol.reply_channel]
+            self.changed.notify_all()
+        self.timers.cancel(protocol.ping_timer)
+        self.timers.cancel(protocol.timeout_timer)
 
     def reply_channels(self):
-        return self.reply_protocols.keys()
+        with self.changed:
+            return list(self.reply_protocols.keys())
+
+    def wait_for_channels(self, timeout=None):
+        """
+        Block until there is at least one reply channel and return them all.
+        """
+        with self.changed:
+            if not self.reply_protocols:
+                self.changed.wait(timeout)
+            return list(self.reply_protocols.keys())
+
+    def start(self):
+        """
+        Advance the timer wheel once a tick from the event loop.
+        """
+        self.timers.advance()
+        self.loop.call_later(self.timers.resolution, self.start)
+
+    def ping(self, protocol):
+        protocol.set_ping()
+        protocol.ping_timer = self.timers.schedule(self.ping_interval, self.ping, protocol)
+
+    def check_timeout(self, protocol):
+        last_read = protocol.receiver.last_read
+        idle = (monotonic_ns() - last_read) / 1e9 if last_read is not None else self.ping_timeout
+        if idle < self.ping_timeout:
+            protocol.timeout_timer = self.timers.schedule(self.ping_timeout - idle, self.check_timeout, protocol)
+            return
+        logger.warning("Nothing read from {} in {:.0f}s, closing it".format(protocol.receiver, idle))
+        protocol.timeout_timer = None
+        if self.on_timeout is not None:
+            self.on_timeout(protocol)
 
     def dispatch_reply(self, channel, message):
-        if isinstance(self.reply_protocols[channel], SerialProtocol):
-            self.reply_protocols[channel].send_message(message)
+        protocol = self.reply_protocols.get(channel)
+        if isinstance(protocol, SerialProtocol):
+            protocol.send_message(message)
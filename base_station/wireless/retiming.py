@@ -0,0 +1,162 @@
+"""
+Batch re-timing of gate passes from the raw detections in a capture log.
+
+This is ``wireless.gates`` over whole arrays instead of one detection at a
+time, for re-timing a finished heat with a different threshold, smoothing
+or gap. A capture's detections are loaded into NumPy arrays per receiver
+and every pass by every transponder is found in one vectorised pass:
+
+1. Detections are grouped by transponder keeping read order, a new pass
+   starts wherever a transponder has been silent for longer than ``gap``.
+2. Sample times are taken from the transponder clock, anchored to the read
+   time of the pass's first sample.
+3. The trailing moving averages of time and RSSI are taken from cumulative
+   sums, clipped to the start of each pass.
+4. The highest average of each pass and the averages a window either side
+   of it give the parabola its crossing time is interpolated from.
+
+Given the same options the passes match what ``GatePassDetector`` reports live.
+"""
+
+import numpy as np
+from django.db import transaction
+
+from base_station.races.models import HeatEvent, Lap
+from base_station.trackers.models import Tracker
+
+from .buffers import ReceiveBuffer
+from .clock import wall_datetime
+from .decoders import Detection, get_decoder
+from .gates import GatePass
+
+
+def load_detections(reader):
+    """
+    Decode every detection in a capture, returning ``(receiver name, tracker
+    type, detections, received)`` per receiver. ``detections`` is an
+    ``(n, 4)`` int64 array of Detection fields and ``received`` the UTC
+    nanoseconds each was read at.
+    """
+    decoders = [(get_decoder(tracker_type), ReceiveBuffer()) for name, tracker_type in reader.receivers]
+    records = [[] for _ in reader.receivers]
+    received = [[] for _ in reader.receivers]
+    for index, read, wall, data in reader:
+        decoder, buffer = decoders[index]
+        buffer.free[:len(data)] = data
+        buffer.filled(len(data))
+        decoded, consumed = decoder.decode(buffer)
+        buffer.consume(consumed)
+        detections = [record for record in decoded if isinstance(record, Detection)]
+        records[index].extend(detections)
+        received[index].extend([wall] * len(detections))
+    return [
+        (name, tracker_type,
+         np.array(detections, dtype=np.int64).reshape(-1, len(Detection._fields)),
+         np.array(times, dtype=np.int64))
+        for (name, tracker_type), detections, times in zip(reader.receivers, records, received)]
+
+
+def detect_passes(detections, received, threshold=80, smoothing=5, gap=0.25):
+    """
+    Every gate pass in one receiver's detections as a list of GatePasses in time order.
+    """
+    if not len(detections):
+        return []
+    order = np.argsort(detections[:, 0], kind='mergesort')
+    transponder_ids = detections[order, 0]
+    timestamps = detections[order, 2]
+    rssi = detections[order, 3]
+    received = received[order]
+    count = len(order)
+    positions = np.arange(count)
+
+    # 1. Split into passes
+    starts = np.ones(count, dtype=bool)
+    starts[1:] = (transponder_ids[1:] != transponder_ids[:-1]) | (
+        np.diff(received) > int(gap * 1000000000))
+    first = np.flatnonzero(starts)
+    last = np.append(first[1:], count) - 1
+    pass_index = np.cumsum(starts) - 1
+    pass_start = first[pass_index]
+
+    # 2. Sample times relative to each pass's anchor, from the wrapping 32 bit transponder clock
+    delta = (timestamps - timestamps[pass_start]) & 0xFFFFFFFF
+    delta = np.where(delta & 0x80000000, delta - 0x100000000, delta)
+    relative = delta * 1000
+
+    # 3. Trailing moving averages that don't reach back before the start of the pass
+    window_start = np.maximum(positions - smoothing + 1, pass_start)
+    window = positions - window_start + 1
+    time_sums = np.concatenate(([0], np.cumsum(relative)))
+    rssi_sums = np.concatenate(([0], np.cumsum(rssi)))
+    smoothed_time = (time_sums[positions + 1] - time_sums[window_start]) // window
+    smoothed_rssi = (rssi_sums[positions + 1] - rssi_sums[window_start]) / window
+
+    # 4. First highest average of each pass and its neighbours
+    by_peak = np.lexsort((positions, -smoothed_rssi, pass_index))
+    peak = by_peak[np.searchsorted(pass_index[by_peak], np.arange(len(first)))]
+    keep = smoothed_rssi[peak] >= threshold
+    peak, first, last = peak[keep], first[keep], last[keep]
+    before = np.maximum(peak - smoothing, first)
+    after = np.where(peak + smoothing <= last, peak + smoothing, np.minimum(peak + 1, last))
+
+    x1 = smoothed_time[peak]
+    y1 = smoothed_rssi[peak]
+    a0 = (smoothed_time[before] - x1).astype(np.float64)
+    a2 = (smoothed_time[after] - x1).astype(np.float64)
+    y0 = smoothed_rssi[before] - y1
+    y2 = smoothed_rssi[after] - y1
+    denominator = a0 * a2 * (a0 - a2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a = (a2 * y0 - a0 * y2) / denominator
+        b = (a0 * a0 * y2 - a2 * a2 * y0) / denominator
+        vertex = np.clip(-b / (2 * a), a0, a2)
+    # Without a neighbour on both sides or a peak between them the crossing is the highest average
+    interpolated = (peak > first) & (peak < last) & (denominator != 0) & (a < 0)
+    crossing = received[first] + x1 + np.where(interpolated, np.trunc(vertex), 0).astype(np.int64)
+
+    chronological = np.argsort(crossing, kind='mergesort')
+    return [
+        GatePass(int(transponder_id), int(time), float(peak_rssi), int(samples))
+        for transponder_id, time, peak_rssi, samples in zip(
+            transponder_ids[peak][chronological], crossing[chronological], y1[chronological],
+            (last - first + 1)[chronological])]
+
+
+def capture_passes(reader, **options):
+    """
+    Every gate pass in a capture as ``(tracker type, GatePass)`` pairs, ``options`` go to ``detect_passes``.
+    """
+    passes = []
+    for name, tracker_type, detections, received in load_detections(reader):
+        passes.extend((tracker_type, gate_pass) for gate_pass in detect_passes(detections, received, **options))
+    return passes
+
+
+def retime_heat(heat, passes):
+    """
+    Replace the gate triggers on ``heat`` with the ``(tracker type, GatePass)``
+    pairs that fall while it was running and rebuild its laps from them,
+    returning the number of triggers removed and added.
+    """
+    started = heat.started_time
+    ended = heat.ended_time
+    events = []
+    trackers = {}
+    for tracker_type, gate_pass in passes:
+        triggered_time = wall_datetime(gate_pass.time)
+        if started is None or triggered_time < started or (ended is not None and triggered_time > ended):
+            continue
+        if tracker_type.value not in trackers:
+            trackers[tracker_type.value] = Tracker.objects.by_transponder(
+                tracker_type.value, {other.transponder_id for kind, other in passes if kind == tracker_type})
+        tracker = trackers[tracker_type.value].get(gate_pass.transponder_id)
+        if tracker is not None:
+            events.append(HeatEvent(
+                heat=heat, tracker=tracker, trigger=HeatEvent.TRIGGERS.gate.value, triggered_time=triggered_time))
+    with transaction.atomic():
+        removed, _ = heat.triggered_events.filter(trigger=HeatEvent.TRIGGERS.gate.value).delete()
+        HeatEvent.objects.bulk_create(events)
+        Lap.objects.rebuild([heat])
+        heat.changed()
+    return removed, len(events)
@@ -1,4 +1,6 @@
 
+# Consumed by a single worker, the runingest command
 channel_routing = {
-    'wireless.packet': 'base_station.wireless.consumers.packet'
+    'wireless.packet': 'base_station.wireless.consumers.packet',
+    'wireless.heat': 'base_station.wireless.consumers.heat_control',
 }
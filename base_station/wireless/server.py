@@ -3,37 +3,371 @@ Ideas, serial server is it's own module like daphean, allows you to place differ
 serial protocols in place of a byte streaming one.
 
 The module has a CLI Server that accepts the serial port/buad rate + any other config.
+The protocol spoken on each port is picked by tracker type from the decoder registry.
+
+Reading happens on an asyncio loop with every port in non-blocking mode, so one
+process serves all of a track's receivers. Decoded packets are put on bounded
+ring buffers that a dispatcher thread drains into batched channel messages, so
+a slow channel layer never holds up the next read from a receiver. The
+dispatcher also reduces each receiver's detections to gate passes, see
+``wireless.gates``.
 """
 
+import asyncio
+import logging
+import signal
+import threading
+import time
+from collections import OrderedDict
+
+from base_station.trackers.models import TRACKER_TYPES
+
+from .adapters import SerialPortAdapter
+from .buffers import OVERFLOW_POLICIES, PacketRing, ReceiveBuffer
+from .capture import CaptureWriter
+from .clock import LatencyStats, WallClock, monotonic_ns
+from .decoders import TIMING_RECORDS, Detection, get_decoder
+from .gates import GatePassDetector
 from .protocol import SerialFactory
 
-class Server(object):
 
-    def __init__(self, channel_layer, interface='/dev/null', baud=False):
-        self.channel_layer = channel_layer
+logger = logging.getLogger(__name__)
+
+
+class Receiver(object):
+    """
+    A wireless receiver attached to one serial port, such as a start/finish or sector gate.
+    """
+
+    def __init__(self, name, interface, baud, tracker_type=TRACKER_TYPES.rw_transponder):
+        self.name = name
         self.interface = interface
         self.baud = baud
+        self.tracker_type = tracker_type
+        self.decoder = get_decoder(tracker_type)
+        self.buffer = ReceiveBuffer()
+        # Read time and packets the ring buffer refused, held while reading is paused
+        self.backlog = None
+        self.paused = False
+        self.port = None
+        # Capture log every read is written to along with this receiver's index in it
+        self.capture = None
+        self.index = None
+        # SerialProtocol handling messages sent to this receiver's reply channel
+        self.protocol = None
+        # Monotonic time anything was last read from the port
+        self.last_read = None
+
+    def __str__(self):
+        return "{} ({})".format(self.name, self.interface)
+
+    def open(self):
+        self.port = SerialPortAdapter(self.interface, self.baud).open()
+        self.last_read = monotonic_ns()
+        return self
+
+    def close(self):
+        if self.port is not None:
+            self.port.close()
+            self.port = None
+
+    def fileno(self):
+        return self.port.fileno()
+
+    def read(self):
+        """
+        Read what is waiting on the port and return the monotonic time it was
+        read at along with the packets it completed.
+        """
+        buffer = self.buffer
+        start = buffer.length
+        count = self.port.readinto(buffer.free)
+        received = monotonic_ns()
+        if not count:
+            return received, []
+        self.last_read = received
+        if self.capture is not None:
+            self.capture.write(self.index, received, buffer.view[start:start + count])
+        buffer.filled(count)
+        return received, self.decode_packets()
+
+    def decode_packets(self):
+        records, consumed = self.decoder.decode(self.buffer)
+        if consumed:
+            self.buffer.consume(consumed)
+        elif not self.buffer.free:
+            # A full buffer with nothing decodable can never make progress
+            logger.warning("Discarding {} undecodable bytes from {}".format(self.buffer.length, self))
+            self.decoder.garbage += self.buffer.length
+            self.buffer.clear()
+        return records
+
+
+def telemetry_key(entry):
+    receiver, received, record = entry
+    return (receiver.name, record.transponder_id)
+
+
+class Server(object):
+    """
+    Timing packets go through a ring that never drops, when it fills up the
+    receivers stop being read until the dispatcher has made room again.
+    Telemetry goes through its own ring that follows ``telemetry_policy``.
+
+    Every packet is stamped with the monotonic time it was read at, the
+    dispatcher converts those to UTC nanoseconds with ``clock`` which is
+    resynchronised every ``clock_interval`` seconds. Passes with an RSSI
+    peak under ``gate_threshold`` don't trigger a gate.
+
+    With ``capture`` set every read is also written to a capture log at that
+    path, see ``wireless.capture``.
+
+    Each receiver gets a SerialProtocol with its own reply channel. A reply
+    thread blocks in the channel layer on those channels and wakes the event
+    loop only when a message arrives. Layers that can't block are polled
+    with a backoff between ``poll_min`` and ``poll_max`` seconds. Reply
+    channels are pinged every ``ping_interval`` seconds and, with
+    ``ping_timeout`` set, a receiver that has gone that long without being
+    read from is closed.
+    """
+
+    poll_min = 0.001
+    poll_max = 0.05
+    # Seconds a transponder has to be silent for before its pass through a gate is over
+    gate_gap = 0.25
+
+    def __init__(self, channel_layer, receivers, batch_size=64, batch_interval=0.005,
+                 ring_size=4096, telemetry_policy=OVERFLOW_POLICIES.coalesce, stats_interval=60,
+                 clock_interval=10, capture=None, ping_interval=20, ping_timeout=None, gate_threshold=80,
+                 loop=None):
+        self.channel_layer = channel_layer
+        self.receivers = receivers
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.stats_interval = stats_interval
+        self.clock_interval = clock_interval
+        self.clock = WallClock()
+        self.capture = capture
+        self.capture_writer = None
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.loop = loop
+        self.timing = PacketRing(ring_size, OVERFLOW_POLICIES.block)
+        self.telemetry = PacketRing(ring_size, telemetry_policy, key=telemetry_key)
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.dispatcher = None
+        self.reply_latency = LatencyStats()
+        # Only ever used from the dispatcher thread
+        self.detectors = OrderedDict(
+            (receiver, GatePassDetector(threshold=gate_threshold, gap=self.gate_gap)) for receiver in receivers)
 
     def run(self):
-        self.factory = SerialFactory(self.channel_layer)
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+        # Everything is set up inside the try so a port failing to open still stops the dispatcher
+        try:
+            self.factory = SerialFactory(
+                self.channel_layer, self.loop, ping_interval=self.ping_interval, ping_timeout=self.ping_timeout,
+                on_timeout=self.on_ping_timeout)
+            self.dispatcher = threading.Thread(target=self.dispatch, name="serial-dispatcher")
+            self.dispatcher.start()
+            # Daemonised as a blocking receive can't be interrupted when stopping
+            self.replies = threading.Thread(target=self.backend_render, name="serial-replies", daemon=True)
+            self.replies.start()
+            if self.capture:
+                self.capture_writer = CaptureWriter(self.capture, self.receivers)
+                self.capture_writer.write_clock(monotonic_ns(), self.clock.offset)
+            for index, receiver in enumerate(self.receivers):
+                receiver.capture = self.capture_writer
+                receiver.index = index
+                receiver.open()
+                receiver.protocol = self.factory.build_protocol(receiver)
+                self.loop.add_reader(receiver.fileno(), self.on_readable, receiver)
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                self.loop.add_signal_handler(signum, self.loop.stop)
+            self.loop.call_later(self.stats_interval, self.log_stats)
+            self.loop.call_later(self.clock_interval, self.sync_clock)
+            self.factory.start()
+            self.loop.run_forever()
+        finally:
+            self.stop()
 
-    def backend_render(self):
+    def stop(self):
+        for receiver in self.receivers:
+            if receiver.port is not None:
+                self.close_receiver(receiver)
+        self.stopping = True
+        self.wakeup.set()
+        if self.dispatcher is not None:
+            self.dispatcher.join()
+        if self.capture_writer is not None:
+            self.capture_writer.close()
+
+    def close_receiver(self, receiver):
+        if not receiver.paused:
+            self.loop.remove_reader(receiver.fileno())
+        if receiver.protocol is not None:
+            receiver.protocol.on_close()
+            receiver.protocol = None
+        receiver.close()
+
+    def drop_receiver(self, receiver):
+        """
+        Close a receiver that has failed, stopping the server once none are left.
+        """
+        self.close_receiver(receiver)
+        if not any(r.port is not None for r in self.receivers):
+            self.loop.stop()
+
+    def on_ping_timeout(self, protocol):
+        self.drop_receiver(protocol.receiver)
+
+    def on_readable(self, receiver):
+        try:
+            received, records = receiver.read()
+        except OSError as e:
+            logger.error("Serial read failed on {}: {}".format(receiver, e))
+            self.drop_receiver(receiver)
+            return
+        if records:
+            self.enqueue(receiver, received, records)
+            self.wakeup.set()
+
+    def enqueue(self, receiver, received, records):
+        for index, record in enumerate(records):
+            ring = self.timing if isinstance(record, TIMING_RECORDS) else self.telemetry
+            if not ring.put((receiver, received, record)):
+                receiver.backlog = (received, records[index:])
+                self.pause(receiver)
+                return
+
+    def pause(self, receiver):
+        """
+        Stop reading a receiver, its packets wait in the OS serial buffer instead.
+        """
+        logger.debug("Ring buffer full, pausing reads from {}".format(receiver))
+        receiver.paused = True
+        self.loop.remove_reader(receiver.fileno())
+
+    def resume(self):
+        for receiver in self.receivers:
+            if not receiver.paused or receiver.port is None:
+                continue
+            (received, backlog), receiver.backlog = receiver.backlog, None
+            receiver.paused = False
+            self.enqueue(receiver, received, backlog)
+            if not receiver.paused:
+                self.loop.add_reader(receiver.fileno(), self.on_readable, receiver)
+        self.wakeup.set()
+
+    def dispatch(self):
+        """
+        Dispatcher thread, drains the ring buffers into channel layer messages.
+        """
         while True:
-            channels = self.factory.reply_channels()
-            # Quit if reactor is stopping
-            if not reactor.running:
+            # Wake up in time to report passes once their transponder has left the gate
+            passing = any(self.detectors.values())
+            self.wakeup.wait(self.gate_gap if passing else None)
+            self.wakeup.clear()
+            if passing:
+                self.expire_passes()
+            if self.stopping and not (self.timing or self.telemetry):
+                self.finish_passes()
                 return
+            # Give a batch the chance to fill before sending it
+            if len(self.timing) + len(self.telemetry) < self.batch_size and not self.stopping:
+                time.sleep(self.batch_interval)
+            while self.timing or self.telemetry:
+                entries = self.timing.drain(self.batch_size)
+                entries.extend(self.telemetry.drain(self.batch_size - len(entries)))
+                self.send_entries(entries)
+                if any(receiver.paused for receiver in self.receivers) and not self.stopping:
+                    self.loop.call_soon_threadsafe(self.resume)
+
+    def send_entries(self, entries):
+        to_wall = self.clock.to_wall
+        batches = OrderedDict()
+        for receiver, received, record in entries:
+            if receiver not in batches:
+                batches[receiver] = ([], [])
+            packets, times = batches[receiver]
+            packets.append(record)
+            times.append(to_wall(received))
+        for receiver, (packets, times) in batches.items():
+            detections = [(packet, time) for packet, time in zip(packets, times) if isinstance(packet, Detection)]
+            passes = self.detectors[receiver].feed(
+                [packet for packet, time in detections], [time for packet, time in detections])
+            self.send_batch(receiver, packets, times, passes)
+
+    def expire_passes(self):
+        now = self.clock.to_wall(monotonic_ns())
+        for receiver, detector in self.detectors.items():
+            passes = detector.expire(now)
+            if passes:
+                self.send_batch(receiver, [], [], passes)
+
+    def finish_passes(self):
+        for receiver, detector in self.detectors.items():
+            passes = detector.finish()
+            if passes:
+                self.send_batch(receiver, [], [], passes)
+
+    def send_batch(self, receiver, packets, times, passes):
+        self.send_message({
+            'receiver': receiver.name,
+            'tracker_type': receiver.tracker_type.value,
+            'packets': packets,
+            # UTC nanoseconds each packet was read at
+            'received': times,
+            'passes': passes,
+        })
+
+    def send_message(self, message):
+        try:
+            self.channel_layer.send('wireless.packet', message)
+        except Exception as e:
+            logger.error("Failed to send {} packets and {} passes from {}: {}".format(
+                len(message['packets']), len(message['passes']), message['receiver'], e))
+
+    def sync_clock(self):
+        offset = self.clock.sync()
+        if self.capture_writer is not None:
+            self.capture_writer.write_clock(monotonic_ns(), offset)
+            self.capture_writer.flush()
+        self.loop.call_later(self.clock_interval, self.sync_clock)
+
+    def log_stats(self):
+        logger.info("Timing ring {}, telemetry ring {}, reply dispatch {}, command writes {}".format(
+            self.timing.stats(), self.telemetry.stats(), self.reply_latency.stats(),
+            self.factory.write_latency.stats()))
+        for receiver in self.receivers:
+            logger.info("Receiver {} frames {}".format(receiver, receiver.decoder.stats()))
+        self.loop.call_later(self.stats_interval, self.log_stats)
+
+    def backend_render(self):
+        """
+        Reply thread, blocks in the channel layer until a message arrives on
+        one of the reply channels and hands it to the event loop.
+        """
+        backoff = self.poll_min
+        while not self.stopping:
             # Don't do anything if there's no channels to listen on
-            if channels:
-                channel, message = self.channel_layer.receive_many(channels, block=True)
-            else:
-                time.sleep(0.1)
+            channels = self.factory.wait_for_channels(timeout=1)
+            if not channels:
                 continue
-            # Wait around if there's nothing received
+            started = time.monotonic()
+            channel, message = self.channel_layer.receive_many(channels, block=True)
             if channel is None:
-                time.sleep(0.05)
+                # Layers that can't block come straight back, back off so they aren't spun on
+                if time.monotonic() - started < self.poll_min:
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, self.poll_max)
                 continue
-            # Deal with the message
-            self.factory.dispatch_reply(channel, message)
+            backoff = self.poll_min
+            self.loop.call_soon_threadsafe(self.dispatch_reply, channel, message, monotonic_ns())
 
-    def keepalive_sender(self):
+    def dispatch_reply(self, channel, message, received):
+        self.factory.dispatch_reply(channel, message)
+        self.reply_latency.add(monotonic_ns() - received)
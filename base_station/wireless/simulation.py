@@ -0,0 +1,134 @@
+"""
+Synthetic transponder fleet for load testing the wireless pipeline.
+
+Every simulated transponder flies laps past a ring of gates with lap times
+drawn from a normal distribution. Passing a gate produces a burst of
+detections at that gate's receiver with the RSSI rising and falling around
+the crossing, and transponders can drop detections or crash out entirely.
+Passes are kept in a heap so the fleet scales to hundreds of transponders.
+"""
+
+import heapq
+import math
+import random
+from collections import namedtuple
+
+from .decoders import Detection
+
+
+# A simulated detection, ``time`` is seconds since the simulation started
+SimulatedDetection = namedtuple('SimulatedDetection', ('time', 'gate', 'detection'))
+
+
+class SimulatedTransponder(object):
+
+    def __init__(self, transponder_id, lap_time, lap_jitter, peak_rssi):
+        self.transponder_id = transponder_id
+        self.lap_time = lap_time
+        self.lap_jitter = lap_jitter
+        self.peak_rssi = peak_rssi
+        self.sequence = 0
+        self.laps = 0
+        self.crashed = False
+
+    def next_lap_time(self, rng):
+        # Never faster than half the mean, nobody flies a lap that clean
+        return max(rng.gauss(self.lap_time, self.lap_jitter), self.lap_time / 2)
+
+    def next_sequence(self):
+        self.sequence = (self.sequence + 1) & 0xFFFF
+        return self.sequence
+
+
+class Fleet(object):
+    """
+    Generates the detections of ``count`` transponders flying ``laps`` laps.
+
+    :gates: number of gates evenly spaced around the lap, gate 0 is start/finish.
+    :lap_time: mean lap time in seconds, each transponder varies it slightly.
+    :lap_jitter: standard deviation of a transponder's lap times in seconds.
+    :pass_duration: seconds a receiver hears a transponder for as it passes.
+    :sample_rate: detections per second a receiver reports while in range.
+    :rssi_floor: RSSI at the edge of a receiver's range.
+    :noise: standard deviation of the RSSI noise.
+    :dropout: chance of any single detection being lost.
+    :crash_chance: chance of a transponder crashing out on any lap.
+    """
+
+    def __init__(self, count, laps=10, gates=1, first_id=1, lap_time=20.0, lap_jitter=1.5,
+                 pass_duration=0.4, sample_rate=100, rssi_floor=40, noise=4.0, dropout=0.05,
+                 crash_chance=0.01, seed=None):
+        self.rng = random.Random(seed)
+        self.laps = laps
+        self.gates = gates
+        self.pass_duration = pass_duration
+        self.sample_rate = sample_rate
+        self.rssi_floor = rssi_floor
+        self.noise = noise
+        self.dropout = dropout
+        self.crash_chance = crash_chance
+        self.transponders = [
+            SimulatedTransponder(
+                first_id + index,
+                lap_time=self.rng.gauss(lap_time, lap_time * 0.05),
+                lap_jitter=lap_jitter,
+                peak_rssi=self.rng.randint(150, 250))
+            for index in range(count)]
+
+    def detections(self):
+        """
+        Yield every SimulatedDetection of the race in time order.
+        """
+        rng = self.rng
+        # (crossing time, tie breaker, transponder, gate, lap time)
+        passes = []
+        for index, transponder in enumerate(self.transponders):
+            # Staggered start over the first second as the fleet crosses the line
+            heapq.heappush(passes, (rng.uniform(0, 1), index, transponder, 0, transponder.next_lap_time(rng)))
+        # (time, tie breaker, SimulatedDetection)
+        pending = []
+        counter = len(self.transponders)
+        lead_in = self.pass_duration / 2
+        while passes or pending:
+            horizon = passes[0][0] - lead_in if passes else float('inf')
+            while pending and pending[0][0] <= horizon:
+                yield heapq.heappop(pending)[2]
+            if not passes:
+                continue
+            crossing, _, transponder, gate, lap_time = heapq.heappop(passes)
+            for detection in self.pass_detections(transponder, gate, crossing):
+                counter += 1
+                heapq.heappush(pending, (detection.time, counter, detection))
+            # Work out where this transponder crosses next
+            gate += 1
+            if gate == self.gates:
+                gate = 0
+                transponder.laps += 1
+                if transponder.laps > self.laps:
+                    continue
+                if rng.random() < self.crash_chance:
+                    transponder.crashed = True
+                    continue
+                lap_time = transponder.next_lap_time(rng)
+            counter += 1
+            heapq.heappush(passes, (crossing + lap_time / self.gates, counter, transponder, gate, lap_time))
+
+    def pass_detections(self, transponder, gate, crossing):
+        rng = self.rng
+        samples = int(self.pass_duration * self.sample_rate)
+        sigma = self.pass_duration / 4
+        start = crossing - self.pass_duration / 2 + rng.uniform(0, 1.0 / self.sample_rate)
+        detections = []
+        for sample in range(samples):
+            time = start + sample / self.sample_rate
+            if rng.random() < self.dropout:
+                continue
+            strength = math.exp(-0.5 * ((time - crossing) / sigma) ** 2)
+            rssi = self.rssi_floor + (transponder.peak_rssi - self.rssi_floor) * strength
+            rssi = int(min(max(rssi + rng.gauss(0, self.noise), 0), 255))
+            detections.append(SimulatedDetection(time, gate, Detection(
+                transponder.transponder_id,
+                transponder.next_sequence(),
+                int(time * 1000000) & 0xFFFFFFFF,
+                rssi)))
+        return detections
@@ -1,3 +1,566 @@
-from django.test import TestCase
+import asyncio
+import math
+import os
+import pty
+import shutil
+import tempfile
+from datetime import datetime, timezone
 
-# Create your tests here.
+import numpy as np
+from asgiref.inmemory import ChannelLayer
+from channels.message import Message
+from django.test import SimpleTestCase, TestCase
+from django.utils.timezone import now
+from model_mommy import mommy
+
+from base_station.races.live import live_heats
+from base_station.races.models import HEAT_CHANNEL, HeatEvent, Lap, RaceHeat
+from base_station.races.writers import heat_events
+from base_station.trackers.models import TRACKER_TYPES
+from .adapters import SerialPortAdapter
+from .benchmarks import STAGES, IngestBenchmark, fleet_reads
+from .buffers import OVERFLOW_POLICIES, PacketRing, ReceiveBuffer
+from .capture import CAPTURE_HEADER, CAPTURE_RECEIVER, CAPTURE_RECORDS, CaptureReader, CaptureWriter
+from .clock import TransponderClock, WallClock, datetime_wall, monotonic_ns, wall_datetime
+from .commands import CommandWriter
+from .consumers import IngestLock, heat_control
+from .decoders import (
+    BROADCAST_ID, COMMANDS, Detection, ILapDecoder, RWTransponderDecoder, Telemetry, encode_rw_detection,
+    get_decoder)
+from .gates import GatePassDetector, clock_delta
+from .protocol import SerialFactory
+from .retiming import detect_passes, load_detections
+from .server import Receiver, Server
+from .simulation import Fleet
+from .timers import TimerWheel
+
+
+class DecoderTestMixin(object):
+
+    def setUp(self):
+        self.decoder = get_decoder(self.tracker_type)
+        self.buffer = ReceiveBuffer(size=256)
+
+    def feed(self, data):
+        self.buffer.free[:len(data)] = data
+        self.buffer.filled(len(data))
+        records, consumed = self.decoder.decode(self.buffer)
+        self.buffer.consume(consumed)
+        return records
+
+
+class TestDecoderRegistry(SimpleTestCase):
+
+    def test_lookup_by_tracker_type(self):
+        self.assertIsInstance(get_decoder(TRACKER_TYPES.rw_transponder), RWTransponderDecoder)
+        self.assertIsInstance(get_decoder(TRACKER_TYPES.ilap.value), ILapDecoder)
+
+    def test_unknown_tracker_type(self):
+        with self.assertRaises(ValueError):
+            get_decoder(TRACKER_TYPES.unknown)
+
+
+class TestRWTransponderDecoder(DecoderTestMixin, SimpleTestCase):
+
+    tracker_type = TRACKER_TYPES.rw_transponder
+
+    def test_decodes_frames(self):
+        records = self.feed(encode_rw_detection(12, 1, 1000, 90) + encode_rw_detection(14, 7, 2000, 120))
+        self.assertEqual(records, [Detection(12, 1, 1000, 90), Detection(14, 7, 2000, 120)])
+        self.assertEqual(self.buffer.length, 0)
+
+    def test_decodes_telemetry(self):
+        telemetry = Telemetry(12, 1000, 1500, -20, 3000, 90, 16400)
+        records = self.feed(self.decoder.encode(telemetry) + encode_rw_detection(12, 1, 1000, 90))
+        self.assertEqual(records, [telemetry, Detection(12, 1, 1000, 90)])
+
+    def test_partial_frame_waits_for_remainder(self):
+        frame = encode_rw_detection(12, 1, 1000, 90)
+        self.assertEqual(self.feed(frame[:5]), [])
+        self.assertEqual(self.buffer.length, 5)
+        self.assertEqual(self.feed(frame[5:]), [Detection(12, 1, 1000, 90)])
+
+    def test_skips_garbage_and_corrupt_frames(self):
+        corrupt = bytearray(encode_rw_detection(12, 1, 1000, 90))
+        corrupt[6] ^= 0xFF
+        records = self.feed(b'\x00\xa5\x13' + bytes(corrupt) + encode_rw_detection(14, 7, 2000, 120))
+        self.assertEqual(records, [Detection(14, 7, 2000, 120)])
+        self.assertEqual(self.decoder.stats(), {'rejected': 2, 'garbage_bytes': 3 + len(corrupt), 'ignored': 0})
+
+    def test_counts_trailing_garbage(self):
+        self.assertEqual(self.feed(b'\x00' * 10), [])
+        self.assertEqual(self.buffer.length, 0)
+        self.assertEqual(self.decoder.garbage, 10)
+
+
+class TestILapDecoder(DecoderTestMixin, SimpleTestCase):
+
+    tracker_type = TRACKER_TYPES.ilap
+
+    def test_decodes_lines(self):
+        records = self.feed(b'12\t1500\t80\r\n14\t1700\t95\r\n14\t18')
+        self.assertEqual(records, [Detection(12, 0, 1500000, 80), Detection(14, 0, 1700000, 95)])
+        self.assertEqual(self.buffer.length, 5)
+        self.assertEqual(self.feed(b'00\t90\r\n'), [Detection(14, 0, 1800000, 90)])
+
+    def test_skips_malformed_lines(self):
+        records = self.feed(b'garbage\r\n12\tx\t80\r\n12\t1500\t80\r\n')
+        self.assertEqual(records, [Detection(12, 0, 1500000, 80)])
+        self.assertEqual(self.decoder.stats(), {'rejected': 2, 'garbage_bytes': 18})
+
+
+class TestPacketRing(SimpleTestCase):
+
+    def test_block_refuses_when_full(self):
+        ring = PacketRing(2)
+        self.assertTrue(ring.put(1))
+        self.assertTrue(ring.put(2))
+        self.assertFalse(ring.put(3))
+        self.assertEqual(ring.drain(), [1, 2])
+        self.assertEqual(ring.stats()['refused'], 1)
+        self.assertEqual(ring.stats()['high_water'], 2)
+
+    def test_drop_oldest(self):
+        ring = PacketRing(2, OVERFLOW_POLICIES.drop_oldest)
+        for item in range(4):
+            ring.put(item)
+        self.assertEqual(ring.drain(), [2, 3])
+        self.assertEqual(ring.dropped, 2)
+
+    def test_coalesce_keeps_latest_per_key(self):
+        ring = PacketRing(3, OVERFLOW_POLICIES.coalesce, key=lambda item: item[0])
+        for item in (('a', 1), ('b', 1), ('c', 1), ('a', 2), ('d', 1)):
+            ring.put(item)
+        self.assertEqual(ring.coalesced, 1)
+        self.assertEqual(ring.dropped, 1)
+        self.assertEqual(ring.drain(), [('b', 1), ('c', 1), ('d', 1)])
+
+    def test_wraps_around(self):
+        ring = PacketRing(3)
+        ring.put(1)
+        ring.put(2)
+        self.assertEqual(ring.drain(1), [1])
+        ring.put(3)
+        ring.put(4)
+        self.assertEqual(ring.drain(), [2, 3, 4])
+
+
+class TestWallClock(SimpleTestCase):
+
+    def test_maps_monotonic_to_utc(self):
+        clock = WallClock()
+        wall = wall_datetime(clock.to_wall(monotonic_ns()))
+        self.assertLess(abs((datetime.now(timezone.utc) - wall).total_seconds()), 0.1)
+
+    def test_datetime_wall_round_trip(self):
+        when = datetime(2016, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+        self.assertEqual(wall_datetime(datetime_wall(when)), when)
+
+    def test_wall_datetime_keeps_microseconds(self):
+        self.assertEqual(
+            wall_datetime(1458796800123456789),
+            datetime(2016, 3, 24, 5, 20, 0, 123456, tzinfo=timezone.utc))
+
+
+class TestTransponderClock(SimpleTestCase):
+
+    def test_follows_transponder_timestamps(self):
+        clock = TransponderClock()
+        start = 1500000000 * 1000000000
+        self.assertEqual(clock.to_wall(1, 0xFFFFF000, start), start)
+        # Read late in a batch, placed by the timestamp and across the wrap
+        self.assertEqual(clock.to_wall(1, 0x00000F00, start + 9000000), start + 0x1F00 * 1000)
+
+    def test_reanchors_when_far_off(self):
+        clock = TransponderClock(tolerance=1000000)
+        self.assertEqual(clock.to_wall(1, 100, 5000000), 5000000)
+        self.assertEqual(clock.to_wall(1, 50, 9000000), 9000000)
+
+
+class TestCapture(SimpleTestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+        self.addCleanup(os.remove, self.path)
+
+    def test_round_trip(self):
+        receivers = [
+            Receiver('start', '/dev/null', 115200),
+            Receiver('sector', '/dev/null', 115200, tracker_type=TRACKER_TYPES.ilap),
+        ]
+        writer = CaptureWriter(self.path, receivers)
+        writer.write_clock(0, 1000)
+        writer.write(0, 10, encode_rw_detection(12, 1, 1000, 90))
+        writer.write_clock(20, 2000)
+        writer.write(1, 30, memoryview(b'12\t1500\t80\r\n'))
+        writer.close()
+
+        reader = CaptureReader(self.path)
+        self.assertEqual(reader.receivers, [('start', TRACKER_TYPES.rw_transponder), ('sector', TRACKER_TYPES.ilap)])
+        self.assertEqual(
+            [(index, received, wall, bytes(data)) for index, received, wall, data in reader],
+            [(0, 10, 1010, encode_rw_detection(12, 1, 1000, 90)), (1, 30, 2030, b'12\t1500\t80\r\n')])
+
+    def test_full_buffer_reads(self):
+        writer = CaptureWriter(self.path, [Receiver('start', '/dev/null', 115200)])
+        data = bytes(range(256)) * 256
+        writer.write(0, 10, data)
+        writer.write(0, 20, data[:3])
+        writer.close()
+        self.assertEqual([read[-1] for read in CaptureReader(self.path)], [data, data[:3]])
+
+    def test_reads_first_version_logs(self):
+        with open(self.path, 'wb') as capture:
+            capture.write(b'BSCAP\x01' + CAPTURE_HEADER.pack(1))
+            capture.write(CAPTURE_RECEIVER.pack(TRACKER_TYPES.rw_transponder.value, 5) + b'start')
+            capture.write(CAPTURE_RECORDS[b'BSCAP\x01'].pack(10, 0, 3) + b'abc')
+        self.assertEqual(list(CaptureReader(self.path)), [(0, 10, 10, b'abc')])
+
+
+class TestFleet(SimpleTestCase):
+
+    def test_detections_are_in_time_order(self):
+        fleet = Fleet(20, laps=3, gates=2, seed=1)
+        times = [simulated.time for simulated in fleet.detections()]
+        self.assertTrue(times)
+        self.assertEqual(times, sorted(times))
+
+    def test_every_lap_passes_every_gate(self):
+        fleet = Fleet(4, laps=3, gates=2, dropout=0, crash_chance=0, seed=1)
+        gates = {(simulated.gate, simulated.detection.transponder_id) for simulated in fleet.detections()}
+        self.assertEqual(gates, {(gate, transponder) for gate in (0, 1) for transponder in (1, 2, 3, 4)})
+
+    def test_detections_encode_for_the_receiver(self):
+        decoder = get_decoder(TRACKER_TYPES.ilap)
+        simulated = next(Fleet(1, seed=1).detections())
+        self.assertEqual(decoder.parse_frame(decoder.encode(simulated.detection)[:-2]).transponder_id, 1)
+
+
+class TestGatePassDetector(SimpleTestCase):
+
+    def crossing(self, detector, crossing, peak, received=10 ** 18):
+        """
+        Feed a pass peaking at ``crossing`` seconds sampled every 10ms from a
+        transponder clock near wrapping, read in batches every 30ms. Returns
+        the passes and the UTC nanoseconds ``crossing`` is counted from.
+        """
+        detections, times = [], []
+        for sample in range(40):
+            time = crossing - 0.2 + sample * 0.01
+            rssi = 40 + (peak - 40) * math.exp(-0.5 * ((time - crossing) / 0.1) ** 2)
+            detections.append(Detection(1, sample, (0xFFFF0000 + int(time * 1000000)) & 0xFFFFFFFF, int(rssi)))
+            times.append(received + int(math.ceil(time / 0.03) * 0.03 * 1000000000))
+        return detector.feed(detections, times) + detector.finish(), times[0] - int((crossing - 0.2) * 1000000000)
+
+    def test_one_pass_per_crossing(self):
+        fleet = Fleet(4, laps=3, gates=2, crash_chance=0, seed=1)
+        detectors = [GatePassDetector(), GatePassDetector()]
+        passes = []
+        for simulated in fleet.detections():
+            passes.extend(detectors[simulated.gate].feed([simulated.detection], [int(simulated.time * 1000000000)]))
+        for detector in detectors:
+            passes.extend(detector.finish())
+        self.assertEqual(len(passes), 4 * 2 * 4)
+
+    def test_interpolates_crossing_between_samples(self):
+        passes, origin = self.crossing(GatePassDetector(), 1.004, 200)
+        self.assertEqual(len(passes), 1)
+        self.assertAlmostEqual((passes[0].time - origin) / 1000000000, 1.004, delta=0.001)
+        self.assertEqual(passes[0].samples, 40)
+
+    def test_ignores_passes_under_threshold(self):
+        passes, origin = self.crossing(GatePassDetector(threshold=80), 1.0, 70)
+        self.assertEqual(passes, [])
+
+    def test_clock_delta_wraps(self):
+        self.assertEqual(clock_delta(5, 0xFFFFFFFB), 10)
+        self.assertEqual(clock_delta(0xFFFFFFFB, 5), -10)
+
+
+class TestRetiming(SimpleTestCase):
+
+    def setUp(self):
+        self.simulated = list(Fleet(6, laps=4, gates=1, seed=2).detections())
+        # Read in batches every 3ms
+        self.received = [10 ** 18 + int(simulated.time / 0.003) * 3000000 for simulated in self.simulated]
+
+    def test_matches_streaming_detector(self):
+        for options in ({}, {'threshold': 150, 'smoothing': 3, 'gap': 0.1}):
+            detector = GatePassDetector(**options)
+            live = []
+            for simulated, received in zip(self.simulated, self.received):
+                live.extend(detector.feed([simulated.detection], [received]))
+            live.extend(detector.finish())
+            batch = detect_passes(
+                np.array([simulated.detection for simulated in self.simulated], dtype=np.int64),
+                np.array(self.received, dtype=np.int64), **options)
+            self.assertTrue(batch)
+            self.assertEqual(sorted(batch), sorted(live))
+
+    def test_loads_detections_from_capture(self):
+        path = os.path.join(tempfile.mkdtemp(), 'race.cap')
+        writer = CaptureWriter(path, [Receiver('start', '/dev/null', 115200)])
+        writer.write(0, 1000, encode_rw_detection(12, 1, 1000, 90) + encode_rw_detection(14, 7, 2000, 120))
+        writer.close()
+        (name, tracker_type, detections, received), = load_detections(CaptureReader(path))
+        self.assertEqual(name, 'start')
+        self.assertEqual(detections.tolist(), [[12, 1, 1000, 90], [14, 7, 2000, 120]])
+        self.assertEqual(received.tolist(), [1000, 1000])
+
+
+class TestSerialFactory(SimpleTestCase):
+
+    def setUp(self):
+        self.channel_layer = ChannelLayer()
+        self.factory = SerialFactory(self.channel_layer)
+        self.protocol = self.factory.build_protocol(Receiver('start', '/dev/null', 115200))
+
+    def test_protocol_listens_on_reply_channel(self):
+        self.assertEqual(self.factory.wait_for_channels(timeout=0), [self.protocol.reply_channel])
+        channel, message = self.channel_layer.receive_many(['serial.connect'])
+        self.assertEqual(message['receiver'], 'start')
+        self.assertEqual(message['reply_channel'], self.protocol.reply_channel)
+
+    def test_close_removes_reply_channel(self):
+        self.protocol.on_close()
+        self.assertEqual(self.factory.reply_channels(), [])
+        self.assertEqual(len(self.factory.timers), 0)
+
+    def test_pings_reply_channel(self):
+        timers = self.factory.timers
+        timers.advance(timers.started + 19)
+        self.assertEqual(self.channel_layer.receive_many(['serial.ping']), (None, None))
+        timers.advance(timers.started + 41)
+        channel, message = self.channel_layer.receive_many(['serial.ping'])
+        self.assertEqual(message['reply_channel'], self.protocol.reply_channel)
+        channel, message = self.channel_layer.receive_many(['serial.ping'])
+        self.assertEqual(message['reply_channel'], self.protocol.reply_channel)
+        self.assertEqual(len(timers), 1)
+
+    def test_ilap_receivers_take_no_commands(self):
+        protocol = self.factory.build_protocol(Receiver('sector', '/dev/null', 115200, TRACKER_TYPES.ilap))
+        protocol.send_message({"command": "arm"})
+        self.assertEqual(len(protocol.writer), 0)
+
+    def test_times_out_idle_receiver(self):
+        timed_out = []
+        factory = SerialFactory(self.channel_layer, ping_timeout=5, on_timeout=timed_out.append)
+        protocol = factory.build_protocol(Receiver('finish', '/dev/null', 115200))
+        factory.timers.advance(factory.timers.started + 6)
+        self.assertEqual(timed_out, [protocol])
+
+
+class TestTimerWheel(SimpleTestCase):
+
+    def setUp(self):
+        self.wheel = TimerWheel(resolution=1, slots=4, clock=lambda: 0)
+        self.fired = []
+
+    def test_fires_when_due(self):
+        self.wheel.schedule(2, self.fired.append, 'a')
+        self.wheel.schedule(9, self.fired.append, 'b')
+        self.assertEqual(self.wheel.advance(1), 0)
+        self.assertEqual(self.wheel.advance(2), 1)
+        self.assertEqual(self.fired, ['a'])
+        # Due after more than a turn of the wheel
+        self.assertEqual(self.wheel.advance(8), 0)
+        self.assertEqual(self.wheel.advance(9), 1)
+        self.assertEqual(self.fired, ['a', 'b'])
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_cancel(self):
+        timer = self.wheel.schedule(1, self.fired.append, 'a')
+        self.wheel.cancel(timer)
+        self.wheel.advance(5)
+        self.assertEqual(self.fired, [])
+
+
+class TestCommandWriter(SimpleTestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        read_fd, write_fd = os.pipe()
+        self.output = open(read_fd, 'rb')
+        self.addCleanup(self.output.close)
+        self.receiver = Receiver('start', '/dev/null', 115200)
+        self.receiver.port = SerialPortAdapter('/dev/null', 115200)
+        self.receiver.port.port = open(write_fd, 'wb', buffering=0)
+        self.addCleanup(self.receiver.close)
+        self.writer = CommandWriter(self.receiver, self.loop)
+
+    def tick(self):
+        self.loop.run_until_complete(asyncio.sleep(0))
+
+    def test_commands_are_written_together(self):
+        decoder = self.receiver.decoder
+        for transponder_id in range(16):
+            self.writer.queue(COMMANDS.set_id, transponder_id, 100 + transponder_id)
+        self.writer.queue(COMMANDS.set_id, 3, 200)
+        self.writer.queue(COMMANDS.heat_start, BROADCAST_ID, 7)
+        self.tick()
+        new_ids = [200 if transponder_id == 3 else 100 + transponder_id for transponder_id in range(16)]
+        expected = decoder.encode_command(COMMANDS.heat_start, BROADCAST_ID, 7) + b''.join(
+            decoder.encode_command(COMMANDS.set_id, transponder_id, new_id)
+            for transponder_id, new_id in enumerate(new_ids))
+        self.assertEqual(self.output.read(len(expected)), expected)
+        self.assertEqual(self.writer.stats(), {'writes': 1, 'coalesced': 1, 'queued': 0})
+        self.assertEqual(self.writer.latency.count, 1)
+
+
+
+class TestServer(SimpleTestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.channel_layer = ChannelLayer()
+        self.masters = {}
+        receivers = []
+        for name in ('start', 'sector'):
+            master, slave = pty.openpty()
+            self.addCleanup(os.close, slave)
+            self.masters[name] = master
+            receivers.append(Receiver(name, os.ttyname(slave), 115200))
+        self.server = Server(self.channel_layer, receivers, batch_interval=0.001, loop=self.loop)
+        self.open_ports = []
+        # Never hang the suite if the server fails to stop
+        self.loop.call_later(5, self.loop.stop)
+
+    def send(self, name, data):
+        os.write(self.masters[name], data)
+
+    def hang_up(self, name):
+        os.close(self.masters.pop(name))
+
+    def record_open_ports(self):
+        self.open_ports.append([receiver.name for receiver in self.server.receivers if receiver.port is not None])
+
+    def messages(self):
+        messages = []
+        while True:
+            channel, message = self.channel_layer.receive_many(['wireless.packet'])
+            if channel is None:
+                return messages
+            messages.append(message)
+
+    def test_reads_every_receiver_until_the_last_fails(self):
+        # Once the ports are open and in raw mode
+        self.loop.call_soon(self.send, 'start', encode_rw_detection(1, 0, 1000, 90))
+        self.loop.call_soon(self.send, 'sector', encode_rw_detection(2, 0, 2000, 60))
+        self.loop.call_later(0.2, self.hang_up, 'start')
+        self.loop.call_later(0.3, self.record_open_ports)
+        self.loop.call_later(0.4, self.hang_up, 'sector')
+        started = self.loop.time()
+        self.server.run()
+        self.assertLess(self.loop.time() - started, 5)
+        self.assertEqual(self.open_ports, [['sector']])
+        self.assertTrue(all(receiver.port is None for receiver in self.server.receivers))
+        packets = {}
+        for message in self.messages():
+            packets.setdefault(message['receiver'], []).extend(message['packets'])
+        self.assertEqual(packets, {
+            'start': [Detection(1, 0, 1000, 90)],
+            'sector': [Detection(2, 0, 2000, 60)],
+        })
+
+    def test_stops_when_a_port_fails_to_open(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.server.receivers.append(Receiver('missing', os.path.join(root, 'tty'), 115200))
+        with self.assertRaises(OSError):
+            self.server.run()
+        self.assertFalse(self.server.dispatcher.is_alive())
+        self.assertTrue(all(receiver.port is None for receiver in self.server.receivers))
+
+
+class TestIngestBenchmark(TestCase):
+
+    def test_fleet_reads_keep_every_frame(self):
+        receivers, reads = fleet_reads(TRACKER_TYPES.rw_transponder, count=2, laps=1, read_size=1000)
+        encode = get_decoder(TRACKER_TYPES.rw_transponder).encode
+        self.assertEqual(
+            b''.join(data for gate, wall, data in reads),
+            b''.join(encode(simulated.detection) for simulated in Fleet(2, laps=1, seed=1).detections()))
+
+    def test_runs_the_packet_consumer_and_rolls_back(self):
+        receivers, reads = fleet_reads(TRACKER_TYPES.rw_transponder, count=2, laps=3)
+        benchmark = IngestBenchmark(receivers, reads)
+        results = {result['stage']: result for result in benchmark.run()}
+        self.assertEqual(list(results), list(STAGES))
+        self.assertEqual(results['consume']['frames'], results['decode']['frames'])
+        self.assertGreater(benchmark.writer.written, 0)
+        self.assertFalse(HeatEvent.objects.exists())
+        self.assertFalse(Lap.objects.exists())
+
+
+class TestIngestLock(SimpleTestCase):
+
+    def test_only_one_holder(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        first, second = IngestLock(os.path.join(root, 'ingest.lock')), IngestLock(os.path.join(root, 'ingest.lock'))
+        self.assertTrue(first.acquire())
+        self.assertTrue(first.acquire())
+        self.assertFalse(second.acquire())
+        first.lock_file.close()
+        self.assertTrue(second.acquire())
+        second.lock_file.close()
+
+
+class TestHeatControl(TestCase):
+
+    def setUp(self):
+        self.heat = mommy.make(RaceHeat, started_time=now(), event__recurrences='')
+        self.tracker = mommy.make('trackers.Tracker', transponder_id=12)
+        self.channel_layer = ChannelLayer()
+        # Keep the writes on this thread so they happen inside the test's transaction
+        self.addCleanup(setattr, heat_events, 'interval', heat_events.interval)
+        heat_events.interval = None
+        self.addCleanup(live_heats.discard, self.heat)
+
+    def handle(self):
+        channel, content = self.channel_layer.receive_many([HEAT_CHANNEL])
+        heat_control(Message(content, channel, self.channel_layer))
+
+    def test_ends_heat_after_pending_events(self):
+        heat_events.add(HeatEvent(heat=self.heat, tracker=self.tracker, trigger=HeatEvent.TRIGGERS.gate.value))
+        ended_time = now()
+        self.heat.request_end(ended_time, self.channel_layer)
+        # Nothing happens until the ingest process handles the request
+        self.assertTrue(RaceHeat.objects.running().exists())
+        self.handle()
+        self.assertEqual(self.heat.triggered_events.count(), 1)
+        self.assertEqual(RaceHeat.objects.get(pk=self.heat.pk).ended_time, ended_time)
+
+    def test_triggers_reach_the_live_heat(self):
+        live = live_heats.get(self.heat)
+        self.heat.send_trigger(HeatEvent.TRIGGERS.crash.value, now(), self.tracker.pk, self.channel_layer)
+        self.handle()
+        self.assertTrue(live.trackers[self.tracker.pk].crashed)
+        ended_time = now()
+        self.heat.send_trigger(HeatEvent.TRIGGERS.ended.value, ended_time, channel_layer=self.channel_layer)
+        self.handle()
+        self.assertEqual(live.ended_time, ended_time)
+        self.assertEqual(self.heat.triggered_events.count(), 2)
+        self.assertEqual(RaceHeat.objects.get(pk=self.heat.pk).ended_time, ended_time)
+        self.assertIsNot(live_heats.get(self.heat), live)
+
+    def test_started_trigger_starts_a_staged_heat(self):
+        RaceHeat.objects.filter(pk=self.heat.pk).update(started_time=None, scheduled_time=now())
+        self.heat.refresh_from_db()
+        started_time = now()
+        self.heat.send_trigger(HeatEvent.TRIGGERS.started.value, started_time, channel_layer=self.channel_layer)
+        self.handle()
+        self.assertEqual(RaceHeat.objects.get(pk=self.heat.pk).started_time, started_time)
+
+    def test_changes_rebuild_the_live_heat(self):
+        live = live_heats.get(self.heat)
+        heat_events.add(HeatEvent(heat=self.heat, tracker=self.tracker, trigger=HeatEvent.TRIGGERS.gate.value))
+        self.heat.send_control({"changed": True}, self.channel_layer)
+        self.handle()
+        self.assertEqual(self.heat.triggered_events.count(), 1)
+        rebuilt = live_heats.get(self.heat)
+        self.assertIsNot(rebuilt, live)
+        self.assertIn(self.tracker.pk, rebuilt.trackers)
@@ -0,0 +1,78 @@
+"""
+Hashed timer wheel for the serial server's many long lived timers.
+
+Timers are hashed into a fixed ring of slots by the tick they are due on,
+scheduling and cancelling are O(1) and each tick only looks at the timers in
+one slot. The wheel is advanced from a single event loop callback, so
+keeping hundreds of reply channels alive costs no threads or sleeping tasks.
+"""
+
+import math
+import time
+
+
+class Timer(object):
+
+    __slots__ = ('tick', 'slot', 'callback', 'args', 'cancelled')
+
+    def __init__(self, tick, slot, callback, args):
+        self.tick = tick
+        self.slot = slot
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+
+class TimerWheel(object):
+    """
+    ``resolution`` is the length of a tick in seconds, timers fire on the
+    first tick at or after they are due. ``slots`` only needs to be large
+    enough that most timers are due within one turn of the wheel, later
+    ones are skipped over until the turn they are due on.
+    """
+
+    def __init__(self, resolution=0.5, slots=256, clock=time.monotonic):
+        self.resolution = resolution
+        self.slots = [set() for _ in range(slots)]
+        self.clock = clock
+        self.started = clock()
+        self.tick = 0
+
+    def __len__(self):
+        return sum(len(slot) for slot in self.slots)
+
+    def schedule(self, delay, callback, *args):
+        """
+        Call ``callback(*args)`` in ``delay`` seconds and return its Timer.
+        """
+        tick = self.tick + max(int(math.ceil(delay / self.resolution)), 1)
+        timer = Timer(tick, tick % len(self.slots), callback, args)
+        self.slots[timer.slot].add(timer)
+        return timer
+
+    def cancel(self, timer):
+        if timer is not None and not timer.cancelled:
+            timer.cancelled = True
+            self.slots[timer.slot].discard(timer)
+
+    def advance(self, now=None):
+        """
+        Fire every timer due up to ``now`` and return how many fired.
+        """
+        if now is None:
+            now = self.clock()
+        target = int((now - self.started) / self.resolution)
+        fired = 0
+        while self.tick < target:
+            self.tick += 1
+            slot = self.slots[self.tick % len(self.slots)]
+            due = [timer for timer in slot if timer.tick <= self.tick]
+            for timer in due:
+                slot.discard(timer)
+            for timer in due:
+                # An earlier callback this tick may have cancelled it
+                if not timer.cancelled:
+                    timer.cancelled = True
+                    timer.callback(*timer.args)
+                    fired += 1
+        return fired
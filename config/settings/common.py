@@ -59,6 +59,7 @@ LOCAL_APPS = (
     'base_station.events',  # race customization and configuration
     'base_station.races',  # state data and handling of an ongoing/past race.
     'base_station.wireless',  # channels communication layer for wireless module
+    'base_station.telemetry',  # storage of tracker telemetry
     'base_station.api',  # RESTful api
 )
 
@@ -246,9 +247,14 @@ ADMIN_URL = r'^admin/'
 
 # Your common stuff: Below this line define 3rd party library settings
 
+# The serial server, the heat scheduler and the ingest worker are separate processes, so the
+# wireless layer has to reach across them, an in-memory layer only exists inside one process
 CHANNEL_LAYERS = {
     "wireless": {
-        "BACKEND": "asgiref.inmemory.ChannelLayer",
+        "BACKEND": "asgi_redis.RedisChannelLayer",
+        "CONFIG": {
+            "hosts": ["{0}/{1}".format(env('REDIS_URL', default="redis://127.0.0.1:6379"), 1)],
+        },
         "ROUTING": "base_station.wireless.routing.channel_routing",
     },
 }
@@ -256,6 +262,40 @@ CHANNEL_LAYERS = {
 # Serial interface settings
 SERIAL_INTERFACE = "/dev/master"
 SERIAL_BAUD = 115200
+# Tracker hardware the receiver speaks to, see trackers.models.TRACKER_TYPES
+SERIAL_TRACKER_TYPE = "rw_transponder_v1"
+# Every receiver the serial server reads, add an entry per start/finish or sector gate
+SERIAL_RECEIVERS = [
+    {
+        "name": "start",
+        "interface": SERIAL_INTERFACE,
+        "baud": SERIAL_BAUD,
+        "tracker_type": SERIAL_TRACKER_TYPE,
+    },
+]
+# Channel layer the serial server sends wireless packets on
+SERIAL_CHANNEL_LAYER = "wireless"
+
+# HeatEvents are written in batches of this many or after waiting this many seconds
+HEAT_EVENT_BATCH_SIZE = 100
+HEAT_EVENT_FLUSH_INTERVAL = 0.05
+
+# Telemetry is stored in a file per heat and tracker under this directory, see base_station.telemetry.store
+TELEMETRY_ROOT = str(ROOT_DIR('telemetry'))
+# Samples of a tracker are written in chunks of this many or after waiting this many seconds
+TELEMETRY_CHUNK_SIZE = 256
+TELEMETRY_FLUSH_INTERVAL = 1.0
+# Live telemetry of running heats is shared between processes through ring files under this directory,
+# kept in memory rather than on the SD card, see base_station.telemetry.rings
+TELEMETRY_RING_ROOT = env('TELEMETRY_RING_ROOT', default='/dev/shm/base_station')
+# Trackers per heat and latest samples kept of each, about 16 seconds at 500 samples a second
+TELEMETRY_RING_SLOTS = 16
+TELEMETRY_RING_CAPACITY = 8192
+# Live telemetry is broadcast every this many seconds, the latest seconds of each tracker
+# downsampled to at most this many points, see base_station.telemetry.downsample
+TELEMETRY_FRAME_INTERVAL = 0.2
+TELEMETRY_FRAME_SECONDS = 5
+TELEMETRY_FRAME_POINTS = 150
 
 # webpack configuration
 WEBPACK_LOADER = {